@@ -0,0 +1,31 @@
+import io
+from typing import IO, BinaryIO
+
+def compress(data: bytes, compression_level: int = ..., block_size: int = ...,
+             content_checksum: bool = ..., block_linked: bool = ..., store_size: bool = ...,
+             return_bytearray: bool = ...) -> bytes: ...
+def decompress(data: bytes, return_bytearray: bool = ...,
+               return_bytes_read: bool = ...) -> bytes: ...
+
+class LZ4FrameCompressor:
+    def __init__(self, block_size: int = ..., block_linked: bool = True,
+                 compression_level: int = ..., content_checksum: bool = False,
+                 block_checksum: bool = False, auto_flush: bool = False,
+                 return_bytearray: bool = False) -> None: ...
+    def begin(self, source_size: int = 0) -> bytes: ...
+    def compress(self, data: bytes) -> bytes: ...
+    def flush(self) -> bytes: ...
+
+class LZ4FrameDecompressor:
+    eof: bool
+    needs_input: bool
+    unused_data: bytes | None
+    def __init__(self, return_bytearray: bool = False) -> None: ...
+    def decompress(self, data: bytes, max_length: int = -1) -> bytes: ...
+
+class LZ4FrameFile(io.BufferedIOBase, BinaryIO):
+    def __init__(self, filename: str | bytes | IO[bytes] | None = None, mode: str = "r",
+                 block_size: int = ..., block_linked: bool = True,
+                 compression_level: int = ..., content_checksum: bool = False,
+                 block_checksum: bool = False, auto_flush: bool = False,
+                 return_bytearray: bool = False, source_size: int = 0) -> None: ...
@@ -5,6 +5,8 @@ Pytest auto configuration.
 This module is run automatically by pytest to define and enable fixtures.
 """
 
+import logging
+import os
 import warnings
 
 import pytest
@@ -37,3 +39,32 @@ def set_warnings():
     default warning filter also provides checking of ResourceWarning:
     """
     warnings.simplefilter("default")
+
+
+def pytest_configure(config):
+    """Register the benchmark marker"""
+    config.addinivalue_line(
+        "markers", "benchmark: microbenchmark, only run if $XCP_BENCHMARKS is set"
+    )
+
+
+def pytest_collection_modifyitems(config, items):  # pylint: disable=unused-argument
+    """Skip the tests marked as benchmark unless $XCP_BENCHMARKS is set"""
+    if os.environ.get("XCP_BENCHMARKS"):
+        return
+    skip = pytest.mark.skip(reason="benchmark: set XCP_BENCHMARKS=1 to run it")
+    for item in items:
+        if "benchmark" in item.keywords:
+            item.add_marker(skip)
+
+
+@pytest.fixture
+def log_rate():
+    """Return a function to log the rate of a benchmark at INFO level"""
+
+    def log(what, count, unit, seconds):
+        # type: (str, int, str, float) -> None
+        logging.info("%s: %d %s in %.3fs: %.0f %s/s", what, count, unit, seconds,
+                     count / max(seconds, 1e-9), unit)
+
+    return log
@@ -1,5 +1,9 @@
+import errno
+import io
+import json
+import os
 import unittest
-from typing import TYPE_CHECKING
+from typing import IO, TYPE_CHECKING, cast
 
 import xcp.accessor
 
@@ -52,3 +56,115 @@ def test_access_handles_exception():
             raise IOError("Test Accessor.access returning False on Exception to cove code")
 
     assert AccessorHandlesException(True).access("filename") is False
+
+
+def test_access_metadata_cache():
+    class CountingAccessor(xcp.accessor.Accessor):
+        opened = []
+
+        def openAddress(self, address):
+            self.opened.append(address)
+            if address == "missing":
+                self.lastError = 404
+                return False
+            return io.BytesIO(b"data")
+
+    accessor = CountingAccessor(True)
+    accessor.metadata_ttl = 60
+    for _ in range(2):
+        assert accessor.access("filename")
+        assert not accessor.access("missing")
+        assert accessor.lastError == 404
+        accessor.lastError = 0
+    assert accessor.opened == ["filename", "missing"]
+
+    accessor.metadata_ttl = 0
+    accessor.invalidate("filename")
+    assert accessor.stat("filename") == (True, None, None, None)
+    assert accessor.access("filename")
+    assert accessor.access("filename")
+    assert accessor.opened == ["filename", "missing"] + ["filename"] * 3
+
+
+def test_copy_fileobj(tmp_path, monkeypatch):
+    """Test xcp.accessor.copy_fileobj() with regular files and other file objects"""
+    data = bytes(bytearray(range(256))) * 5000
+    (tmp_path / "source").write_bytes(data)
+    with open(str(tmp_path / "source"), "rb") as source:
+        source.read(1000)  # Copy the rest after the buffered position
+        with open(str(tmp_path / "copy"), "wb") as copy:
+            copy.write(b"head")
+            assert xcp.accessor.copy_fileobj(source, copy, fsync=True) == len(data) - 1000
+        assert source.read() == b""
+    assert (tmp_path / "copy").read_bytes() == b"head" + data[1000:]
+
+    # Without copy_file_range(), e.g. on an older kernel, os.sendfile() is used:
+    def copy_file_range(*args):
+        raise OSError(errno.EXDEV, "Invalid cross-device link")
+
+    monkeypatch.setattr(os, "copy_file_range", copy_file_range, raising=False)
+    with open(str(tmp_path / "source"), "rb") as source:
+        with open(str(tmp_path / "copy"), "wb") as copy:
+            assert xcp.accessor.copy_fileobj(source, copy) == len(data)
+    assert (tmp_path / "copy").read_bytes() == data
+
+    # File objects without file descriptors (and without readinto()) are copied in Python:
+    class Reader(object):
+        def __init__(self):
+            self.fileobj = io.BytesIO(data)
+
+        def read(self, size):
+            return self.fileobj.read(size)
+
+    for reader in (io.BytesIO(data), cast(IO[bytes], Reader())):
+        buffer = io.BytesIO()
+        assert xcp.accessor.copy_fileobj(reader, buffer) == len(data)
+        assert buffer.getvalue() == data
+
+
+def test_accessor_instrument(tmp_path, caplog):
+    """Test the AccessorStats collected by Accessor.instrument()"""
+    (tmp_path / "repo").mkdir()
+    (tmp_path / "repo" / "file").write_bytes(b"0123456789")
+    accessor = xcp.accessor.createAccessor("file://%s/repo/" % tmp_path, False)
+    assert isinstance(accessor, xcp.accessor.FileAccessor)
+    stats = accessor.instrument(log=True)
+    assert accessor.instrument() is stats
+
+    accessor.start()
+    assert accessor.access("file") and not accessor.access("missing")
+    assert not accessor.openAddress("missing")
+    filehandle = accessor.openAddress("file")
+    assert filehandle and [line for line in filehandle] == [b"0123456789"]
+    filehandle.close()
+    accessor.writeFile(io.BytesIO(b"written"), "written")
+    assert accessor.downloadFile("file", str(tmp_path / "downloaded"))
+    with caplog.at_level("INFO"):
+        accessor.finish()
+
+    snapshot = stats.snapshot()
+    assert snapshot["bytes_read"] == 20  # openAddress() and downloadFile() of "file"
+    assert snapshot["bytes_written"] == len(b"written") + 10
+    assert snapshot["errors"] == {"404": 2}
+    assert snapshot["calls"]["access"]["count"] == 2
+    assert snapshot["calls"]["openAddress"]["count"] == 5  # Including those of stat()
+    assert sum(snapshot["calls"]["stat"]["histogram"].values()) == 2
+    assert json.loads(caplog.records[-1].getMessage().split(": ", 1)[1]) == snapshot
+
+    # The HTTPAccessor reports the connections of its pool:
+    http = xcp.accessor.createAccessor("http://localhost/", True)
+    assert http and http.instrument().snapshot()["connections"].keys() == {"opened", "reused"}
+
+
+def test_metadata_cache_opt_in(tmp_path):
+    """Test that local accessors do not cache by default and writeFile() invalidates"""
+    accessor = xcp.accessor.createAccessor("file://%s/" % tmp_path, False)
+    assert isinstance(accessor, xcp.accessor.FileAccessor)
+    assert not accessor.access("file")
+    (tmp_path / "file").write_bytes(b"data")
+    assert accessor.access("file")
+
+    accessor.metadata_ttl = 60
+    assert not accessor.access("written")
+    accessor.writeFile(io.BytesIO(b"data"), "written")
+    assert accessor.stat("written") == (True, 4, (tmp_path / "written").stat().st_mtime, None)
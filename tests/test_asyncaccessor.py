@@ -0,0 +1,90 @@
+"""Test xcp.asyncaccessor.AsyncAccessor using the FileAccessor and a local HTTP/1.1 server"""
+import asyncio
+import threading
+import time
+from http.server import ThreadingHTTPServer
+
+import xcp.accessor
+import xcp.asyncaccessor
+
+from .test_httpaccessor import LARGE_DATA, UTF8TEXT_LITERAL, KeepAliveHandler
+
+
+def test_async_file_accessor(tmp_path):
+    """Test the methods of AsyncAccessor with a FileAccessor of tests/data/repo/"""
+    with open("tests/data/repo/.treeinfo", "rb") as dot_treeinfo:
+        reference_treeinfo = dot_treeinfo.read()
+
+    async def check_accessor():
+        async with xcp.asyncaccessor.createAsyncAccessor("file://tests/data/repo/", True) as access:
+            assert await access.access(".treeinfo")
+            assert not await access.access("no_such_file")
+            assert access.lastError == 404
+            assert await access.read_all(".treeinfo") == reference_treeinfo
+            assert await access.read_all("no_such_file") is False
+
+            async with await access.open_address(".treeinfo") as treeinfo:
+                assert await treeinfo.read(4) == reference_treeinfo[:4]
+                assert await treeinfo.read() == reference_treeinfo[4:]
+
+            assert await access.copy_to(".treeinfo", str(tmp_path / "treeinfo"))
+            assert (tmp_path / "treeinfo").read_bytes() == reference_treeinfo
+
+    asyncio.run(check_accessor())
+
+
+def test_async_concurrency():
+    """Assert that AsyncAccessor limits the number of concurrent calls"""
+
+    class SlowAccessor(xcp.accessor.Accessor):
+        running = 0
+        max_running = 0
+        lock = threading.Lock()
+
+        def access(self, name):
+            with self.lock:
+                self.running += 1
+                self.max_running = max(self.max_running, self.running)
+            time.sleep(0.01)
+            with self.lock:
+                self.running -= 1
+            return True
+
+    async def gather(accessor):
+        return await asyncio.gather(*(accessor.access(str(i)) for i in range(20)))
+
+    accessor = SlowAccessor(True)
+    assert asyncio.run(gather(xcp.asyncaccessor.AsyncAccessor(accessor, 3))) == [True] * 20
+    assert 1 < accessor.max_running <= 3
+
+    accessor = SlowAccessor(True)
+    accessor.threadsafe = False
+    asyncio.run(gather(xcp.asyncaccessor.AsyncAccessor(accessor, 3)))
+    assert accessor.max_running == 1
+
+
+def test_async_http_accessor():
+    """Fetch files concurrently using the keep-alive connections of the HTTPAccessor"""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), KeepAliveHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+
+    async def fetch():
+        url = "http://127.0.0.1:%d/" % server.server_address[1]
+        access = xcp.asyncaccessor.createAsyncAccessor(url, True, concurrency=4)
+        assert isinstance(access.accessor, xcp.accessor.HTTPAccessor)
+        access.accessor.pool = pool
+        requests = [access.read_all("textfile") for _ in range(8)]
+        return await asyncio.gather(access.read_all("large"), access.access("404"), *requests)
+
+    pool = xcp.accessor.HTTPConnectionPool()
+    try:
+        results = asyncio.run(fetch())
+    finally:
+        pool.clear()
+        server.shutdown()
+        server.server_close()
+        thread.join()
+    assert results == [LARGE_DATA, False] + [UTF8TEXT_LITERAL.encode("utf-8")] * 8
+    assert pool.opened <= 4 and pool.opened + pool.reused == 10
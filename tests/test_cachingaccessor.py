@@ -0,0 +1,96 @@
+"""Test xcp.accessor.CachingAccessor using a FileAccessor of a temporary directory"""
+import hashlib
+import os
+
+import xcp.accessor
+
+
+def caching_accessor(tmp_path, max_bytes):
+    # type: (os.PathLike[str], int) -> xcp.accessor.CachingAccessor
+    """Return a CachingAccessor of a FileAccessor for tmp_path/repo/"""
+    os.mkdir(os.path.join(tmp_path, "repo"))
+    accessor = xcp.accessor.createAccessor("file://%s/repo/" % tmp_path, True)
+    assert isinstance(accessor, xcp.accessor.FileAccessor)
+    accessor.metadata_ttl = 0
+    return xcp.accessor.CachingAccessor(accessor, os.path.join(tmp_path, "cache"), max_bytes)
+
+
+def read(accessor, address, md5sum=None):
+    # type: (xcp.accessor.CachingAccessor, str, str | None) -> bytes
+    filehandle = accessor.openAddress(address, md5sum)
+    assert filehandle
+    with filehandle:
+        return filehandle.read()
+
+
+def test_caching_accessor(tmp_path):
+    """Test the cache hits and misses and that changed files are read again"""
+    accessor = caching_accessor(tmp_path, 1024)
+    (tmp_path / "repo" / "XS-PACKAGES").write_bytes(b"packages")
+    assert read(accessor, "XS-PACKAGES") == b"packages"
+    assert read(accessor, "XS-PACKAGES") == b"packages"
+    assert (accessor.hits, accessor.misses) == (1, 1)
+
+    # A partial read does not add the file to the cache:
+    (tmp_path / "repo" / "partial").write_bytes(b"partial")
+    filehandle = accessor.openAddress("partial")
+    assert filehandle and filehandle.read(1) == b"p"
+    filehandle.close()
+    assert len(os.listdir(accessor.cache_dir)) == 1
+
+    # A changed file has a new mtime and size:
+    (tmp_path / "repo" / "XS-PACKAGES").write_bytes(b"new packages")
+    assert read(accessor, "XS-PACKAGES") == b"new packages"
+    assert (accessor.hits, accessor.misses) == (1, 3)
+    assert not accessor.openAddress("no_such_file")
+    assert accessor.lastError == 404
+    assert accessor.access("XS-PACKAGES") and not accessor.access("no_such_file")
+
+
+def test_caching_accessor_md5_and_lru(tmp_path):
+    """Test that files with a known md5sum are shared and that the LRU files are evicted"""
+    accessor = caching_accessor(tmp_path, 20)
+    for name in ("a.rpm", "b.rpm", "c.rpm", "copy-of-a.rpm"):
+        (tmp_path / "repo" / name).write_bytes(name[-5].encode() * 8)
+    md5a = hashlib.md5(b"a" * 8).hexdigest()
+
+    assert read(accessor, "a.rpm", md5a) == b"a" * 8
+    assert read(accessor, "copy-of-a.rpm", md5a) == b"a" * 8
+    assert (accessor.hits, accessor.misses) == (1, 1)
+
+    # A file with a wrong md5sum is not cached:
+    assert read(accessor, "b.rpm", md5a.replace(md5a[0], "x")) == b"b" * 8
+    assert sorted(os.listdir(accessor.cache_dir)) == ["md5-" + md5a]
+
+    # When adding c.rpm exceeds max_bytes, the least recently used b.rpm is evicted:
+    read(accessor, "b.rpm")
+    read(accessor, "a.rpm", md5a)
+    read(accessor, "c.rpm")
+    assert len(os.listdir(accessor.cache_dir)) == 2
+    assert "md5-" + md5a in os.listdir(accessor.cache_dir)
+    hits = accessor.hits
+    read(accessor, "c.rpm")
+    read(accessor, "b.rpm")
+    assert accessor.hits == hits + 1
+
+
+def test_caching_accessor_truncated_and_eviction(tmp_path, monkeypatch):
+    """Test that truncated reads are not cached and that evict() runs only when full"""
+    accessor = caching_accessor(tmp_path, 20)
+    evictions = []  # type: list[None]
+    evict = accessor.evict
+    monkeypatch.setattr(accessor, "evict", lambda: evictions.append(evict()))
+    stat = accessor.accessor.stat
+    # stat() reports 8 bytes, but the read ends after 4, like on a closed connection:
+    monkeypatch.setattr(accessor.accessor, "stat", lambda name: stat(name)._replace(size=8))
+    (tmp_path / "repo" / "truncated").write_bytes(b"comp")
+    assert read(accessor, "truncated") == b"comp"
+    assert not os.listdir(accessor.cache_dir)
+    monkeypatch.setattr(accessor.accessor, "stat", stat)
+
+    for name in ("a", "b", "c"):
+        (tmp_path / "repo" / name).write_bytes(name.encode() * 8)
+        assert read(accessor, name) == name.encode() * 8
+    # The first file scans the cache, only the third exceeds max_bytes:
+    assert len(evictions) == 2 and accessor.cached_bytes == 16
+    assert len(os.listdir(accessor.cache_dir)) == 2
@@ -5,15 +5,35 @@ types, opening the archive as stream and as file, using pyfakefs as filesystem w
 ever touching any real real file. pyfakefs was developed by Google and is in wide use.
 https://pytest-pyfakefs.readthedocs.io/en/latest/intro.html
 """
+import bz2
+import gzip
 import io
+import lzma
 import os
+import stat
+import struct
 import sys
-from typing import cast
+import tempfile
+import time
+import tracemalloc
+import zlib
+from typing import TYPE_CHECKING, Any, cast
 
 import pytest
 from pyfakefs.fake_filesystem import FakeFileOpen, FakeFilesystem
 
-from xcp.cpiofile import CpioFile, StreamError
+from xcp.cpiofile import (
+    CpioFile,
+    CpioInfo,
+    ExFileObject,
+    InitrdFile,
+    MmapExFileObject,
+    ReadError,
+    StreamError,
+)
+
+if TYPE_CHECKING:
+    from pathlib import Path
 
 binary_data = b"\x00\x1b\x5b\x95\xb1\xb2\xb3\xb4\xb5\xb6\xb7\xb8\xb9\xcc\xdd\xee\xff"
 
@@ -51,6 +71,30 @@ def test_cpiofile_modes(fs):
                 check_archive_mode(filetype + comp, fs, filename="archive." + comp)
 
 
+@pytest.mark.parametrize("comp, module", [("zst", "zstandard"), ("lz4", "lz4.frame")])
+def test_cpiofile_modes_optional(fs, comp, module):
+    # type: (FakeFilesystem, str, str) -> None
+    """
+    Test the modes for compression types that need optional modules, and that
+    archives using them are detected by the modes for transparent decompression.
+
+    :param fs: `FakeFilesystem` fixture representing a simulated file system for testing
+    :param comp: The compression type to test
+    :param module: The module needed by the compression type
+    """
+    pytest.importorskip(module)
+    for filetype in [":", "|"]:
+        check_archive_mode(filetype + comp, fs)
+        check_archive_mode(filetype + comp, fs, filename="archive." + comp)
+
+    cpiofile = cast(io.BytesIO, create_cpio_archive(fs, "|" + comp))
+    for mode in ["r", "r|*"]:
+        cpiofile.seek(0)
+        archive = CpioFile.open(fileobj=cpiofile, mode=mode)
+        assert archive.getnames() == ["dirname", "dirname/filename", "symlink", "dir2/file_2"]
+        archive.close()
+
+
 def create_cpio_archive(fs, archive_mode, filename=None):
     # type: (FakeFilesystem, str, str | None) -> io.BytesIO | None
     """
@@ -162,3 +206,503 @@ def pyfakefs_verify_filesystem(fs):
         assert contents.read() == binary_data
     with FakeFileOpen(fs)("dir2/file_2", "rb") as contents:
         assert contents.read() == binary_data
+
+
+def test_cpiofile_index(fs):
+    # type: (FakeFilesystem) -> None
+    """
+    Test that CpioFile.open(index=...) writes a member index after the first scan,
+    uses it for getmember() and extractfile() on the next open without scanning the
+    archive, and that a stale index is not used but rewritten.
+
+    :param fs: `FakeFilesystem` fixture representing a simulated file system for testing
+    """
+    create_cpio_archive(fs, ":", filename="archive.cpio")
+
+    archive = CpioFile.open("archive.cpio", "r:", index="archive.cpio.idx")
+    assert not archive._loaded  # pylint: disable=protected-access
+    assert archive.getmember("symlink").linkname == "dirname/filename"
+    archive.close()
+    assert fs.isfile("archive.cpio.idx")
+
+    archive = CpioFile.open("archive.cpio", "r:", index="archive.cpio.idx")
+    assert archive._loaded  # pylint: disable=protected-access
+    assert archive.getnames() == ["dirname", "dirname/filename", "symlink", "dir2/file_2"]
+    fileobj = archive.extractfile("symlink")
+    assert fileobj and fileobj.read() == binary_data
+    with pytest.raises(KeyError):
+        archive.getmember("missing")
+    archive.close()
+
+    # Appending a member changes the archive, so the index must not be used:
+    archive = CpioFile.open("archive.cpio", "a")
+    fs.create_file("file_3", contents=cast(str, binary_data))
+    archive.add("file_3")
+    archive.close()
+    archive = CpioFile.open("archive.cpio", "r:", index="archive.cpio.idx")
+    assert not archive._loaded  # pylint: disable=protected-access
+    assert archive.getnames()[-1] == "file_3"
+    archive.close()
+
+    archive = CpioFile.open("archive.cpio", "r:")
+    assert archive.load_index("archive.cpio.idx")
+    fileobj = archive.extractfile("file_3")
+    assert fileobj and fileobj.read() == binary_data
+    archive.close()
+
+    with pytest.raises(StreamError):
+        CpioFile.open("archive.cpio", "r|", index="archive.cpio.idx")
+
+
+def test_cpiofile_mmap(tmp_path, monkeypatch):
+    # type: (Path, pytest.MonkeyPatch) -> None
+    """
+    Test reading an archive using the memory-mapped "r:mmap" mode and accessing
+    the data of its members using read(), readinto() and getbuffer().
+
+    :param tmp_path: Temporary directory (mmap does not work with pyfakefs)
+    :param monkeypatch: Fixture to change to tmp_path for the duration of the test
+    """
+    monkeypatch.chdir(tmp_path)
+    with open("filename", "wb") as data_file:
+        data_file.write(binary_data)
+    os.symlink("filename", "symlink")
+    archive = CpioFile.open("archive.cpio", "w:")
+    archive.add("filename")
+    archive.add("symlink")
+    archive.close()
+
+    archive = CpioFile.open("archive.cpio", "r:mmap")
+    assert archive.getnames() == ["filename", "symlink"]
+    fileobj = cast(MmapExFileObject, archive.extractfile("symlink"))
+    assert isinstance(fileobj, MmapExFileObject)
+    assert fileobj.read(2) == binary_data[:2]
+    buf = bytearray(4)
+    assert fileobj.readinto(buf) == 4
+    assert buf == binary_data[2:6]
+    view = fileobj.getbuffer()
+    assert isinstance(view, memoryview) and view == binary_data
+    fileobj.close()
+    assert view.tobytes() == binary_data
+    view.release()
+
+    fileobj = cast(MmapExFileObject, archive.extractfile("filename"))
+    buf = bytearray(64)
+    assert fileobj.readinto(buf) == len(binary_data)
+    assert buf[: len(binary_data)] == binary_data
+    assert fileobj.readinto(buf) == 0
+    archive.close()
+
+    with pytest.raises(ValueError):
+        CpioFile.open("archive.cpio", "w:mmap")
+    with pytest.raises(ReadError):
+        CpioFile.open(fileobj=io.BytesIO(b"0" * 512), mode="r:mmap")
+
+
+@pytest.mark.parametrize("mode", ["w", "w:", "w|", "a", "r", "r:gz", "r|gz", "r:mmap"])
+def test_cpiofile_compresslevel_mode(mode):
+    # type: (str) -> None
+    """Check that compresslevel is rejected for the read, append and uncompressed modes"""
+    with pytest.raises(ValueError, match="compresslevel"):
+        CpioFile.open(fileobj=io.BytesIO(), mode=mode, compresslevel=1)
+
+
+@pytest.mark.parametrize("mode", ["r:", "r:mmap"])
+def test_cpiofile_extractall_workers(tmp_path, monkeypatch, mode):
+    # type: (Path, pytest.MonkeyPatch, str) -> None
+    """
+    Test extracting an archive using a pool of worker threads for regular files
+    and that directories, symlinks, hardlinks and their metadata are extracted.
+
+    :param tmp_path: Temporary directory (threads with pyfakefs are not supported)
+    :param monkeypatch: Fixture to change to tmp_path for the duration of the test
+    :param mode: The mode to open the archive for extraction
+    """
+    monkeypatch.chdir(tmp_path)
+    os.makedirs("src/dir/sub")
+    for i in range(32):
+        with open("src/dir/file_%d" % i, "wb") as data_file:
+            data_file.write(binary_data * i)
+        os.chmod("src/dir/file_%d" % i, 0o600 + i % 8)
+    os.link("src/dir/file_5", "src/dir/sub/hardlink")
+    os.symlink("file_7", "src/dir/symlink")
+    os.utime("src/dir/sub", (0, 0))
+    os.chdir("src")
+    archive = CpioFile.open("../archive.cpio", "w:")
+    archive.add("dir")
+    archive.close()
+    os.chdir("..")
+
+    archive = CpioFile.open("archive.cpio", mode)
+    archive.extractall("dst", workers=4)
+    archive.close()
+    for i in range(32):
+        with open("dst/dir/file_%d" % i, "rb") as data_file:
+            assert data_file.read() == binary_data * i
+        assert os.stat("dst/dir/file_%d" % i).st_mode & 0o777 == 0o600 + i % 8
+    assert os.path.samefile("dst/dir/file_5", "dst/dir/sub/hardlink")
+    assert os.readlink("dst/dir/symlink") == "file_7"
+    assert os.stat("dst/dir/sub").st_mtime == 0
+
+
+@pytest.mark.parametrize("comptype", ["gz", "bz2", "xz"])
+def test_cpiofile_stream_memory(comptype):
+    # type: (str) -> None
+    """
+    Test that reading a highly compressed member from a compressed stream with read()
+    and readinto() does not decompress much more than was requested at once.
+
+    :param comptype: The compression type of the stream
+    """
+    member_size = 32 * 1024 * 1024
+    archive_data = io.BytesIO()
+    archive = CpioFile.open(fileobj=archive_data, mode="w|" + comptype)
+    cpioinfo = CpioInfo("zeros")
+    cpioinfo.size = member_size
+    archive.addfile(cpioinfo, io.BytesIO(bytes(member_size)))
+    archive.close()
+    archive_data.seek(0)
+
+    tracemalloc.start()
+    archive = CpioFile.open(fileobj=archive_data, mode="r|" + comptype)
+    stream = archive.fileobj
+    fileobj = cast(ExFileObject, archive.extractfile(next(archive)))
+    size = len(fileobj.read(64 * 1024))
+    buf = bytearray(64 * 1024)
+    while size < member_size:
+        # Read the rest using _Stream.readinto(), which ExFileObject does not use:
+        count = stream.readinto(buf)
+        assert count and buf[:count] == bytes(count)
+        size += count
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    archive.close()
+    assert size == member_size
+    # The xz decompressor itself needs 8 MiB for the dictionary of the default preset:
+    assert peak < (10 if comptype == "xz" else 2) * 1024 * 1024
+
+
+@pytest.mark.parametrize("comptype", ["gz", "bz2", "xz"])
+def test_cpiofile_parallel_write(comptype):
+    # type: (str) -> None
+    """
+    Test writing an archive using workers which compress blocks into concatenated streams
+    that the stock decompressors and CpioFile read as one.
+
+    :param comptype: The compression type of the archive
+    """
+    members = {"file_%d" % i: os.urandom(1000) * (i + 1) for i in range(20)}
+    archive_data = io.BytesIO()
+    add_members(CpioFile.open(fileobj=archive_data, mode="w|"), members)
+    parallel_data = io.BytesIO()
+    archive = CpioFile.open(fileobj=parallel_data, mode="w|" + comptype,
+                            compresslevel=1, workers=3, blocksize=16 * 1024)
+    add_members(archive, members)
+
+    decompressor = {
+        "gz": lambda: zlib.decompressobj(16 + zlib.MAX_WBITS),
+        "bz2": bz2.BZ2Decompressor,
+        "xz": lzma.LZMADecompressor,
+    }[comptype]()  # type: Any
+    decompressor.decompress(parallel_data.getvalue())
+    assert decompressor.eof and decompressor.unused_data  # the first of many streams
+    decompress = {"gz": gzip.decompress, "bz2": bz2.decompress, "xz": lzma.decompress}
+    assert decompress[comptype](parallel_data.getvalue()) == archive_data.getvalue()
+
+    for mode in ("r|*", "r|" + comptype):
+        parallel_data.seek(0)
+        archive = CpioFile.open(fileobj=parallel_data, mode=mode)
+        for cpioinfo in archive:
+            assert cast(ExFileObject, archive.extractfile(cpioinfo)).read() == members[
+                cpioinfo.name
+            ]
+        assert archive.getnames() == list(members)
+        archive.close()
+
+
+def add_members(archive, members):
+    # type: (CpioFile, dict[str, bytes]) -> None
+    """Add regular files with the given names and contents to the archive and close it"""
+    for name, data in members.items():
+        cpioinfo = CpioInfo(name)
+        cpioinfo.size = len(data)
+        archive.addfile(cpioinfo, io.BytesIO(data))
+    archive.close()
+
+
+def test_initrdfile(tmp_path):
+    # type: (Path) -> None
+    """
+    Test reading an initrd of an early microcode archive, NUL padding and a compressed
+    main archive, and appending overlay segments with different compressions to it.
+
+    :param tmp_path: The path of a temporary directory for the initrd
+    """
+    initrd = str(tmp_path / "initrd.img")
+    with open(initrd, "wb") as f:
+        microcode = {"kernel/x86/microcode/GenuineIntel.bin": binary_data}
+        add_members(CpioFile.open(fileobj=f, mode="w|"), microcode)
+        f.write(b"\0" * 509)
+        main = {"init": b"#!/bin/sh\n", "etc/config": b"config" * 10000}
+        add_members(CpioFile.open(fileobj=f, mode="w|gz"), main)
+    with open(initrd, "rb") as f:
+        original = f.read()
+
+    for comptype in ("xz", "", "bz2"):
+        initrdfile = InitrdFile(initrd, "a")
+        add_members(initrdfile.addsegment(comptype), {"etc/config": comptype.encode()})
+        initrdfile.close()
+    with open(initrd, "rb") as f:
+        assert f.read(len(original)) == original
+
+    initrdfile = InitrdFile(initrd)
+    segments = initrdfile.getsegments()
+    assert [segment.comptype for segment in segments] == ["cpio", "gz", "xz", "cpio", "bz2"]
+    assert [segment.ismicrocode() for segment in segments] == [True] + [False] * 4
+    assert segments[1].offset == segments[0].size + 509
+    for previous, segment in zip(segments[1:], segments[2:]):
+        # Appended segments only have the padding to the next word boundary:
+        assert segment.offset == (previous.offset + previous.size + 3) & ~3
+    assert initrdfile.getnames() == list(microcode) + list(main) + ["etc/config"] * 3
+
+    # Like the kernel, later segments replace the files of earlier ones:
+    cpioinfo = initrdfile.getmember("etc/config")
+    assert initrdfile.getsegment(cpioinfo) is segments[-1]
+    assert cast(ExFileObject, initrdfile.extractfile(cpioinfo)).read() == b"bz2"
+    contents = list(microcode.values()) + list(main.values()) + [b"xz", b"", b"bz2"]
+    for cpioinfo, data in zip(initrdfile.getmembers(), contents):
+        assert cast(ExFileObject, initrdfile.extractfile(cpioinfo)).read() == data
+    with pytest.raises(KeyError):
+        initrdfile.getmember("missing")
+    with pytest.raises(IOError):
+        initrdfile.addsegment()
+    initrdfile.close()
+
+    with open(initrd, "ab") as f:
+        f.write(b"junk")
+    with pytest.raises(ReadError):
+        InitrdFile(initrd)
+
+
+def lz4_legacy_compress(data, blocksize):
+    # type: (bytes, int) -> bytes
+    """Compress data in the lz4 legacy format of `lz4 -l`, using blocks of blocksize"""
+    lz4_block = pytest.importorskip("lz4.block")
+    blocks = [b"\x02\x21\x4c\x18"]
+    for offset in range(0, len(data), blocksize):
+        block = lz4_block.compress(data[offset:offset + blocksize], store_size=False)
+        blocks.append(struct.pack("<L", len(block)) + block)
+    return b"".join(blocks)
+
+
+def test_cpiofile_lz4_legacy(tmp_path):
+    # type: (Path) -> None
+    """
+    Test reading archives and initrd segments in the lz4 legacy format of dracut
+    and the kernel, which has no end marker.
+
+    :param tmp_path: The path of a temporary directory for the initrd
+    """
+    main = {"init": b"#!/bin/sh\n", "etc/config": b"config" * 10000, "bin/sh": binary_data}
+    archive_data = io.BytesIO()
+    add_members(CpioFile.open(fileobj=archive_data, mode="w|"), main)
+    compressed = lz4_legacy_compress(archive_data.getvalue(), 16 * 1024)
+
+    for mode in ("r|lz4", "r|*", "r:lz4", "r"):
+        archive = CpioFile.open(fileobj=io.BytesIO(compressed), mode=mode)
+        for cpioinfo, data in zip(archive, main.values()):
+            assert cast(ExFileObject, archive.extractfile(cpioinfo)).read() == data
+        archive.close()
+    archive = CpioFile.open(fileobj=io.BytesIO(compressed), mode="r:lz4")
+    for name in reversed(list(main)):  # seeking backwards decompresses from the start
+        assert cast(ExFileObject, archive.extractfile(name)).read() == main[name]
+    archive.close()
+
+    initrd = str(tmp_path / "initrd.img")
+    with open(initrd, "wb") as f:
+        microcode = {"kernel/x86/microcode/AuthenticAMD.bin": binary_data}
+        add_members(CpioFile.open(fileobj=f, mode="w|"), microcode)
+        f.write(compressed + b"\0" * 512)
+    initrdfile = InitrdFile(initrd)
+    assert [segment.comptype for segment in initrdfile.getsegments()] == ["cpio", "lz4"]
+    assert initrdfile.getsegments()[1].size == len(compressed)
+    for name, data in main.items():
+        assert cast(ExFileObject, initrdfile.extractfile(name)).read() == data
+    initrdfile.close()
+
+
+def test_cpiofile_dedup_reproducible(tmp_path, monkeypatch):
+    # type: (Path, pytest.MonkeyPatch) -> None
+    """
+    Test that the dedup option adds files with the same content as hard links to the
+    first one, and that the reproducible option creates the same archive from a tree
+    with different mtimes.
+
+    :param tmp_path: The path of a temporary directory for the tree and the archives
+    :param monkeypatch: The fixture to change the directory and $SOURCE_DATE_EPOCH
+    """
+    monkeypatch.chdir(tmp_path)
+    os.makedirs("tree/sub")
+    for name, data, mode in [
+        ("tree/firmware.bin", binary_data * 100, 0o644),
+        ("tree/sub/firmware.bin", binary_data * 100, 0o644),
+        ("tree/sub/executable", binary_data * 100, 0o755),  # differs in mode
+        ("tree/module.ko", b"module", 0o644),
+    ]:
+        with open(name, "wb") as f:
+            f.write(data)
+        os.chmod(name, mode)
+    os.link("tree/module.ko", "tree/sub/module.ko")
+
+    def create_archive(mode):
+        # type: (str) -> bytes
+        archive_data = io.BytesIO()
+        archive = CpioFile.open(fileobj=archive_data, mode=mode)
+        archive.dedup = archive.reproducible = True
+        archive.add("tree")
+        archive.close()
+        return archive_data.getvalue()
+
+    monkeypatch.setenv("SOURCE_DATE_EPOCH", "1700000000")
+    archive_data = create_archive("w|")
+    assert len(archive_data) < 3 * len(binary_data * 100)
+    os.utime("tree/firmware.bin", (0, 1800000000))
+    assert create_archive("w|") == archive_data
+    assert create_archive("w|gz")[4:8] == b"\x00\xf1\x53\x65"  # SOURCE_DATE_EPOCH
+
+    archive = CpioFile.open(fileobj=io.BytesIO(archive_data), mode="r:")
+    assert archive.getnames() == [
+        "tree", "tree/firmware.bin", "tree/module.ko", "tree/sub",
+        "tree/sub/executable", "tree/sub/firmware.bin", "tree/sub/module.ko",
+    ]
+    members = {cpioinfo.name: cpioinfo for cpioinfo in archive}
+    assert [cpioinfo.ino for cpioinfo in archive] == [1, 2, 3, 4, 5, 2, 3]
+    assert {cpioinfo.mtime for cpioinfo in archive} == {1700000000}
+    assert members["tree/sub/firmware.bin"].size == 0
+    assert members["tree/sub/executable"].size == len(binary_data * 100)
+    duplicate = cast(ExFileObject, archive.extractfile("tree/sub/firmware.bin"))
+    assert duplicate.read() == binary_data * 100
+
+    archive.extractall("dst")
+    assert os.path.samefile("dst/tree/firmware.bin", "dst/tree/sub/firmware.bin")
+    assert os.path.samefile("dst/tree/module.ko", "dst/tree/sub/module.ko")
+    assert not os.path.samefile("dst/tree/firmware.bin", "dst/tree/sub/executable")
+    with open("dst/tree/sub/firmware.bin", "rb") as extracted:
+        assert extracted.read() == binary_data * 100
+
+
+@pytest.mark.parametrize("mode", ["w|gz", "w:gz"])
+def test_cpiofile_reproducible_gzip(monkeypatch, mode):
+    # type: (pytest.MonkeyPatch, str) -> None
+    """
+    Test that open(reproducible=True) writes the same gzip archive at different times
+    when $SOURCE_DATE_EPOCH is not set.
+
+    :param monkeypatch: The fixture to unset $SOURCE_DATE_EPOCH and to change the time
+    :param mode: The mode of the archive
+    """
+    monkeypatch.delenv("SOURCE_DATE_EPOCH", raising=False)
+
+    def create_archive(now):
+        # type: (float) -> bytes
+        monkeypatch.setattr(time, "time", lambda: now)
+        archive_data = io.BytesIO()
+        archive = CpioFile.open(fileobj=archive_data, mode=mode, reproducible=True)
+        assert archive.reproducible
+        cpioinfo = CpioInfo("filename")
+        cpioinfo.size = len(binary_data)
+        cpioinfo.mtime = int(now)
+        archive.addfile(cpioinfo, io.BytesIO(binary_data))
+        archive.close()
+        return archive_data.getvalue()
+
+    archive_data = create_archive(1700000000)
+    assert archive_data[4:8] == b"\0\0\0\0"  # the mtime of the gzip header
+    assert create_archive(1800000000) == archive_data
+
+
+def test_cpiofile_dedup_unseekable(monkeypatch):
+    # type: (pytest.MonkeyPatch) -> None
+    """
+    Test that dedup closes the temporary copies of unseekable file objects,
+    also when the file object ends before cpioinfo.size bytes.
+
+    :param monkeypatch: The fixture to record the temporary copies
+    """
+    copies = []
+    spooled_file = tempfile.SpooledTemporaryFile
+
+    def record_copy(*args, **kwargs):
+        copies.append(spooled_file(*args, **kwargs))
+        return copies[-1]
+
+    monkeypatch.setattr(tempfile, "SpooledTemporaryFile", record_copy)
+
+    class Unseekable(io.BytesIO):
+        def seekable(self):
+            return False
+
+    archive_data = io.BytesIO()
+    archive = CpioFile.open(fileobj=archive_data, mode="w|")
+    archive.dedup = True
+    for name in ("first", "second"):
+        cpioinfo = CpioInfo(name)
+        cpioinfo.size = len(binary_data)
+        archive.addfile(cpioinfo, Unseekable(binary_data))
+    cpioinfo = CpioInfo("truncated")
+    cpioinfo.size = len(binary_data) + 1
+    with pytest.raises(IOError):
+        archive.addfile(cpioinfo, Unseekable(binary_data))
+    archive.close()
+    assert len(copies) == 3 and all(copy.closed for copy in copies)
+
+    archive = CpioFile.open(fileobj=io.BytesIO(archive_data.getvalue()), mode="r:")
+    assert archive.getnames() == ["first", "second"]
+    second = cast(ExFileObject, archive.extractfile("second"))
+    assert second.read() == binary_data
+
+
+def test_cpiofile_extractfile_links():
+    # type: () -> None
+    """
+    Test that extractfile() resolves chains of symbolic links, symbolic links to
+    directories in their paths and hard links through the index of the members.
+    """
+    archive_data = io.BytesIO()
+    archive = CpioFile.open(fileobj=archive_data, mode="w|")
+    for name, mode, data in [
+        ("usr", stat.S_IFDIR | 0o755, b""),
+        ("usr/lib", stat.S_IFDIR | 0o755, b""),
+        ("lib", stat.S_IFLNK | 0o777, b"usr/lib"),  # merged /usr
+        ("usr/lib/libc.so.6", stat.S_IFREG | 0o755, binary_data),
+        ("usr/lib/libc.so", stat.S_IFLNK | 0o777, b"libc.so.6"),
+        ("bin", stat.S_IFLNK | 0o777, b"/usr/../bin2"),
+        ("bin2", stat.S_IFDIR | 0o755, b""),
+        ("bin2/sh", stat.S_IFLNK | 0o777, b"../lib/libc.so"),
+        ("loop", stat.S_IFLNK | 0o777, b"loop"),
+        ("dangling", stat.S_IFLNK | 0o777, b"lib/missing"),
+        ("dir", stat.S_IFLNK | 0o777, b"./usr/"),
+        ("sh", stat.S_IFLNK | 0o777, b"bin/sh"),
+    ]:
+        cpioinfo = CpioInfo(name)
+        cpioinfo.mode = mode
+        cpioinfo.size = len(data)
+        archive.addfile(cpioinfo, io.BytesIO(data))
+    archive.hardlinks = False  # add the data of hard links like GNU cpio, to the last link:
+    cpioinfo = CpioInfo("usr/lib/libc-copy")
+    cpioinfo.ino = cpioinfo.nlink = 2
+    archive.addfile(cpioinfo)
+    cpioinfo.name = "usr/lib/libc-copy2"
+    cpioinfo.size = len(binary_data)
+    archive.addfile(cpioinfo, io.BytesIO(binary_data))
+    archive.close()
+
+    archive_data.seek(0)
+    archive = CpioFile.open(fileobj=archive_data, mode="r:")
+    for name in ("usr/lib/libc.so", "sh", "usr/lib/libc-copy", "usr/lib/libc-copy2"):
+        assert cast(ExFileObject, archive.extractfile(name)).read() == binary_data
+    assert archive.extractfile("dir") is None
+    assert archive.extractfile("bin") is None
+    for name in ("loop", "dangling"):
+        with pytest.raises(KeyError):
+            archive.extractfile(name)
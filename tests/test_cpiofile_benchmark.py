@@ -0,0 +1,225 @@
+"""
+Microbenchmarks of xcp.cpiofile which also check the results of the benchmarked code.
+
+The benchmarks are skipped unless XCP_BENCHMARKS is set. The rates are logged at INFO
+level (shown by pytest's live logging). The size of the benchmarks can be increased
+using environment variables, e.g.:
+
+XCP_BENCHMARKS=1 CPIO_BENCH_MEMBERS=200000 CPIO_BENCH_STREAM_MIB=1024 \
+    pytest tests/test_cpiofile_benchmark.py
+"""
+import io
+import os
+import time
+from typing import Callable, cast
+
+import pytest
+
+from xcp.cpiofile import BLOCKSIZE, CpioFile, CpioInfo, ExFileObject, _Stream
+
+BENCH_MEMBERS = int(os.environ.get("CPIO_BENCH_MEMBERS", "20000"))
+BENCH_STREAM_MIB = int(os.environ.get("CPIO_BENCH_STREAM_MIB", "4"))
+
+pytestmark = pytest.mark.benchmark
+
+
+def test_cpioinfo_header_codec(log_rate):
+    # type: (Callable[..., None]) -> None
+    """Benchmark CpioInfo.tobuf() and CpioInfo.frombuf() on newc headers"""
+    cpioinfo = CpioInfo("lib/modules/6.6.0/kernel/drivers/net/ethernet/driver.ko")
+    cpioinfo.ino = 0x1234
+    cpioinfo.mode = 0o100644
+    cpioinfo.size = 0x56789
+
+    start = time.time()
+    for _ in range(BENCH_MEMBERS):
+        buf = cpioinfo.tobuf()
+    log_rate("CpioInfo.tobuf()", BENCH_MEMBERS, "headers", time.time() - start)
+
+    start = time.time()
+    for _ in range(BENCH_MEMBERS):
+        decoded = CpioInfo.frombuf(buf)
+    log_rate("CpioInfo.frombuf()", BENCH_MEMBERS, "headers", time.time() - start)
+    assert (decoded.ino, decoded.mode, decoded.size) == (0x1234, 0o100644, 0x56789)
+    assert decoded.namesize == len(cpioinfo.name) + 1
+
+
+def test_cpiofile_write_and_list(log_rate):
+    # type: (Callable[..., None]) -> None
+    """Benchmark writing and listing an archive of BENCH_MEMBERS empty files"""
+    archive_data = io.BytesIO()
+    start = time.time()
+    archive = CpioFile.open(fileobj=archive_data, mode="w")
+    for i in range(BENCH_MEMBERS):
+        cpioinfo = CpioInfo("usr/lib/firmware/file_%d" % i)
+        cpioinfo.ino = i + 1
+        archive.addfile(cpioinfo)
+    archive.close()
+    log_rate("CpioFile.addfile()", BENCH_MEMBERS, "headers", time.time() - start)
+
+    archive_data.seek(0)
+    start = time.time()
+    archive = CpioFile.open(fileobj=archive_data, mode="r:")
+    members = archive.getmembers()
+    log_rate("CpioFile.getmembers()", BENCH_MEMBERS, "headers", time.time() - start)
+    assert len(members) == BENCH_MEMBERS
+    assert members[-1].name == "usr/lib/firmware/file_%d" % (BENCH_MEMBERS - 1)
+
+
+def create_stream_archive(comptype, mib):
+    # type: (str, int) -> io.BytesIO
+    """Return a compressed archive of mib MiB of compressible members of 256 KiB"""
+    archive_data = io.BytesIO()
+    archive = CpioFile.open(fileobj=archive_data, mode="w|" + comptype)
+    for i in range(mib * 4):
+        data = b"".join(b"module-%d block-%d\n" % (i, block) for block in range(16000))
+        cpioinfo = CpioInfo("lib/modules/module_%d.ko" % i)
+        cpioinfo.size = 256 * 1024
+        archive.addfile(cpioinfo, io.BytesIO(data))
+    archive.close()
+    archive_data.seek(0)
+    return archive_data
+
+
+class _PreviousStream(_Stream):
+    """
+    _Stream with the read buffering it had before it used bytearrays: The buffers
+    were rebuilt using b"".join() and slicing on every read, and the compressed
+    data was decompressed without a max_length. Used as the baseline of the
+    stream read benchmark.
+    """
+
+    def seek(self, pos=0):
+        blocks, remainder = divmod(pos - self.pos, self.bufsize)
+        for _ in range(blocks):
+            self.read(self.bufsize)
+        self.read(remainder)
+        return self.pos
+
+    def readinto(self, b):
+        data = self.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+    def _read(self, size):
+        c = len(self.dbuf)
+        t = [bytes(self.dbuf)]
+        while c < size:
+            buf = self._Stream__read(self.bufsize)
+            if not buf:
+                break
+            buf = self.cmp.decompress(buf)
+            t.append(buf)
+            c += len(buf)
+        data = b"".join(t)
+        self.dbuf = data[size:]
+        return data[:size]
+
+    def _Stream__read(self, size):
+        c = len(self.buf)
+        t = [bytes(self.buf)]
+        while c < size:
+            buf = self.fileobj.read(self.bufsize)
+            if not buf:
+                break
+            t.append(buf)
+            c += len(buf)
+        data = b"".join(t)
+        self.buf = data[size:]
+        return data[:size]
+
+
+def read_members(archive):
+    # type: (CpioFile) -> int
+    """Read all members of the archive in chunks of 64 KiB and return their total size"""
+    size = 0
+    for cpioinfo in archive:
+        fileobj = archive.extractfile(cpioinfo)
+        assert fileobj
+        while True:
+            chunk = fileobj.read(64 * 1024)
+            if not chunk:
+                break
+            size += len(chunk)
+    archive.close()
+    return size
+
+
+@pytest.mark.parametrize("comptype", ["gz", "bz2", "xz"])
+def test_cpiofile_stream_read(comptype, log_rate):
+    # type: (str, Callable[..., None]) -> None
+    """
+    Benchmark reading all members of a compressed archive as a stream (r|gz, etc),
+    compared with the previous buffering of _Stream, and with the seekable file
+    objects of the Python library (r:gz).
+    """
+    archive_data = create_stream_archive(comptype, BENCH_STREAM_MIB)
+    expected = BENCH_STREAM_MIB * 1024 * 1024
+
+    archive_data.seek(0)
+    start = time.time()
+    stream = _PreviousStream(None, "r", comptype, archive_data, 20 * BLOCKSIZE)
+    size = read_members(CpioFile(None, "r", stream))
+    log_rate("previous _Stream (mode=%r)" % ("r|" + comptype), size // 1024 // 1024,
+             "MiB", time.time() - start)
+    assert size == expected
+
+    modes = ["r|" + comptype]
+    if comptype != "xz":  # xzopen() does not support fileobj
+        modes.append("r:" + comptype)
+    for mode in modes:
+        archive_data.seek(0)
+        start = time.time()
+        size = read_members(CpioFile.open(fileobj=archive_data, mode=mode))
+        log_rate("CpioFile.open(mode=%r)" % mode, size // 1024 // 1024, "MiB",
+                 time.time() - start)
+        assert size == expected
+
+
+@pytest.mark.parametrize("comptype", ["gz", "bz2"])
+def test_cpiofile_parallel_write(comptype, log_rate):
+    # type: (str, Callable[..., None]) -> None
+    """Benchmark writing a compressed archive with _Stream and with a worker per CPU"""
+    archive = CpioFile.open(fileobj=create_stream_archive("", BENCH_STREAM_MIB), mode="r:")
+    members = [(cpioinfo, cast(ExFileObject, archive.extractfile(cpioinfo)).read())
+               for cpioinfo in archive]
+    for workers in (1, max(os.cpu_count() or 1, 2)):
+        start = time.time()
+        archive = CpioFile.open(fileobj=io.BytesIO(), mode="w|" + comptype, workers=workers)
+        for cpioinfo, data in members:
+            archive.addfile(cpioinfo, io.BytesIO(data))
+        archive.close()
+        log_rate("CpioFile.open(mode=%r, workers=%d)" % ("w|" + comptype, workers),
+                 BENCH_STREAM_MIB, "MiB", time.time() - start)
+
+
+def test_cpiofile_extractfile_links(log_rate):
+    # type: (Callable[..., None]) -> None
+    """Benchmark extractfile() on the hard links and symbolic links of an archive"""
+    count = BENCH_MEMBERS // 4
+    archive_data = io.BytesIO()
+    archive = CpioFile.open(fileobj=archive_data, mode="w|")
+    for i in range(count):
+        cpioinfo = CpioInfo("lib/modules/kabi-1/module_%d.ko" % i)
+        cpioinfo.ino = i + 1
+        cpioinfo.nlink = 2
+        cpioinfo.size = 8
+        archive.addfile(cpioinfo, io.BytesIO(b"%08d" % i))
+        cpioinfo.name = "lib/modules/kabi-2/module_%d.ko" % i  # hard link
+        archive.addfile(cpioinfo)
+    for i in range(count):
+        cpioinfo = CpioInfo("lib/modules/current/module_%d.ko" % i)
+        cpioinfo.mode = 0o120777
+        cpioinfo.size = len("../kabi-2/module_%d.ko" % i)
+        archive.addfile(cpioinfo, io.BytesIO(b"../kabi-2/module_%d.ko" % i))
+    archive.close()
+
+    archive_data.seek(0)
+    archive = CpioFile.open(fileobj=archive_data, mode="r:")
+    members = archive.getmembers()
+    for what, links in (("hard links", members[1:2 * count:2]),
+                        ("symbolic links", members[2 * count:])):
+        start = time.time()
+        for i, cpioinfo in enumerate(links):
+            assert cast(ExFileObject, archive.extractfile(cpioinfo)).read() == b"%08d" % i
+        log_rate("CpioFile.extractfile() of %s" % what, count, "links", time.time() - start)
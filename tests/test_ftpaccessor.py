@@ -18,6 +18,9 @@ asserts, by implementing the tests using pytest is a lot easer. The plain assert
 a pleasure to use. This is the result of these lessons learnt.
 """
 import ftplib
+import socket
+import threading
+import time
 from io import BytesIO
 
 import pytest
@@ -48,20 +51,39 @@ def ftpserver_content(ftpserver, path):
     return next(ftp_content_generator)["content"]
 
 
+def wait_for_ftpserver(ftpserver, timeout=10.0):
+    """
+    Wait until the ftpserver accepts connections: Its thread calls listen() on the socket,
+    so connecting right after creating the fixture can fail with ConnectionRefusedError.
+    """
+    deadline = time.time() + timeout
+    while True:
+        try:
+            socket.create_connection(("localhost", ftpserver.server_port), timeout=1).close()
+            return
+        except ConnectionRefusedError:
+            if time.time() > deadline:
+                raise
+            time.sleep(0.01)
+
+
 @pytest.fixture
 def ftp_accessor(ftpserver):
     upload = {"src": "tests/test_ftpaccessor.py", "dest": "testdir/dummy-file-to-create-testdir"}
     ftpserver.put_files(upload, anon=False, overwrite=True)
     url = ftpserver.get_login_data(style="url", anon=False)
+    wait_for_ftpserver(ftpserver)
 
     accessor = xcp.accessor.FTPAccessor(url + "/testdir", False)
+    accessor.pool = xcp.accessor.FTPSessionPool()
     accessor.start()
     upload_binary_file(ftpserver, accessor)
     upload_textfile(ftpserver, accessor)
     # This leaves ftp_accessor.finish() to each test to because disconnecting from the
     # ftpserver after the test in the fixture would cause the formatting of the pytest
     # live log to be become less readable:
-    return accessor
+    yield accessor
+    accessor.pool.clear()
 
 
 # pylint: disable=redefined-outer-name  # The argument ftp_accessor is the fixture above
@@ -94,3 +116,65 @@ def test_download_textfile(ftp_accessor):
     with ftp_accessor.openText("textfile") as remote_ftp_filehandle:
         assert remote_ftp_filehandle.read() == text_data
     ftp_accessor.finish()
+
+
+def test_stat(ftp_accessor):
+    """Check the metadata of FTPAccessor.stat() from MLST and that it is cached"""
+    info = ftp_accessor.stat("filename")
+    assert info.exists and info.size == len(binary_data) and info.mtime
+    assert ftp_accessor.stat("filename") is info
+    assert not ftp_accessor.stat("no_such_file").exists
+    assert ftp_accessor.lastError == 500
+    ftp_accessor.finish()
+
+
+def test_session_pool(ftp_accessor):
+    """Check that sessions are reused over start()/finish() and allow concurrent transfers"""
+    ftp_accessor.finish()
+    for _ in range(2):
+        ftp_accessor.start()
+        with ftp_accessor.openAddress("filename") as binary_file:
+            with ftp_accessor.openText("textfile") as text_file:
+                assert text_file.read() == text_data
+            assert binary_file.read() == binary_data
+        ftp_accessor.finish()
+    assert ftp_accessor.pool.opened == 2  # One for each of the concurrent transfers
+
+    # An incomplete transfer closes its session:
+    with ftp_accessor.openAddress("filename") as binary_file:
+        assert binary_file.read(1) == binary_data[:1]
+    assert len(ftp_accessor.pool.idle[ftp_accessor.session_key]) == 1
+
+
+def test_session_reaping(ftp_accessor):
+    """Check that start()/finish() are thread-safe and that idle sessions are reaped"""
+    ftp_accessor.finish()
+    threads = [threading.Thread(target=ftp_accessor.start) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert ftp_accessor.start_count == 8
+    for _ in range(8):
+        ftp_accessor.finish()
+    assert ftp_accessor.start_count == 0
+    assert ftp_accessor.pool.idle[ftp_accessor.session_key]
+
+    # Sessions idle for longer than idle_timeout are logged out, not handed back out:
+    ftp_accessor.pool.idle_timeout = 0
+    ftp_accessor.start()
+    ftp_accessor.finish()
+    assert ftp_accessor.session_key not in ftp_accessor.pool.idle
+    assert ftp_accessor.pool.opened == 2
+
+
+def test_listing_cache(ftp_accessor):
+    """Check that stat() answers the files of a directory from one MLSD listing"""
+    ftp_accessor.invalidate()
+    assert ftp_accessor.stat("textfile").size == len(ensure_binary(text_data))
+    assert list(ftp_accessor.listings) == [""]
+    ftp_accessor.listings[""][1]["cached"] = {"size": "1", "modify": "20260101000000"}
+    assert ftp_accessor.stat("cached") == (True, 1, 1767225600, None)
+    ftp_accessor.writeFile(BytesIO(b"new"), "cached")
+    assert not ftp_accessor.listings and ftp_accessor.stat("cached").size == 3
+    ftp_accessor.finish()
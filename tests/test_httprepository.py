@@ -48,3 +48,7 @@ class HTTPRepositoryTestCase(HTTPServerTestCase):
             assert BaseRepository.getRepoVer(access=httpaccessor) == Version(ver=[3, 2, 1])
             assert BaseRepository.getProductVersion(access=httpaccessor) == Version(ver=[8, 2, 1])
             assert len(BaseRepository.findRepositories(access=httpaccessor)) == 6
+            repos = BaseRepository.findRepositories(access=httpaccessor, workers=4)
+            assert [repo.base for repo in repos[1:]] == [
+                "", "packages", "packages.main", "packages.linux", "packages.site"
+            ]
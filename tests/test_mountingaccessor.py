@@ -8,6 +8,7 @@ from pyfakefs.fake_filesystem import FakeFileOpen, FakeFilesystem
 
 import xcp.accessor
 import xcp.mount
+import xcp.repository
 
 from .test_httpaccessor import UTF8TEXT_LITERAL
 
@@ -144,3 +145,113 @@ def open_text(accessor, location, fs, text):
         assert not isinstance(textfile, bool)
         fs.remove(path)
         return textfile.read()
+
+
+def test_mount_registry(fs, fp):
+    # type: (FakeFilesystem, FakeProcess) -> None
+    """Test that accessors of the same source share the mount of the xcp.mount.registry"""
+    # The superblock of /dev/device has the ext magic: Mount it only as ext3:
+    fs.create_file("/dev/device", contents=b"\0" * 0x438 + b"\x53\xef" + b"\0" * 0x8000)
+    assert xcp.mount.probe_fstype("/dev/device") == "ext"
+    expect(fp, [b"/bin/mount", b"-t", b"ext3", b"-o", b"ro", b"/dev/device", b"/tmp"])
+    accessors = [xcp.accessor.DeviceAccessor("/dev/device", True) for _ in range(2)]
+    with patch("tempfile.mkdtemp") as tempfile_mkdtemp:
+        tempfile_mkdtemp.return_value = "/tmp"
+        for accessor in accessors:
+            accessor.start()
+    assert accessors[0].location == accessors[1].location == "/tmp"
+    assert fp.call_count([b"/bin/mount", fp.any()]) == 1  # type: ignore[list-item]
+
+    # With idle_grace, the unused mount is kept for reuse until it expires or is flushed:
+    registry = xcp.mount.registry
+    registry.idle_grace = 60
+    try:
+        accessors[0].finish()
+        accessors[1].finish()
+        assert registry.mounts
+        accessors[0].start()
+        accessors[0].finish()
+        assert fp.call_count([b"/bin/mount", fp.any()]) == 1  # type: ignore[list-item]
+
+        fp.register_subprocess([b"/bin/umount", b"-d", b"/tmp"])  # type: ignore[list-item]
+        registry.flush()
+        assert not registry.mounts and not fs.exists("/tmp")
+    finally:
+        registry.idle_grace = 0
+
+
+def test_mount_registry_busy(fs, fp):
+    # type: (FakeFilesystem, FakeProcess) -> None
+    """Test that a mount which fails to unmount (e.g. busy) stays registered"""
+    expect(fp, [b"/bin/mount", b"-t", b"iso9660", b"-o", b"ro", b"/dev/device", b"/tmp"])
+    accessor = xcp.accessor.DeviceAccessor("/dev/device", True)
+    with patch("tempfile.mkdtemp") as tempfile_mkdtemp:
+        tempfile_mkdtemp.return_value = "/tmp"
+        accessor.start()
+    fs.create_file("/tmp/open_file")
+
+    umount = [b"/bin/umount", b"-d", b"/tmp"]
+    fp.register_subprocess(umount, returncode=32)  # type: ignore[arg-type]
+    accessor.finish()  # must not raise
+    registry = xcp.mount.registry
+    assert len(registry.mounts) == 1 and fs.exists("/tmp/open_file")
+
+    # The mount is reused, and flush() unmounts it when it is no longer busy:
+    accessor.start()
+    assert fp.call_count([b"/bin/mount", fp.any()]) == 1  # type: ignore[list-item]
+    fs.remove("/tmp/open_file")
+    fp.register_subprocess(umount)  # type: ignore[arg-type]
+    registry.flush()  # the mount is still used by accessor: nothing to do
+    assert len(registry.mounts) == 1
+    (registered,) = registry.mounts.values()
+    registered.refcount = 0  # as if the accessor was released in another way
+    registry.flush()
+    assert not registry.mounts and not fs.exists("/tmp")
+    accessor.finish()  # release() of a flushed mount must not raise
+
+
+def test_probe_fstype(fs):
+    # type: (FakeFilesystem) -> None
+    """Test xcp.mount.probe_fstype() and xcp.mount.order_fstypes()"""
+    fs.create_file("/iso", contents=b"\0" * 0x8001 + b"CD001\1")
+    fs.create_file("/fat", contents=b"\0" * 0x52 + b"FAT32   " + b"\0" * 0x8000)
+    fs.create_file("/unknown", contents=b"\0" * 0x8010)
+    assert xcp.mount.probe_fstype("/iso") == "iso9660"
+    assert xcp.mount.probe_fstype("/fat") == "vfat"
+    assert xcp.mount.probe_fstype("/unknown") is None
+    assert xcp.mount.probe_fstype("server:/path") is None
+    fstypes = ["iso9660", "vfat", "ext3"]
+    assert xcp.mount.order_fstypes("/fat", fstypes) == ["vfat"]
+    assert xcp.mount.order_fstypes("/unknown", fstypes) == fstypes
+
+
+def test_repository_iter_packages(fs, fp):
+    # type: (FakeFilesystem, FakeProcess) -> None
+    """Test that Repository.iter_packages() keeps the mount while it reads XS-PACKAGES"""
+    fs.add_real_directory("tests/data/repo", target_path="/repo")
+    expect(fp, [b"/bin/mount", b"-t", b"iso9660", b"-o", b"ro", b"/dev/device", b"/tmp"])
+    accessor = xcp.accessor.DeviceAccessor("/dev/device", True)
+    with patch("tempfile.mkdtemp") as tempfile_mkdtemp:
+        tempfile_mkdtemp.return_value = "/tmp"
+        accessor.start()
+    for name in ("XS-REPOSITORY", "XS-PACKAGES"):
+        fs.create_file("/tmp/" + name, contents=cast(str, fs.get_object("/repo/" + name).contents))
+
+    repo = xcp.repository.Repository(accessor, "", lazy=True)
+    assert accessor.start_count == 1
+    packages = repo.iter_packages()
+    assert next(packages)
+    assert accessor.start_count == 2  # The mount is held while XS-PACKAGES is read
+    assert len(list(packages)) == len(repo.packages) - 1
+    assert accessor.start_count == 1
+
+    partial = xcp.repository.Repository(accessor, "", lazy=True).iter_packages()
+    assert next(partial) and accessor.start_count == 2
+    partial.close()
+    assert accessor.start_count == 1
+
+    for name in ("XS-REPOSITORY", "XS-PACKAGES"):
+        fs.remove("/tmp/" + name)
+    fp.register_subprocess([b"/bin/umount", b"-d", b"/tmp"])  # type: ignore[list-item]
+    accessor.finish()
+    assert not xcp.mount.registry.mounts
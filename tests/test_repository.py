@@ -1,6 +1,23 @@
+import gzip
+import ftplib
+import hashlib
+from hashlib import md5
+import io
+import lzma
+import os
+import pathlib
+import shutil
+import threading
+import time
 import unittest
+import xml.dom.minidom
+from typing import Any
+
+import pytest
+from six.moves import http_client  # pyright: ignore
 
 import xcp.accessor
+import xcp.xmlunwrap
 from xcp import repository
 from xcp.version import Version
 
@@ -20,7 +37,7 @@ class TestRepository(unittest.TestCase):
 
 
 def unittest_driver_rpm_package():
-    repo = "test_repo"
+    repo = "test_repo"  # type: Any  # stands in for the repository
     label = "test_label"
     size = 1024
     md5sum = "test_md5sum"
@@ -36,3 +53,383 @@ def unittest_driver_rpm_package():
     assert pkg.kernel == kernel
     assert pkg.options == options
     assert str(pkg) == "<DriverRPMPackage 'test_label', kernel 'test_kernel'>"
+
+
+def test_package_open_verified(tmp_path):
+    """Test Package.open_verified() with matching and mismatching checksums"""
+    data = b"rpm contents" * 1000
+    (tmp_path / "packages").mkdir()
+    (tmp_path / "packages" / "test.rpm").write_bytes(data)
+    access = xcp.accessor.createAccessor("file://%s/" % tmp_path, True)
+    assert isinstance(access, xcp.accessor.FileAccessor)
+    repo = repository.BaseRepository(access, "packages")
+    md5sum = hashlib.md5(data).hexdigest()
+    sha256 = hashlib.sha256(data).hexdigest()
+
+    pkg = repository.RPMPackage(repo, "test", str(len(data)), md5sum, False, "test.rpm", "")
+    with pkg.open_verified(sha256) as verified:
+        assert verified.read() == data
+    # Verify while copying the package using Accessor._writeFile():
+    with pkg.open_verified() as verified:
+        assert access._writeFile(verified, open(str(tmp_path / "copy.rpm"), "wb"))
+    assert (tmp_path / "copy.rpm").read_bytes() == data
+
+    for size, md5, sha in ((len(data) + 1, md5sum, None), (len(data), sha256[:32], None),
+                           (len(data), md5sum, md5sum * 2)):
+        pkg = repository.RPMPackage(repo, "test", str(size), md5, False, "test.rpm", "")
+        with pkg.open_verified(sha) as verified:
+            assert verified.read(100) == data[:100]
+            with pytest.raises(xcp.accessor.ChecksumError):
+                verified.read()
+
+    pkg = repository.RPMPackage(repo, "test", "1", md5sum, False, "missing.rpm", "")
+    assert pkg.open_verified() is False
+
+
+def test_iter_packages():
+    """Test that the streaming parser of XS-PACKAGES matches the minidom parser"""
+    access = xcp.accessor.createAccessor("file://tests/data/repo/", True)
+    repo = repository.Repository(access, "")
+    lazy_repo = repository.Repository(access, "", lazy=True)
+    assert not lazy_repo.packages and not lazy_repo.packages_loaded
+
+    with open("tests/data/repo/XS-PACKAGES", "rb") as xs_packages:
+        pkgdata = xs_packages.read()
+    xmldoc = xml.dom.minidom.parseString(pkgdata)
+    expected = [repo._create_package(node) for node in xmldoc.getElementsByTagName("package")]
+    for packages in (repo.packages, list(lazy_repo.iter_packages()), lazy_repo.packages):
+        assert [dict(vars(pkg), repository=None) for pkg in packages] == [
+            dict(vars(pkg), repository=None) for pkg in expected
+        ]
+    assert lazy_repo._md5.hexdigest() == repo._md5.hexdigest()
+    with open("tests/data/repo/XS-REPOSITORY", "rb") as xs_repository:
+        assert repo._md5.hexdigest() == hashlib.md5(xs_repository.read() + pkgdata).hexdigest()
+
+    with pytest.raises(repository.RepoFormatError):
+        list(repo._iterparse_packages(io.BytesIO(b"<packages><package")))
+    with pytest.raises(xcp.xmlunwrap.XmlUnwrapError):
+        list(repo._iterparse_packages(io.BytesIO(b'<packages><package type="rpm"/></packages>')))
+
+
+def test_find_repositories_concurrently(tmp_path):
+    """Test that findRepositories(workers=4) probes concurrently and keeps the order"""
+    for loc in ("packages.site", "packages", "packages.main"):
+        (tmp_path / loc).mkdir()
+        for name in ("XS-REPOSITORY", "XS-PACKAGES"):
+            shutil.copy("tests/data/repo/" + name, str(tmp_path / loc / name))
+
+    class SlowAccessor(xcp.accessor.FileAccessor):
+        running = 0
+        max_running = 0
+        lock = threading.Lock()
+
+        def access(self, name):
+            with self.lock:
+                self.running += 1
+                self.max_running = max(self.max_running, self.running)
+            time.sleep(0.01)
+            with self.lock:
+                self.running -= 1
+            return super(SlowAccessor, self).access(name)
+
+    sequential = repository.Repository.findRepositories(SlowAccessor("%s/" % tmp_path, True))
+    accessor = SlowAccessor("%s/" % tmp_path, True)
+    repos = repository.Repository.findRepositories(accessor, workers=4)
+    assert [repo.base for repo in repos] == [repo.base for repo in sequential] == [
+        "packages", "packages.main", "packages.site"
+    ]
+    assert accessor.max_running > 1
+
+
+def test_metadata_snapshot(tmp_path, monkeypatch):
+    """Test that the metadata of an unchanged repository is loaded from its snapshot"""
+    (tmp_path / "repo").mkdir()
+    for name in ("XS-REPOSITORY", "XS-PACKAGES"):
+        shutil.copy("tests/data/repo/" + name, str(tmp_path / "repo" / name))
+    monkeypatch.setattr(repository.Repository, "snapshot_dir", str(tmp_path / "snapshots"))
+    access = xcp.accessor.createAccessor("file://%s/repo/" % tmp_path, True)
+    assert isinstance(access, xcp.accessor.FileAccessor)
+    access.metadata_ttl = 0
+
+    repo = repository.Repository(access, "")
+    assert sorted(os.listdir(str(tmp_path / "snapshots")))[0] == "md5-%s.json" % repo._md5.hexdigest()
+
+    def no_parsing(*args):
+        raise AssertionError("The snapshot was not used")
+
+    with monkeypatch.context() as context:
+        context.setattr(repository.Repository, "_parse_repofile", no_parsing)
+        for snapshot in (repository.Repository(access, ""),
+                         repository.Repository(access, "", lazy=True)):
+            assert isinstance(snapshot._md5, repository._SnapshotDigest)
+            assert snapshot._md5.hexdigest() == repo._md5.hexdigest()
+            assert snapshot.identifier == repo.identifier
+            assert snapshot.product_version == repo.product_version
+            assert (snapshot.description, snapshot.requires) == (repo.description, repo.requires)
+            assert list(map(vars, snapshot.iter_packages())) == [
+                dict(vars(pkg), repository=snapshot) for pkg in repo.packages
+            ]
+
+    # A changed XS-PACKAGES invalidates the snapshot:
+    with open("tests/data/repo/XS-PACKAGES", "rb") as xs_packages:
+        pkgdata = xs_packages.read()
+    (tmp_path / "repo" / "XS-PACKAGES").write_bytes(pkgdata.replace(b"</xml>", b"""\
+  <package label="new" type="rpm" size="1" md5="0" optional="true">new.rpm</package>
+</xml>"""))
+    changed = repository.Repository(access, "")
+    assert isinstance(changed._md5, type(md5()))
+    assert len(changed.packages) == len(repo.packages) + 1
+    assert len(os.listdir(str(tmp_path / "snapshots"))) == 3
+    assert len(repository.Repository(access, "").packages) == len(changed.packages)
+
+
+def test_fetch(tmp_path, monkeypatch):
+    """Test Repository.fetch() with retries of failed downloads and checksum errors"""
+    (tmp_path / "repo" / "packages").mkdir(parents=True)
+    datas = {"packages/%d.rpm" % i: b"%d" % i * (1000 * i) for i in range(1, 9)}
+    for name, data in datas.items():
+        (tmp_path / "repo" / name).write_bytes(data)
+    monkeypatch.setattr(repository.Repository, "fetch_retry_delay", 0)
+
+    class FlakyAccessor(xcp.accessor.FileAccessor):
+        opened = []  # type: list[str]
+        failures = {"packages/3.rpm": 2, "packages/5.rpm": 1, "packages/2.rpm": 1}
+
+        def openAddress(self, address):
+            self.opened.append(address)
+            if address == "packages/perm.rpm":
+                return BrokenReader(ftplib.error_perm("550 Permission denied"))
+            if self.failures.get(address):
+                self.failures[address] -= 1
+                if address == "packages/3.rpm":
+                    self.lastError = 500
+                    return False
+                if address == "packages/2.rpm":
+                    return BrokenReader(http_client.IncompleteRead(b"2" * 10))
+                return io.BytesIO(datas[address][:100])  # a truncated download
+            return super(FlakyAccessor, self).openAddress(address)
+
+    class BrokenReader(io.RawIOBase):
+        """Reader which returns some data, then raises error"""
+
+        def __init__(self, error):
+            super(BrokenReader, self).__init__()
+            self.error = error
+            self.calls = 0
+
+        def readable(self):
+            return True
+
+        def readinto(self, b):
+            self.calls += 1
+            if self.calls > 1:
+                raise self.error
+            b[:10] = b"x" * 10
+            return 10
+
+    shutil.copy("tests/data/repo/XS-REPOSITORY", str(tmp_path / "repo"))
+    (tmp_path / "repo" / "XS-PACKAGES").write_bytes(b"<packages/>")
+    access = FlakyAccessor("file://%s/repo/" % tmp_path, True)
+    repo = repository.Repository(access, "")
+    del access.opened[:]
+
+    def rpm(name, md5sum=None):
+        data = datas.get(name, b"")
+        return repository.RPMPackage(repo, name, str(len(data)),
+                                     md5sum or hashlib.md5(data).hexdigest(), False, name, "")
+
+    packages = [rpm(name) for name in datas]
+    stats = repo.fetch(packages, str(tmp_path / "dest"))
+    assert stats.packages == 8 and stats.bytes == sum(map(len, datas.values()))
+    for name, data in datas.items():
+        assert (tmp_path / "dest" / name).read_bytes() == data
+    # The largest packages are fetched first, retries follow the failures:
+    assert access.opened == ["packages/8.rpm", "packages/7.rpm", "packages/6.rpm"] + [
+        "packages/5.rpm"] * 2 + ["packages/4.rpm"] + ["packages/3.rpm"] * 3 + [
+        "packages/2.rpm"] * 2 + ["packages/1.rpm"]
+
+    del access.opened[:]
+    with pytest.raises(repository.FetchError):
+        repo.fetch([rpm("missing.rpm")], str(tmp_path / "dest"))
+    assert access.opened == ["missing.rpm"]
+    with pytest.raises(repository.FetchError):
+        repo.fetch([rpm("packages/1.rpm", "0" * 32)], str(tmp_path / "dest2"), retries=2)
+    assert len(access.opened) == 4
+    assert not os.listdir(str(tmp_path / "dest2" / "packages"))
+    with pytest.raises(repository.RepoFormatError):
+        repo.fetch([rpm("../1.rpm")], str(tmp_path / "dest"))
+    # Permanent FTP errors are not retried and the .part file is removed:
+    del access.opened[:]
+    with pytest.raises(repository.FetchError):
+        repo.fetch([rpm("packages/perm.rpm")], str(tmp_path / "dest2"))
+    assert access.opened == ["packages/perm.rpm"]
+    assert not os.listdir(str(tmp_path / "dest2" / "packages"))
+
+    stats = repo.fetch(packages, str(tmp_path / "dest3"), workers=4)
+    assert stats.packages == 8
+    for name, data in datas.items():
+        assert (tmp_path / "dest3" / name).read_bytes() == data
+
+
+def test_fetch_concurrent_errors(tmp_path, monkeypatch):
+    """Test that fetch(workers=2) retries by the error of each worker's own openAddress()"""
+    (tmp_path / "repo").mkdir()
+    (tmp_path / "repo" / "flaky.rpm").write_bytes(b"flaky")
+    monkeypatch.setattr(repository.Repository, "fetch_retry_delay", 0)
+    both_failed = threading.Barrier(2, timeout=10)
+    overwritten = threading.Event()
+
+    class RacingAccessor(xcp.accessor.FileAccessor):
+        opened = []  # type: list[str]
+
+        def openAddress(self, address):
+            self.opened.append(address)
+            if address == "missing.rpm":
+                self.lastError = 404
+                both_failed.wait()
+                overwritten.wait(10)  # until the other worker set lastError = 500
+                return False
+            if address == "flaky.rpm" and self.opened.count(address) == 1:
+                both_failed.wait()
+                self.lastError = 500
+                overwritten.set()
+                return False
+            return super(RacingAccessor, self).openAddress(address)
+
+    shutil.copy("tests/data/repo/XS-REPOSITORY", str(tmp_path / "repo"))
+    (tmp_path / "repo" / "XS-PACKAGES").write_bytes(b"<packages/>")
+    access = RacingAccessor("file://%s/repo/" % tmp_path, True)
+    repo = repository.Repository(access, "")
+    del access.opened[:]
+    packages = [repository.RPMPackage(repo, name, str(len(data)), md5(data).hexdigest(),
+                                      False, name, "")
+                for name, data in (("missing.rpm", b"missing"), ("flaky.rpm", b"flaky"))]
+    with pytest.raises(repository.FetchError, match="error 404"):
+        repo.fetch(packages, str(tmp_path / "dest"), workers=2)
+    assert sorted(access.opened) == ["flaky.rpm", "flaky.rpm", "missing.rpm"]
+    assert (tmp_path / "dest" / "flaky.rpm").read_bytes() == b"flaky"
+
+
+YUM_PACKAGES = [
+    # name, epoch, version, release, provides, file
+    ("xcp-ng-release", "0", "8.2.1", "1", ["xcp-ng-release", "system-release"], "/etc/issue"),
+    ("kernel", "0", "4.19.19", "8.0.40.1", ["kernel", "kernel(x86-64)"], "/boot/vmlinuz"),
+    ("kernel", "1", "4.19.19", "8.0.41.1", ["kernel", "kernel(x86-64)"], "/boot/vmlinuz"),
+]
+
+
+def create_yum_repo(path, compression):
+    # type: (pathlib.Path, str) -> dict[str, bytes]
+    """Create a Yum repository in path with YUM_PACKAGES, return the RPM files by name"""
+    rpms = {}
+    entries = []
+    for name, epoch, ver, rel, provides, file_path in YUM_PACKAGES:
+        location = "Packages/%s-%s-%s.x86_64.rpm" % (name, ver, rel)
+        rpms[location] = data = ("%s:%s-%s" % (epoch, ver, rel)).encode() * 100
+        entries.append("""
+<package type="rpm">
+  <name>%s</name>
+  <arch>x86_64</arch>
+  <version epoch="%s" ver="%s" rel="%s"/>
+  <checksum type="sha256" pkgid="YES">%s</checksum>
+  <size package="%d" installed="0" archive="0"/>
+  <location href="%s"/>
+  <format>
+    <rpm:provides>%s</rpm:provides>
+    <file>%s</file>
+  </format>
+</package>""" % (name, epoch, ver, rel, hashlib.sha256(data).hexdigest(), len(data), location,
+                 "".join('<rpm:entry name="%s"/>' % cap for cap in provides), file_path))
+    primary = ("""<?xml version="1.0" encoding="UTF-8"?>
+<metadata xmlns="http://linux.duke.edu/metadata/common"
+ xmlns:rpm="http://linux.duke.edu/metadata/rpm" packages="%d">%s
+</metadata>""" % (len(entries), "".join(entries))).encode()
+    if compression == "gz":
+        primary = gzip.compress(primary)
+    elif compression == "xz":
+        primary = lzma.compress(primary)
+    elif compression == "zst":
+        primary = pytest.importorskip("zstandard").ZstdCompressor().compress(primary)
+    checksum = hashlib.sha256(primary).hexdigest()
+    primary_name = "repodata/%s-primary.xml%s" % (checksum, compression and "." + compression)
+
+    (path / "repodata").mkdir()
+    (path / "Packages").mkdir()
+    shutil.copy("tests/data/repo/.treeinfo", str(path))
+    (path / primary_name).write_bytes(primary)
+    (path / "repodata" / "repomd.xml").write_text("""\
+<?xml version="1.0" encoding="UTF-8"?>
+<repomd xmlns="http://linux.duke.edu/metadata/repo">
+  <data type="primary">
+    <checksum type="sha256">%s</checksum>
+    <location href="%s"/>
+    <size>%d</size>
+  </data>
+</repomd>""" % (checksum, primary_name, len(primary)))
+    for location, data in rpms.items():
+        (path / location).write_bytes(data)
+    return rpms
+
+
+@pytest.mark.parametrize("compression", ["gz", "xz", "zst", ""])
+def test_yum_repository(tmp_path, compression):
+    """Test reading the package index of a Yum repository and fetching its packages"""
+    rpms = create_yum_repo(tmp_path, compression)
+
+    class StartCountingAccessor(xcp.accessor.FileAccessor):
+        started = 0
+
+        def start(self):
+            self.started += 1
+
+        def finish(self):
+            self.started -= 1
+
+    access = StartCountingAccessor("file://%s/" % tmp_path, True)
+    (repo,) = repository.BaseRepository.findRepositories(access)
+    assert isinstance(repo, repository.YumRepository)
+    assert not repo.packages_loaded
+    assert repo.read_repomd()["primary"].checksum_type == "sha256"
+
+    # The accessor is kept started while primary.xml is read:
+    packages = repository.YumRepository(access).iter_packages()
+    assert next(packages) and access.started == 1
+    packages.close()
+    assert access.started == 0
+
+    assert [pkg.nevra for pkg in repo.find_packages("kernel")] == [
+        "kernel-4.19.19-8.0.40.1.x86_64", "kernel-1:4.19.19-8.0.41.1.x86_64"
+    ]
+    assert repo.find_packages("no-such-package") == []
+    assert [pkg.name for pkg in repo.what_provides("system-release")] == ["xcp-ng-release"]
+    assert len(repo.what_provides("kernel(x86-64)")) == 2
+    assert len(repo.what_provides("/boot/vmlinuz")) == 2
+    assert len(list(repo.iter_packages())) == 3
+    assert repr(repo.packages[0]) == "<YumPackage 'xcp-ng-release-8.2.1-1.x86_64'>"
+
+    stats = repo.fetch(repo.packages, str(tmp_path / "dest"), workers=2)
+    assert stats.packages == 3 and stats.bytes == sum(map(len, rpms.values()))
+    for location, data in rpms.items():
+        assert (tmp_path / "dest" / location).read_bytes() == data
+
+    # The sha256 checksums of primary.xml and of the packages are verified:
+    (tmp_path / next(iter(rpms))).write_bytes(b"x" * len(rpms[next(iter(rpms))]))
+    with repo.packages[0].open_verified() as rpm:
+        with pytest.raises(xcp.accessor.ChecksumError):
+            rpm.read()
+    repomd = tmp_path / "repodata" / "repomd.xml"
+    primary = repo.read_repomd()["primary"]
+    repomd_text = repomd.read_text()
+    repomd.write_text(repomd_text.replace(">%s<" % primary.checksum, ">%s<" % ("0" * 64)))
+    with pytest.raises(xcp.accessor.ChecksumError):
+        list(repository.YumRepository(access).iter_packages())
+
+    # Corrupt and truncated compressed data with a matching checksum is a RepoFormatError:
+    data = (tmp_path / primary.location).read_bytes()
+    for corrupt in (data[:20] + b"\xff" * 20 + data[40:], data[:len(data) // 2]):
+        (tmp_path / primary.location).write_bytes(corrupt)
+        repomd.write_text(repomd_text.replace(
+            ">%s<" % primary.checksum, ">%s<" % hashlib.sha256(corrupt).hexdigest()
+        ).replace(">%d<" % len(data), ">%d<" % len(corrupt)))
+        with pytest.raises(repository.RepoFormatError):
+            list(repository.YumRepository(access).iter_packages())
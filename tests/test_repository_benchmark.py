@@ -0,0 +1,59 @@
+"""
+Benchmark of parsing XS-PACKAGES of xcp.repository.Repository, which also checks the results.
+
+The benchmark is skipped unless XCP_BENCHMARKS is set. The rates are logged at INFO
+level (shown by pytest's live logging). The size of the benchmark can be changed using
+an environment variable, e.g.:
+
+XCP_BENCHMARKS=1 REPO_BENCH_PACKAGES=200000 pytest tests/test_repository_benchmark.py
+"""
+import io
+import os
+import time
+import xml.dom.minidom
+from typing import Callable
+
+import pytest
+
+from xcp import xmlunwrap
+from xcp.accessor import createAccessor
+from xcp.repository import Repository
+
+BENCH_PACKAGES = int(os.environ.get("REPO_BENCH_PACKAGES", "50000"))
+
+pytestmark = pytest.mark.benchmark
+
+
+def create_xs_packages(count):
+    # type: (int) -> bytes
+    """Return a synthetic XS-PACKAGES manifest of count RPM packages"""
+    lines = ['<?xml version="1.0" encoding="UTF-8"?>', "<packages>"]
+    for i in range(count):
+        lines.append(
+            '  <package type="rpm" label="package-%d" size="%d" md5="%032x" optional="false">'
+            "packages/package-%d-1.0-1.x86_64.rpm</package>" % (i, 1024 + i, i, i)
+        )
+    lines.append("</packages>")
+    return "\n".join(lines).encode()
+
+
+def test_parse_xs_packages(log_rate):
+    # type: (Callable[..., None]) -> None
+    """Benchmark the streaming XS-PACKAGES parser against the former minidom parser"""
+    pkgdata = create_xs_packages(BENCH_PACKAGES)
+    repo = Repository(createAccessor("file://tests/data/repo/", True), "", lazy=True)
+
+    start = time.time()
+    xmldoc = xml.dom.minidom.parseString(pkgdata)
+    expected = [repo._create_package(node)
+                for node in xmlunwrap.getElementsByTagName(xmldoc, ["package"])]
+    log_rate("minidom parser", BENCH_PACKAGES, "packages", time.time() - start)
+    del xmldoc
+
+    start = time.time()
+    packages = list(repo._iterparse_packages(io.BytesIO(pkgdata)))
+    log_rate("Repository.iter_packages()", BENCH_PACKAGES, "packages", time.time() - start)
+
+    assert len(packages) == len(expected) == BENCH_PACKAGES
+    assert vars(packages[-1]) == vars(expected[-1])
+    assert packages[-1].filename == "packages/package-%d-1.0-1.x86_64.rpm" % (BENCH_PACKAGES - 1)
@@ -23,24 +23,40 @@
 
 """accessor - provide common interface to access methods"""
 
+import base64
+import bisect
+import calendar
+import copy
 import errno
 import ftplib
+import functools
+import hashlib
 import io
+import json
 import os
+import socket
+import stat
 import sys
 import tempfile
+import threading
+import time
+from collections import namedtuple
 from contextlib import contextmanager
+from email.utils import mktime_tz, parsedate_tz
 from typing import TYPE_CHECKING, Union, cast
 
-from six.moves import urllib  # pyright: ignore
+from six.moves import http_client, urllib  # pyright: ignore
 
 from xcp import logger, mount
 
 if TYPE_CHECKING:
     from collections.abc import Generator
-    from typing import IO, List, Tuple
+    from http.client import HTTPConnection, HTTPResponse
+    from typing import IO, Any, List, Tuple
 
     from typing_extensions import Literal
+else:
+    HTTPResponse = http_client.HTTPResponse
 
 # maps errno codes to HTTP error codes
 # needed for error code consistency
@@ -54,24 +70,361 @@ def mapError(errorCode):
     else:
         return 500
 
+AddressInfo = namedtuple("AddressInfo", ["exists", "size", "mtime", "etag"])
+"""Metadata of an address returned by Accessor.stat(), unknown values are None"""
+
+MISSING = AddressInfo(False, None, None, None)
+
+
+def _file_info(filehandle):
+    # type: (IO[bytes]) -> AddressInfo
+    """Return the AddressInfo of an opened local file and close it"""
+    with filehandle:
+        st = os.fstat(filehandle.fileno())
+    return AddressInfo(True, st.st_size, st.st_mtime, None)
+
+
+COPY_BUFSIZE = 1024 * 1024
+"""Size of the buffer for copying files which are not regular files"""
+
+
+def _kernel_copy(in_fh, out_fh):
+    # type: (IO[bytes], IO[bytes]) -> int | None
+    """
+    Copy the rest of the regular file in_fh to out_fh inside the kernel using
+    os.copy_file_range() or os.sendfile(). Returns the number of bytes copied, or
+    None if the file objects have no usable file descriptors (e.g. BytesIO, HTTP).
+    """
+    try:
+        in_fd, out_fd = in_fh.fileno(), out_fh.fileno()
+        if not stat.S_ISREG(os.fstat(in_fd).st_mode):
+            return None  # A socket may have data in the buffer of in_fh
+        offset = start = in_fh.tell()
+    except (AttributeError, OSError, ValueError):  # io.UnsupportedOperation is both
+        return None
+    out_fh.flush()
+    copy_file_range = getattr(os, "copy_file_range", None)
+    while True:
+        try:
+            if copy_file_range:
+                copied = copy_file_range(in_fd, out_fd, 1 << 30, offset)
+            else:
+                copied = os.sendfile(out_fd, in_fd, offset, 1 << 30)
+        except OSError as e:
+            if offset != start or e.errno not in (errno.EXDEV, errno.EINVAL, errno.ENOSYS,
+                                                  errno.EOPNOTSUPP, errno.EBADF):
+                raise
+            if not copy_file_range:
+                return None
+            copy_file_range = None  # e.g. a copy across filesystems on older kernels
+            continue
+        if not copied:
+            break
+        offset += copied
+    in_fh.seek(offset)
+    return offset - start
+
+
+def copy_fileobj(in_fh, out_fh, fsync=False):
+    # type: (IO[bytes], IO[bytes], bool) -> int
+    """
+    Copy in_fh to out_fh and return the number of bytes copied.
+
+    Regular files are copied by the kernel. Other file objects are copied using
+    readinto() into a buffer of COPY_BUFSIZE. If fsync is set, out_fh is flushed
+    to disk at the end.
+    """
+    copied = _kernel_copy(in_fh, out_fh)
+    if copied is None:
+        copied = 0
+        buf = bytearray(COPY_BUFSIZE)
+        view = memoryview(buf)
+        readinto = getattr(in_fh, "readinto", None)
+        while True:
+            if readinto:
+                length = readinto(buf)
+            else:
+                data = in_fh.read(COPY_BUFSIZE)
+                length = len(data)
+                view[:length] = data
+            if not length:
+                break
+            out_fh.write(view[:length])
+            copied += length
+    if fsync:
+        out_fh.flush()
+        os.fsync(out_fh.fileno())
+    return copied
+
+
+class ChecksumError(IOError):
+    """Raised by VerifyingReader at the end of a file which does not match its checksums"""
+
+
+class VerifyingReader(io.RawIOBase):
+    """
+    Reader which computes the checksums of the data read from fileobj. At the end
+    of the file, it raises ChecksumError if the size, md5sum or sha256 (if given)
+    do not match. This allows to verify a file while it is read or copied.
+    """
+
+    def __init__(self, fileobj, md5sum=None, sha256=None, size=None, name=""):
+        # type: (IO[bytes], str | None, str | None, int | None, str) -> None
+        super(VerifyingReader, self).__init__()
+        self.fileobj = fileobj
+        self.name = name
+        self.size = size
+        self.read_size = 0
+        self.checksums = []  # type: List[Tuple[str, str, Any]]
+        if md5sum:
+            self.checksums.append(("md5sum", md5sum.lower(), hashlib.md5()))
+        if sha256:
+            self.checksums.append(("sha256", sha256.lower(), hashlib.sha256()))
+        self.verified = False
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        data = self.fileobj.read(len(b))
+        if not data:
+            if not self.verified:
+                self.verified = True
+                self.verify()
+            return 0
+        b[:len(data)] = data
+        self.read_size += len(data)
+        for _, _, checksum in self.checksums:
+            checksum.update(data)
+        return len(data)
+
+    def verify(self):
+        # type: () -> None
+        """Raise ChecksumError if the data read so far does not match"""
+        if self.size is not None and self.read_size != self.size:
+            raise ChecksumError("%s: size %d, expected %d" % (self.name, self.read_size,
+                                                                self.size))
+        for kind, expected, checksum in self.checksums:
+            if checksum.hexdigest() != expected:
+                raise ChecksumError("%s: %s %s, expected %s" % (self.name, kind,
+                                                                  checksum.hexdigest(), expected))
+
+    def close(self):
+        self.fileobj.close()
+        super(VerifyingReader, self).close()
+
+
+class _CountingReader(io.RawIOBase):
+    """Reader which adds the number of bytes read from fileobj to a counter of stats"""
+
+    def __init__(self, fileobj, stats, counter):
+        # type: (IO[bytes], AccessorStats, str) -> None
+        super(_CountingReader, self).__init__()
+        self.fileobj = fileobj
+        self.stats = stats
+        self.counter = counter
+
+    def readable(self):
+        return True
+
+    def fileno(self):
+        # For fstat(), but without tell() for copy_fileobj(), so it reads the data here
+        return self.fileobj.fileno()
+
+    def readinto(self, b):
+        data = self.fileobj.read(len(b))
+        b[:len(data)] = data
+        self.stats.add(self.counter, len(data))
+        return len(data)
+
+    def close(self):
+        self.fileobj.close()
+        super(_CountingReader, self).close()
+
+
+class AccessorStats(object):
+    """
+    Statistics of an accessor which were enabled by Accessor.instrument():
+    Calls and latency histograms of its methods, bytes read and written,
+    errors by lastError code, and the connections opened and reused.
+    """
+
+    buckets = [0.001, 0.01, 0.1, 1.0, 10.0]
+    """Upper bounds in seconds of the buckets of the latency histograms"""
+
+    bucket_names = ["<1ms", "<10ms", "<100ms", "<1s", "<10s", ">=10s"]
+
+    def __init__(self, accessor):
+        # type: (Accessor) -> None
+        self.accessor = accessor
+        self.lock = threading.Lock()
+        self.calls = {}  # type: dict[str, dict[str, Any]]
+        self.counters = {"bytes_read": 0, "bytes_written": 0}
+        self.errors = {}  # type: dict[str, int]
+        self.nesting = threading.local()  # Errors are counted by the outermost call
+
+    def add(self, counter, value):
+        # type: (str, int) -> None
+        with self.lock:
+            self.counters[counter] += value
+
+    def record(self, method, seconds, error=None):
+        # type: (str, float, str | None) -> None
+        """Record a call of method which took seconds and failed with error (if set)"""
+        with self.lock:
+            call = self.calls.setdefault(method, {
+                "count": 0, "seconds": 0.0, "histogram": dict.fromkeys(self.bucket_names, 0)
+            })
+            call["count"] += 1
+            call["seconds"] += seconds
+            call["histogram"][self.bucket_names[bisect.bisect(self.buckets, seconds)]] += 1
+            if error is not None:
+                self.errors[error] = self.errors.get(error, 0) + 1
+
+    def snapshot(self):
+        # type: () -> dict[str, Any]
+        """Return a copy of the statistics as a dict which can be serialized as JSON"""
+        with self.lock:
+            snapshot = copy.deepcopy({"calls": self.calls, "errors": self.errors})
+            snapshot.update(self.counters)
+        snapshot["accessor"] = repr(self.accessor)
+        pool = getattr(self.accessor, "pool", None)  # Shared by the accessors of a class
+        if pool is not None:
+            snapshot["connections"] = {"opened": pool.opened, "reused": pool.reused}
+        if isinstance(self.accessor, CachingAccessor):
+            snapshot["cache"] = {"hits": self.accessor.hits, "misses": self.accessor.misses}
+        return snapshot
+
+    def to_json(self):
+        # type: () -> str
+        return json.dumps(self.snapshot(), sort_keys=True)
+
+
 class Accessor(object):
+    metadata_ttl = 0.0
+    """Seconds for which stat() and access() answer from the metadata cache (0: disabled)"""
+
+    threadsafe = True
+    """Whether several threads may open addresses of the accessor concurrently"""
+
+    fsync = False
+    """Whether writeFile() and downloadFile() flush the written files to disk"""
 
     def __init__(self, ro):
         self.read_only = ro
+        self._errors = threading.local()  # the lastError of each thread
         self.lastError = 0
+        self.metadata = {}  # type: dict[str, Tuple[float, AddressInfo, int]]
+        self.stats = None  # type: AccessorStats | None
+
+    @property
+    def lastError(self):
+        # type: () -> int
+        """Error code of the last failed call, e.g. 404 (see threadLastError)"""
+        return self._lastError
+
+    @lastError.setter
+    def lastError(self, code):
+        # type: (int) -> None
+        self._lastError = code
+        self._errors.code = code
+
+    @property
+    def threadLastError(self):
+        # type: () -> int
+        """
+        Error code of the last failed call of the current thread: Unlike lastError,
+        it is not overwritten by the failed calls of other threads.
+        """
+        return getattr(self._errors, "code", 0)
+
+    instrumented = ("openAddress", "access", "stat", "writeFile", "downloadFile", "finish")
+
+    def instrument(self, log=False):
+        # type: (bool) -> AccessorStats
+        """
+        Enable the collection of AccessorStats for the methods of this accessor. The
+        files returned by openAddress() are wrapped to count the bytes read from them.
+        When log is set, the stats are logged when finish() releases the accessor.
+        """
+        if self.stats:
+            return self.stats
+        stats = self.stats = AccessorStats(self)
+        for name in self.instrumented:
+            if hasattr(self, name):  # e.g. HTTPAccessor has no writeFile()
+                setattr(self, name, self._instrumented(name, getattr(self, name), log))
+        return stats
+
+    def _instrumented(self, name, method, log):
+        """Return a wrapper of the bound method which records the call in self.stats"""
+        stats = cast(AccessorStats, self.stats)
+
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            if name == "writeFile":
+                args = (io.BufferedReader(_CountingReader(args[0], stats, "bytes_written")),) \
+                    + args[1:]
+            start = time.time()
+            depth = getattr(stats.nesting, "depth", 0)
+            stats.nesting.depth = depth + 1
+            try:
+                result = method(*args, **kwargs)
+            except Exception as e:
+                stats.record(name, time.time() - start, None if depth else type(e).__name__)
+                raise
+            finally:
+                stats.nesting.depth = depth
+            error = None
+            if not depth and (result is False or name == "stat" and not result.exists):
+                error = str(self.threadLastError)
+            stats.record(name, time.time() - start, error)
+            if name == "openAddress" and result:
+                return io.BufferedReader(_CountingReader(result, stats, "bytes_read"))
+            if name == "downloadFile" and result:
+                stats.add("bytes_written", os.path.getsize(args[1]))
+            if name == "finish" and log and not getattr(self, "start_count", 0):
+                logger.info("Accessor stats: " + stats.to_json())
+            return result
+
+        return wrapper
 
     def access(self, name):
         """ Return boolean determining where 'name' is an accessible object
         in the target. """
         try:
-            f = self.openAddress(name)
-            if not f:
-                return False
-            f.close()  # pylint: disable=no-member
+            return self.stat(name).exists
         except Exception:
             return False
 
-        return True
+    def stat(self, name):
+        # type: (str) -> AddressInfo
+        """Return the AddressInfo of name, cached for metadata_ttl seconds"""
+        cached = self.metadata.get(name)
+        if cached and cached[0] > time.time():
+            if not cached[1].exists:
+                self.lastError = cached[2]
+            return cached[1]
+        info = self._stat(name)
+        if self.metadata_ttl > 0:
+            self.metadata[name] = (time.time() + self.metadata_ttl, info, self.threadLastError)
+        return info
+
+    def invalidate(self, name=None):
+        # type: (str | None) -> None
+        """Drop name (or all addresses) from the metadata cache"""
+        if name is None:
+            self.metadata.clear()
+        else:
+            self.metadata.pop(name, None)
+
+    def _stat(self, name):
+        # type: (str) -> AddressInfo
+        """Return the AddressInfo of name, subclasses can avoid opening name"""
+        f = self.openAddress(name)
+        if not f:
+            return MISSING
+        f.close()  # pylint: disable=no-member
+        return AddressInfo(True, None, None, None)
 
     @contextmanager
     def openText(self, address):
@@ -103,14 +456,24 @@ class Accessor(object):
     def finish(self):
         pass
 
+    def downloadFile(self, address, path):
+        # type: (str, str) -> bool
+        """Copy address to the local file path, returns False if it cannot be opened"""
+        in_fh = self.openAddress(address)
+        if not in_fh:
+            return False
+        with in_fh:
+            return self._writeFile(in_fh, open(path, "wb"), self.fsync)
+
     @staticmethod
-    def _writeFile(in_fh, out_fh):
-        while out_fh:
-            data = in_fh.read(256 * 512)
-            if len(data) == 0:
-                break
-            out_fh.write(data)
-        out_fh.close()
+    def _writeFile(in_fh, out_fh, fsync=False):
+        # type: (IO[bytes], IO[bytes], bool) -> bool
+        start = time.time()
+        with out_fh:
+            copied = copy_fileobj(in_fh, out_fh, fsync)
+        seconds = time.time() - start
+        logger.debug("Copied %d bytes in %.3fs (%.1f MiB/s)"
+                     % (copied, seconds, copied / max(seconds, 1e-6) / 1024 / 1024))
         return True
 
 class FilesystemAccessor(Accessor):
@@ -132,6 +495,10 @@ class FilesystemAccessor(Accessor):
             return False
         return filehandle
 
+    def _stat(self, name):
+        filehandle = self.openAddress(name)
+        return _file_info(filehandle) if filehandle else MISSING
+
 class MountingAccessor(FilesystemAccessor):
     def __init__(self, mount_types, mount_source, mount_options=None):
         ro = isinstance(mount_options, list) and 'ro' in mount_options
@@ -141,49 +508,35 @@ class MountingAccessor(FilesystemAccessor):
         self.mount_source = mount_source
         self.mount_options = mount_options
         self.start_count = 0
+        self.start_lock = threading.Lock()  # for start()/finish() from worker threads
 
     def start(self):
-        if self.start_count == 0:
-            self.location = tempfile.mkdtemp(prefix="media-", dir="/tmp")
-            # try each filesystem in turn:
-            success = False
-            for fs in self.mount_types:
-                try:
-                    opts = self.mount_options
-                    if fs == 'iso9660':
-                        if isinstance(opts, list):
-                            if 'ro' not in opts:
-                                opts.append('ro')
-                        else:
-                            opts = ['ro']
-                    mount.mount(self.mount_source, self.location,
-                                options = opts,
-                                fstype = fs)
-                except mount.MountException:
-                    continue
-                else:
-                    success = True
-                    break
-            if not success:
-                os.rmdir(self.location)
-                raise mount.MountException
-        self.start_count += 1
+        with self.start_lock:
+            if self.start_count == 0:
+                # Mount the source, or share the mount of another accessor of the source:
+                self.location = mount.registry.acquire(self.mount_source, self.mount_types,
+                                                       self.mount_options)
+            self.start_count += 1
 
     def finish(self):
-        if self.start_count == 0:
-            return
-        self.start_count -= 1
-        if self.start_count == 0:
-            assert self.location
-            mount.umount(self.location)
-            os.rmdir(self.location)
-            self.location = None
+        with self.start_lock:
+            if self.start_count == 0:
+                return
+            self.start_count -= 1
+            if self.start_count == 0:
+                assert self.location
+                mount.registry.release(self.mount_source, self.mount_options)
+                self.location = None
+                self.invalidate()
 
     def writeFile(self, in_fh, out_name):
         assert self.location
         logger.info("Copying to %s" % os.path.join(self.location, out_name))
         out_fh = open(os.path.join(self.location, out_name), "wb")
-        return self._writeFile(in_fh, out_fh)
+        try:
+            return self._writeFile(in_fh, out_fh, self.fsync)
+        finally:
+            self.invalidate(out_name)
 
     def __del__(self):
         while self.start_count > 0:
@@ -249,10 +602,17 @@ class FileAccessor(Accessor):
             return False
         return reader
 
+    def _stat(self, name):
+        reader = self.openAddress(name)
+        return _file_info(reader) if reader else MISSING
+
     def writeFile(self, in_fh, out_name):
         logger.info("Copying to %s" % os.path.join(self.baseAddress, out_name))
         out_fh = open(os.path.join(self.baseAddress, out_name), "wb")
-        return self._writeFile(in_fh, out_fh)
+        try:
+            return self._writeFile(in_fh, out_fh, self.fsync)
+        finally:
+            self.invalidate(out_name)
 
     def __repr__(self):
         return "<FileAccessor: %s>" % self.baseAddress
@@ -267,104 +627,457 @@ def rebuild_url(url_parts):
         (url_parts.scheme, host,
          url_parts.path, '', ''))
 
+class FTPSessionPool(object):
+    """
+    Pool of logged-in FTP sessions, kept per server, login and directory.
+
+    FTPAccessor takes a session for each command or transfer, so several files can
+    be retrieved at the same time, and returns it when done. Up to maxsize idle
+    sessions per key are kept for idle_timeout seconds: get(), put() and reap()
+    log out of the sessions which were idle for longer. The counters opened and
+    reused can be used to check the reuse of sessions.
+    """
+
+    check_after = 5.0
+    """Sessions idle for longer are checked with NOOP before they are reused"""
+
+    def __init__(self, maxsize=4, idle_timeout=60.0):
+        # type: (int, float) -> None
+        self.maxsize = maxsize
+        self.idle_timeout = idle_timeout
+        self.opened = 0
+        self.reused = 0
+        self.lock = threading.Lock()
+        self.idle = {}  # type: dict[Tuple[str, int, str, str, str], List[Tuple[float, ftplib.FTP]]]
+
+    @staticmethod
+    def _close(ftp):
+        # type: (ftplib.FTP) -> None
+        try:
+            ftp.quit()
+        except Exception:  # The connection may be broken already
+            ftp.close()
+
+    def reap(self):
+        # type: () -> None
+        """Log out of the sessions which are idle for longer than idle_timeout"""
+        deadline = time.time() - self.idle_timeout
+        expired = []  # type: List[ftplib.FTP]
+        with self.lock:
+            for key, sessions in list(self.idle.items()):
+                expired += [ftp for since, ftp in sessions if since < deadline]
+                sessions[:] = [(since, ftp) for since, ftp in sessions if since >= deadline]
+                if not sessions:
+                    del self.idle[key]
+        for ftp in expired:
+            self._close(ftp)
+
+    def get(self, key):
+        # type: (Tuple[str, int, str, str, str]) -> ftplib.FTP
+        """Return an idle session for key or a new session"""
+        self.reap()
+        while True:
+            with self.lock:
+                sessions = self.idle.get(key)
+                if not sessions:
+                    self.opened += 1
+                    break
+                since, ftp = sessions.pop()
+            idle = time.time() - since
+            if idle > self.idle_timeout:
+                self._close(ftp)
+                continue
+            if idle > self.check_after:
+                try:
+                    ftp.voidcmd("NOOP")
+                except (ftplib.Error, EOFError, socket.error):
+                    ftp.close()
+                    continue
+            with self.lock:
+                self.reused += 1
+            return ftp
+
+        host, port, username, password, directory = key
+        ftp = ftplib.FTP()
+        try:
+            ftp.connect(host, port)
+            ftp.login(username, password)
+            if directory != '':
+                logger.debug("Changing to " + directory)
+                ftp.cwd(directory)
+        except BaseException:
+            ftp.close()
+            raise
+        return ftp
+
+    def put(self, key, ftp):
+        # type: (Tuple[str, int, str, str, str], ftplib.FTP) -> None
+        """Return an idle session to the pool, close it if the pool of the key is full"""
+        self.reap()
+        with self.lock:
+            sessions = self.idle.setdefault(key, [])
+            if len(sessions) < self.maxsize:
+                sessions.append((time.time(), ftp))
+                return
+        self._close(ftp)
+
+    def clear(self):
+        # type: () -> None
+        """Log out of all idle sessions of the pool"""
+        with self.lock:
+            idle, self.idle = self.idle, {}
+        for sessions in idle.values():
+            for _, ftp in sessions:
+                self._close(ftp)
+
+
+class _FTPFile(io.RawIOBase):
+    """Data connection of a RETR, which returns the session to the pool on close()"""
+
+    def __init__(self, accessor, ftp, conn):
+        # type: (FTPAccessor, ftplib.FTP, socket.socket) -> None
+        super(_FTPFile, self).__init__()
+        self.accessor = accessor
+        self.ftp = ftp  # type: ftplib.FTP | None
+        self.raw = conn.makefile("rb", buffering=0)
+        # See https://github.com/xenserver/python-libs/pull/49#discussion_r1212794936:
+        conn.close()
+        self.eof = False
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        length = self.raw.readinto(b)
+        if not length:
+            self.eof = True
+        return length
+
+    def close(self):
+        ftp, self.ftp = self.ftp, None
+        if ftp:
+            self.raw.close()
+            try:
+                if not self.eof:
+                    raise EOFError("transfer not complete")  # The server replies 426
+                ftp.voidresp()
+            except (ftplib.Error, EOFError, socket.error):
+                ftp.close()
+            else:
+                self.accessor.pool.put(self.accessor.session_key, ftp)
+        super(_FTPFile, self).close()
+
+
 class FTPAccessor(Accessor):
+    pool = FTPSessionPool()
+    """Logged-in sessions shared by all FTPAccessors, kept over start()/finish()"""
+
+    metadata_ttl = 60.0  # Answer repeated probes of findRepositories() from the cache
+
     def __init__(self, baseAddress, ro):
         super(FTPAccessor, self).__init__(ro)
         self.url_parts = urllib.parse.urlsplit(baseAddress, allow_fragments=False)
         self.start_count = 0
-        self.cleanup = False
-        self.ftp = None
+        self.start_lock = threading.Lock()  # for start()/finish() from worker threads
+        self.listings = {}  # type: dict[str, Tuple[float, dict[str, dict[str, str]] | None]]
         self.baseAddress = rebuild_url(self.url_parts)
 
-    def _cleanup(self):
-        if self.cleanup:
-            # clean up after RETR
-            cast(ftplib.FTP, self.ftp).voidresp()
-            self.cleanup = False
+        port = ftplib.FTP_PORT
+        if self.url_parts.port:
+            port = self.url_parts.port
+        username = cast(str, self.url_parts.username)
+        password = cast(str, self.url_parts.password)
+        if username:
+            username = urllib.parse.unquote(username)
+        if password:
+            password = urllib.parse.unquote(password)
+        directory = urllib.parse.unquote(self.url_parts.path[1:])
+        self.session_key = (cast(str, self.url_parts.hostname), port,
+                            username or "", password or "", directory)
 
-    def start(self):
-        if self.start_count == 0:
-            self.ftp = ftplib.FTP()
-            #self.ftp.set_debuglevel(1)
-            port = ftplib.FTP_PORT
-            if self.url_parts.port:
-                port = self.url_parts.port
-            self.ftp.connect(cast(str, self.url_parts.hostname), port)
-            username = cast(str, self.url_parts.username)
-            password = cast(str, self.url_parts.password)
-            if username:
-                username = urllib.parse.unquote(username)
-            if password:
-                password = urllib.parse.unquote(password)
-            self.ftp.login(username, password)
-
-            directory = urllib.parse.unquote(self.url_parts.path[1:])
-            if directory != '':
-                logger.debug("Changing to " + directory)
-                self.ftp.cwd(directory)
+    @contextmanager
+    def session(self):
+        # type: () -> Generator[ftplib.FTP, None, None]
+        """Context manager for a session of the pool (closed if a command fails)"""
+        ftp = self.pool.get(self.session_key)
+        try:
+            yield ftp
+        except ftplib.error_perm:
+            self.pool.put(self.session_key, ftp)  # The command failed, the session is fine
+            raise
+        except BaseException:
+            ftp.close()
+            raise
+        self.pool.put(self.session_key, ftp)
 
-        self.start_count += 1
+    def start(self):
+        with self.start_lock:
+            if self.start_count == 0:
+                # Log in (or check an idle session) to report connection errors here:
+                self.pool.put(self.session_key, self.pool.get(self.session_key))
+            self.start_count += 1
 
     def finish(self):
-        if self.start_count == 0:
-            return
-        self.start_count -= 1
-        if self.start_count == 0:
-            cast(ftplib.FTP, self.ftp).quit()
-            self.cleanup = False
-            self.ftp = None
-
-    # pylint: disable-next=arguments-differ,arguments-renamed
-    def access(self, path):  # pyright: ignore[reportIncompatibleMethodOverride]
+        with self.start_lock:
+            if self.start_count == 0:
+                return
+            self.start_count -= 1
+            if self.start_count == 0:
+                self.pool.reap()
+
+    def invalidate(self, name=None):
+        super(FTPAccessor, self).invalidate(name)
+        if name is None:
+            self.listings.clear()
+        else:
+            self.listings.pop(os.path.dirname(urllib.parse.unquote(name)), None)
+
+    def _listdir(self, ftp, directory):
+        # type: (ftplib.FTP, str) -> dict[str, dict[str, str]] | None
+        """Return the MLSD facts of the entries of directory, None if MLSD is unsupported"""
+        cached = self.listings.get(directory)
+        if cached and cached[0] > time.time():
+            return cached[1]
+        try:
+            listing = dict(ftp.mlsd(directory, ["type", "size", "modify", "unique"]))
+        except ftplib.error_perm as e:
+            if not str(e).startswith("50"):
+                raise
+            listing = None  # The server does not support MLSD
+        self.listings[directory] = (time.time() + self.metadata_ttl, listing)
+        return listing
+
+    def _stat(self, name):
         try:
-            logger.debug("Testing "+path)
-            self._cleanup()
-            url = urllib.parse.unquote(path)
-
-            assert self.ftp
-            if self.ftp.size(url) is not None:
-                return True
-            lst = self.ftp.nlst(os.path.dirname(url))
-            return os.path.basename(url) in list(map(os.path.basename, lst))
+            logger.debug("Testing "+name)
+            url = urllib.parse.unquote(name)
+
+            with self.session() as ftp:
+                listing = self._listdir(ftp, os.path.dirname(url))
+                if listing is None:
+                    if ftp.size(url) is not None:
+                        return AddressInfo(True, None, None, None)
+                    lst = ftp.nlst(os.path.dirname(url))
+                    if os.path.basename(url) in list(map(os.path.basename, lst)):
+                        return AddressInfo(True, None, None, None)
+                    raise ftplib.error_perm("550 " + url)
+            facts = listing.get(os.path.basename(url))
+            if facts is None:
+                raise ftplib.error_perm("550 " + url)
+            size = facts.get("size")
+            modify = facts.get("modify")
+            mtime = None
+            if modify:
+                mtime = calendar.timegm(time.strptime(modify[:14], "%Y%m%d%H%M%S"))
+            return AddressInfo(True, size and int(size), mtime, facts.get("unique"))
         except (IOError, OSError) as e:
             if e.errno == errno.EIO:
                 self.lastError = 5
             else:
                 self.lastError = mapError(e.errno)
-            return False
+            return MISSING
         except Exception:
             self.lastError = 500
-            return False
+            return MISSING
 
     def openAddress(self, address):
         logger.debug("Opening "+address)
-        self._cleanup()
         url = urllib.parse.unquote(address)
 
-        assert self.ftp
-        self.ftp.voidcmd('TYPE I')
-        socket = self.ftp.transfercmd('RETR ' + url)
-        buffered_reader = socket.makefile('rb')
-        # See https://github.com/xenserver/python-libs/pull/49#discussion_r1212794936:
-        socket.close()
-        self.cleanup = True
-        return buffered_reader
+        ftp = self.pool.get(self.session_key)
+        try:
+            ftp.voidcmd('TYPE I')
+            conn = ftp.transfercmd('RETR ' + url)
+        except ftplib.error_perm:
+            self.pool.put(self.session_key, ftp)
+            raise
+        except BaseException:
+            ftp.close()
+            raise
+        # The session is returned to the pool when the data connection is closed:
+        return io.BufferedReader(_FTPFile(self, ftp, conn))
 
     def writeFile(self, in_fh, out_name):
-        self._cleanup()
         fname = urllib.parse.unquote(out_name)
 
         logger.debug("Storing as " + fname)
-        cast(ftplib.FTP, self.ftp).storbinary('STOR ' + fname, in_fh)
+        try:
+            with self.session() as ftp:
+                ftp.storbinary('STOR ' + fname, in_fh)
+        finally:
+            self.invalidate(out_name)
 
     def __repr__(self):
         return "<FTPAccessor: %s>" % self.baseAddress
 
+class _PooledHTTPResponse(HTTPResponse):
+    """HTTPResponse which returns its keep-alive connection to the pool on close()"""
+
+    pool = None  # type: HTTPConnectionPool | None
+    pool_key = None  # type: Tuple[str, str, int] | None
+    connection = None  # type: HTTPConnection | None
+
+    def close(self):
+        # Drain a small rest of the body so the connection can be reused:
+        if self.fp and not self.will_close and self.length is not None \
+                and self.length <= HTTPConnectionPool.drain_limit:
+            try:
+                self.read()
+            except (http_client.HTTPException, socket.error):
+                self.will_close = True
+        reusable = not self.fp and not self.will_close  # fp is None at the end
+        HTTPResponse.close(self)
+        conn, self.connection = self.connection, None
+        if conn and self.pool and self.pool_key:
+            if reusable:
+                self.pool.put(self.pool_key, conn)
+            else:
+                conn.close()
+
+
+class HTTPConnectionPool(object):
+    """
+    Pool of HTTP/1.1 keep-alive connections, kept per (scheme, host, port).
+
+    Responses which are read to the end (or which have only a small rest left)
+    return their connection to the pool when they are closed. Up to maxsize
+    idle connections per host are kept for reuse by the following requests.
+    The counters opened and reused can be used to check the reuse of connections.
+    """
+
+    drain_limit = 64 * 1024
+    """Maximum rest of a response body that close() reads to keep the connection"""
+
+    max_redirects = 10
+
+    def __init__(self, maxsize=4, timeout=None):
+        # type: (int, float | None) -> None
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self.opened = 0
+        """Number of connections opened by the pool"""
+        self.reused = 0
+        """Number of requests sent on an idle connection from the pool"""
+        self.lock = threading.Lock()
+        self.idle = {}  # type: dict[Tuple[str, str, int], List[HTTPConnection]]
+
+    def get(self, key):
+        # type: (Tuple[str, str, int]) -> Tuple[HTTPConnection, bool]
+        """Return an idle connection to the host of key or a new one, and if it is reused"""
+        with self.lock:
+            connections = self.idle.get(key)
+            if connections:
+                self.reused += 1
+                return connections.pop(), True
+            self.opened += 1
+        scheme, host, port = key
+        kwargs = {}
+        if self.timeout is not None:
+            kwargs["timeout"] = self.timeout
+        if scheme == "https":
+            conn = http_client.HTTPSConnection(host, port, **kwargs)
+        else:
+            conn = http_client.HTTPConnection(host, port, **kwargs)
+        conn.response_class = _PooledHTTPResponse
+        return conn, False
+
+    def put(self, key, conn):
+        # type: (Tuple[str, str, int], HTTPConnection) -> None
+        """Return a connection to the pool, close it if the pool of the host is full"""
+        with self.lock:
+            connections = self.idle.setdefault(key, [])
+            if len(connections) < self.maxsize:
+                connections.append(conn)
+                return
+        conn.close()
+
+    def clear(self):
+        # type: () -> None
+        """Close all idle connections of the pool"""
+        with self.lock:
+            idle, self.idle = self.idle, {}
+        for connections in idle.values():
+            for conn in connections:
+                conn.close()
+
+    def request(self, key, method, selector, headers):
+        # type: (Tuple[str, str, int], str, str, dict[str, str]) -> _PooledHTTPResponse
+        """Send a request on a pooled connection, retry once if an idle one was stale"""
+        while True:
+            conn, reused = self.get(key)
+            try:
+                conn.request(method, selector, headers=headers)
+                response = cast(_PooledHTTPResponse, conn.getresponse())
+            except (http_client.HTTPException, socket.error):
+                conn.close()
+                if reused:
+                    continue  # The server closed the idle connection, open a new one
+                raise
+            response.pool, response.pool_key, response.connection = self, key, conn
+            return response
+
+    def urlopen(self, url, headers=None, method="GET"):
+        # type: (str, dict[str, str] | None, str) -> _PooledHTTPResponse
+        """
+        Open url like urllib.request.urlopen(), but using the connections of the pool.
+
+        Redirects are followed, but the Authorization header is only sent to the scheme,
+        host and port of url. urllib.error.HTTPError is raised for error responses and
+        urllib.error.URLError for connection and protocol errors.
+        """
+        origin = None
+        for _ in range(self.max_redirects + 1):
+            parts = urllib.parse.urlsplit(url)
+            scheme = parts.scheme.lower()
+            port = parts.port or (443 if scheme == "https" else 80)
+            key = (scheme, cast(str, parts.hostname), port)
+            origin = origin or key
+            selector = urllib.parse.urlunsplit(("", "", parts.path or "/", parts.query, ""))
+            request_headers = {"Host": parts.netloc.rpartition("@")[2]}
+            for name, value in (headers or {}).items():
+                if key == origin or name.lower() != "authorization":
+                    request_headers[name] = value
+            try:
+                response = self.request(key, method, selector, request_headers)
+            except (http_client.HTTPException, socket.error) as e:
+                raise urllib.error.URLError(e)
+            response.url = url
+            if response.status in (301, 302, 303, 307, 308) and response.getheader("Location"):
+                url = urllib.parse.urljoin(url, response.getheader("Location"))
+                response.close()
+                continue
+            if response.status >= 400:
+                body = response.read(self.drain_limit)
+                response.close()
+                raise urllib.error.HTTPError(url, response.status, response.reason,
+                                             response.msg, io.BytesIO(body))
+            return response
+        raise urllib.error.HTTPError(url, response.status, "Too many redirects",
+                                     response.msg, None)
+
+
+class _RangeNotReturned(IOError):
+    """Raised by HTTPAccessor.downloadFile() when a range request is not answered with 206"""
+
+
 class HTTPAccessor(Accessor):
+    pool = HTTPConnectionPool()
+    """Keep-alive connections shared by all HTTPAccessors, kept over start()/finish()"""
+
+    metadata_ttl = 60.0  # Answer repeated probes of findRepositories() from the cache
+
+    range_workers = 4
+    """Number of ranges which downloadFile() fetches concurrently"""
+    range_size = 8 * 1024 * 1024
+    """Size of the ranges fetched by downloadFile()"""
+    range_min_size = 32 * 1024 * 1024
+    """Files smaller than this are fetched as a single stream by downloadFile()"""
+
     def __init__(self, baseAddress, ro):
         assert ro
         super(HTTPAccessor, self).__init__(ro)
         self.url_parts = urllib.parse.urlsplit(baseAddress, allow_fragments=False)
+        self.headers = {}  # type: dict[str, str]
 
         assert self.url_parts.hostname
         if self.url_parts.username:
@@ -380,21 +1093,361 @@ class HTTPAccessor(Accessor):
             self.authhandler = urllib.request.HTTPBasicAuthHandler(self.passman)
             self.opener = urllib.request.build_opener(self.authhandler)
             urllib.request.install_opener(self.opener)
+            # The pooled connections send the credentials without waiting for a 401:
+            login = "%s:%s" % (username, password or "")
+            self.headers["Authorization"] = "Basic " + \
+                base64.b64encode(login.encode("utf-8")).decode("ascii")
 
         self.baseAddress = rebuild_url(self.url_parts)
 
+    def _use_pool(self):
+        # type: () -> bool
+        """Return False if a proxy is configured for the host: urlopen() handles proxies"""
+        proxies = urllib.request.getproxies()
+        return self.url_parts.scheme not in proxies or \
+            bool(urllib.request.proxy_bypass(cast(str, self.url_parts.hostname)))
+
     def openAddress(self, address):
+        url = os.path.join(self.baseAddress, address)
         try:
-            urlFile = urllib.request.urlopen(os.path.join(self.baseAddress, address))
+            if self._use_pool():
+                urlFile = self.pool.urlopen(url, self.headers)
+            else:
+                urlFile = urllib.request.urlopen(url)
         except urllib.error.HTTPError as e:
             self.lastError = e.code
             return False
+        except urllib.error.URLError as e:
+            logger.debug("Failed to open %s: %s" % (url, e.reason))
+            self.lastError = 500
+            return False
         return urlFile
 
+    def _head(self, name):
+        # type: (str) -> _PooledHTTPResponse
+        """Send a HEAD request for name, raises urllib.error.HTTPError on errors"""
+        response = self.pool.urlopen(os.path.join(self.baseAddress, name),
+                                     self.headers, method="HEAD")
+        response.close()
+        return response
+
+    def _stat(self, name):
+        if not self._use_pool():
+            return super(HTTPAccessor, self)._stat(name)
+        try:
+            response = self._head(name)
+        except urllib.error.HTTPError as e:
+            if e.code in (405, 501):  # The server does not support HEAD
+                return super(HTTPAccessor, self)._stat(name)
+            self.lastError = e.code
+            return MISSING
+        except urllib.error.URLError as e:
+            logger.debug("Failed to stat %s: %s" % (name, e.reason))
+            self.lastError = 500
+            return MISSING
+        size = response.getheader("Content-Length")
+        last_modified = response.getheader("Last-Modified")
+        parsed = parsedate_tz(last_modified) if last_modified else None
+        return AddressInfo(True, size and int(size), mktime_tz(parsed) if parsed else None,
+                           response.getheader("ETag"))
+
+    def downloadFile(self, address, path):
+        # type: (str, str) -> bool
+        """
+        Download address to the local file path.
+
+        When the server accepts range requests, files of at least range_min_size
+        are fetched as ranges of range_size by range_workers threads, which write
+        them to their offsets in path. The finished ranges are recorded in
+        path + ".ranges", so an interrupted download resumes with the missing ranges
+        when downloadFile() is called again and the ETag and size did not change.
+        Otherwise, the file is fetched as a single stream. Returns False and sets
+        lastError if the server returns an error.
+        """
+        try:
+            response = self._head(address) if self._use_pool() else None
+        except urllib.error.HTTPError as e:
+            if e.code not in (405, 501):
+                self.lastError = e.code
+                return False
+            response = None
+        except urllib.error.URLError as e:
+            logger.debug("Failed to stat %s: %s" % (address, e.reason))
+            self.lastError = 500
+            return False
+        size = int(response.getheader("Content-Length") or 0) if response else 0
+        if not response or size < self.range_min_size or \
+                response.getheader("Accept-Ranges", "").lower() != "bytes":
+            return super(HTTPAccessor, self).downloadFile(address, path)
+
+        url = os.path.join(self.baseAddress, address)
+        state = {"size": size, "etag": response.getheader("ETag"),
+                 "mtime": response.getheader("Last-Modified"),
+                 "done": []}  # type: dict[str, Any]  # saved as JSON to path.ranges
+        state_path = path + ".ranges"
+        try:
+            with open(state_path) as state_file:
+                saved = json.load(state_file)
+            if all(saved.get(key) == state[key] for key in ("size", "etag", "mtime")) \
+                    and os.path.getsize(path) == size:
+                state["done"] = saved["done"]
+        except (IOError, OSError, ValueError):
+            pass
+
+        validator = state["etag"] or state["mtime"]
+        todo = [offset for offset in range(0, size, self.range_size)
+                if offset not in state["done"]]
+        lock = threading.Lock()
+
+        def fetch(offset):
+            # type: (int) -> None
+            """Fetch the range at offset and write it to its offset in fd"""
+            end = min(offset + self.range_size, size) - 1
+            headers = dict(self.headers, Range="bytes=%d-%d" % (offset, end))
+            if validator:
+                headers["If-Range"] = validator
+            range_response = self.pool.urlopen(url, headers)
+            with range_response:
+                if range_response.status != 206:
+                    raise _RangeNotReturned("%s: Range %d-%d not returned (status %d)"
+                                            % (url, offset, end, range_response.status))
+                position = offset
+                while position <= end:
+                    data = range_response.read(min(256 * 512, end + 1 - position))
+                    if not data:
+                        raise IOError("%s: Range %d-%d ended at %d" % (url, offset, end, position))
+                    view = memoryview(data)
+                    while view:  # os.pwrite() may write only a part of view
+                        written = os.pwrite(fd, view, position)
+                        view = view[written:]
+                        position += written
+            with lock:
+                state["done"].append(offset)
+                with open(state_path, "w") as state_file:
+                    json.dump(state, state_file)
+
+        from concurrent.futures import ThreadPoolExecutor
+
+        logger.info("Downloading %s to %s using %d ranges (%d done)"
+                    % (url, path, len(todo), len(state["done"])))
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT, 0o666)
+        try:
+            if not state["done"]:
+                os.ftruncate(fd, size)
+            with ThreadPoolExecutor(self.range_workers) as executor:
+                futures = [executor.submit(fetch, offset) for offset in todo]
+                try:
+                    for future in futures:
+                        future.result()
+                finally:  # On errors, do not start the remaining ranges
+                    for future in futures:
+                        future.cancel()
+            if self.fsync:
+                os.fsync(fd)
+        except urllib.error.HTTPError as e:
+            self.lastError = e.code
+            return False
+        except _RangeNotReturned as e:
+            # The server ignored the Range (e.g. a proxy or a changed file): start over
+            logger.info("%s, downloading it as a single stream" % e)
+            for partial in (state_path, path):
+                if os.path.exists(partial):
+                    os.unlink(partial)
+            return super(HTTPAccessor, self).downloadFile(address, path)
+        except (urllib.error.URLError, IOError, OSError) as e:
+            logger.debug("Failed to download %s: %s" % (url, e))
+            self.lastError = 500
+            return False
+        finally:
+            os.close(fd)
+        if os.path.exists(state_path):
+            os.unlink(state_path)
+        return True
+
     def __repr__(self):
         return "<HTTPAccessor: %s>" % self.baseAddress
 
 
+class _CachingReader(io.RawIOBase):
+    """Reader which copies what it reads into a new entry of a CachingAccessor"""
+
+    def __init__(self, cache, source, path, md5sum, size):
+        # type: (CachingAccessor, IO[bytes], str, str | None, int | None) -> None
+        super(_CachingReader, self).__init__()
+        self.cache = cache
+        self.source = source
+        self.path = path
+        self.md5sum = md5sum
+        self.size = size
+        self.written = 0
+        self.md5 = hashlib.md5()
+        self.tmp = tempfile.NamedTemporaryFile(dir=cache.cache_dir, prefix=".tmp-",
+                                               delete=False)  # type: IO[bytes] | None
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        data = self.source.read(len(b))
+        if not data:
+            self._commit()
+            return 0
+        b[:len(data)] = data
+        if self.tmp:
+            self.tmp.write(data)
+            self.md5.update(data)
+            self.written += len(data)
+        return len(data)
+
+    def _commit(self):
+        """Add the copy to the cache when the source was read to the end"""
+        if not self.tmp:
+            return
+        self.tmp.close()
+        if self.md5sum and self.md5.hexdigest() != self.md5sum:
+            logger.info("Not caching %s: md5sum mismatch" % self.path)
+            os.unlink(self.tmp.name)
+        elif self.size is not None and self.written != self.size:
+            logger.info("Not caching %s: read %d of %d bytes"
+                        % (self.path, self.written, self.size))
+            os.unlink(self.tmp.name)
+        else:
+            os.rename(self.tmp.name, self.path)
+            self.cache.added(self.written)
+        self.tmp = None
+
+    def close(self):
+        if self.tmp:  # Do not cache partial reads
+            self.tmp.close()
+            os.unlink(self.tmp.name)
+            self.tmp = None
+        self.source.close()
+        super(_CachingReader, self).close()
+
+
+class CachingAccessor(Accessor):
+    """
+    Accessor which keeps local copies of the files read from another accessor.
+
+    The files are stored in cache_dir under a key of the URL and the validators
+    returned by stat() (ETag, Last-Modified and size), or when openAddress() is
+    passed the md5sum of the file (e.g. from XS-PACKAGES), under this md5sum, so the
+    same file is found in the cache regardless of its source. Files are added to the
+    cache when they are read to the end and have the md5sum or the size from stat().
+    When the cache grows beyond max_bytes, the least recently used files are removed.
+    The counters hits and misses count the files opened from the cache and from the
+    accessor.
+
+    Example usage::
+
+        accessor = CachingAccessor(createAccessor(url, True), "/var/cache/xcp", 10 << 30)
+    """
+
+    def __init__(self, accessor, cache_dir, max_bytes):
+        # type: (AnyAccessor, str, int) -> None
+        super(CachingAccessor, self).__init__(accessor.read_only)
+        self.accessor = accessor
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.threadsafe = accessor.threadsafe
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.cached_bytes = None  # type: int | None  # Size of the cache after evict()
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+    def start(self):
+        self.accessor.start()
+
+    def finish(self):
+        self.accessor.finish()
+
+    def canEject(self):
+        return self.accessor.canEject()
+
+    def stat(self, name):
+        info = self.accessor.stat(name)
+        self.lastError = self.accessor.threadLastError
+        return info
+
+    def invalidate(self, name=None):
+        self.accessor.invalidate(name)
+
+    def writeFile(self, in_fh, out_name):
+        return self.accessor.writeFile(in_fh, out_name)
+
+    def _key(self, address, md5sum):
+        # type: (str, str | None) -> Tuple[str | None, int | None]
+        """Return the cache key of address (None if it has no validators) and its size"""
+        if md5sum:
+            return "md5-" + md5sum.lower(), None
+        info = self.stat(address)
+        if not info.exists or (info.etag is None and info.mtime is None):
+            return None, None
+        key = "%r\0%s\0%s\0%s\0%s" % (self.accessor, address, info.etag, info.mtime, info.size)
+        return hashlib.sha256(key.encode("utf-8")).hexdigest(), info.size
+
+    def openAddress(self, address, md5sum=None):
+        # type: (str, str | None) -> IO[bytes] | Literal[False]
+        """Open address from the cache, or from the accessor while adding it to the cache"""
+        key, size = self._key(address, md5sum)
+        path = key and os.path.join(self.cache_dir, key)
+        if path and os.path.exists(path):
+            try:
+                filehandle = open(path, "rb")
+            except (IOError, OSError):
+                pass  # evicted by another process
+            else:
+                os.utime(path, None)
+                self.hits += 1
+                return filehandle
+        self.misses += 1
+        source = self.accessor.openAddress(address)  # type: IO[bytes] | Literal[False]
+        self.lastError = self.accessor.threadLastError
+        if not source or not path:
+            return source
+        return io.BufferedReader(_CachingReader(self, source, path, md5sum, size))
+
+    def added(self, size):
+        # type: (int) -> None
+        """Account for a file of size added to the cache, evict() if it exceeds max_bytes"""
+        with self.lock:
+            if self.cached_bytes is not None:
+                self.cached_bytes += size
+                if self.cached_bytes <= self.max_bytes:
+                    return
+        self.evict()
+
+    def evict(self):
+        # type: () -> None
+        """Remove the least recently used files until the cache fits into max_bytes"""
+        entries = []
+        total = 0
+        for name in os.listdir(self.cache_dir):
+            if name.startswith(".tmp-"):
+                continue
+            try:
+                st = os.stat(os.path.join(self.cache_dir, name))
+            except OSError:
+                continue
+            entries.append((st.st_mtime, name, st.st_size))
+            total += st.st_size
+        for _, name, size in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.unlink(os.path.join(self.cache_dir, name))
+            except OSError:
+                continue
+            total -= size
+        with self.lock:
+            self.cached_bytes = total
+
+    def __repr__(self):
+        return "<CachingAccessor: %r>" % self.accessor
+
+
 # Tuple passed in tests to isinstanc(val, ...Types) to check types:
 MountingAccessorTypes = (DeviceAccessor, NFSAccessor)
 """Tuple for type checking in unit tests testing subclasses of MountingAccessor"""
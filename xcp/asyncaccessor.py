@@ -0,0 +1,128 @@
+"""asyncaccessor - asyncio interface to the accessors of xcp.accessor (Python 3 only)"""
+
+import asyncio
+import functools
+from typing import TYPE_CHECKING, TypeVar, cast
+
+from xcp.accessor import createAccessor
+
+if TYPE_CHECKING:
+    from typing import IO, Any, Callable, List, Tuple
+
+    from typing_extensions import Literal
+
+    from xcp.accessor import Accessor, AnyAccessor
+
+T = TypeVar("T")
+
+
+class AsyncFile(object):
+    """File object returned by AsyncAccessor.open_address() with awaitable methods"""
+
+    def __init__(self, accessor, fileobj):
+        # type: (AsyncAccessor, IO[bytes]) -> None
+        self.accessor = accessor
+        self.fileobj = fileobj
+
+    async def read(self, size=-1):
+        # type: (int) -> bytes
+        return await self.accessor.run(self.fileobj.read, size)
+
+    async def close(self):
+        # type: () -> None
+        await self.accessor.run(self.fileobj.close)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+
+class AsyncAccessor(object):
+    """
+    asyncio interface to an Accessor returned by createAsyncAccessor().
+
+    The blocking methods of the accessor run in the default executor of the event
+    loop. At most concurrency calls run at the same time (one if the accessor is
+    not threadsafe), so a caller can gather() many requests without opening an
+    unbounded number of connections.
+
+    Example usage::
+
+        async with createAsyncAccessor("http://example.com/repo/", True) as accessor:
+            data = await asyncio.gather(*(accessor.read_all(name) for name in names))
+    """
+
+    def __init__(self, accessor, concurrency=8):
+        # type: (Accessor, int) -> None
+        self.accessor = accessor
+        self.concurrency = concurrency if accessor.threadsafe else 1
+        self.semaphore = None  # type: asyncio.Semaphore | None
+
+    async def run(self, func, *args):
+        # type: (Callable[..., T], *Any) -> T
+        """Run func(*args) in the executor when less than concurrency calls are running"""
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.concurrency)
+        async with self.semaphore:
+            loop = asyncio.get_event_loop()
+            return await loop.run_in_executor(None, functools.partial(func, *args))
+
+    async def start(self):
+        await self.run(self.accessor.start)
+
+    async def finish(self):
+        await self.run(self.accessor.finish)
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.finish()
+
+    @property
+    def lastError(self):
+        return self.accessor.lastError
+
+    async def open_address(self, address):
+        # type: (str) -> AsyncFile | Literal[False]
+        """Return an AsyncFile to read address or False (see Accessor.openAddress())"""
+        fileobj = await self.run(self.accessor.openAddress, address)
+        return AsyncFile(self, fileobj) if fileobj else False
+
+    async def access(self, name):
+        # type: (str) -> bool
+        return await self.run(self.accessor.access, name)
+
+    async def read_all(self, address):
+        # type: (str) -> bytes | Literal[False]
+        """Return the contents of address or False if it cannot be opened"""
+
+        def read_all():
+            fileobj = self.accessor.openAddress(address)
+            if not fileobj:
+                return False
+            with fileobj:
+                return fileobj.read()
+
+        return await self.run(read_all)
+
+    async def copy_to(self, address, path):
+        # type: (str, str) -> bool
+        """Copy address to the local file path (see Accessor.downloadFile())"""
+        return await self.run(self.accessor.downloadFile, address, path)
+
+    def __repr__(self):
+        return "<AsyncAccessor: %r>" % self.accessor
+
+
+def createAsyncAccessor(baseAddress, *args, concurrency=8):
+    # type: (str, bool | Tuple[bool, List[str]], int) -> AsyncAccessor
+    """
+    Return an AsyncAccessor for the Accessor returned by createAccessor(baseAddress, *args).
+
+    :param concurrency (int): The maximum number of concurrent requests
+    """
+    return AsyncAccessor(cast("AnyAccessor", createAccessor(baseAddress, *args)), concurrency)
@@ -44,17 +44,24 @@ __credits__ = "Lars Gustäbel, Gustavo Niemeyer, Niels Gustäbel, Richard Townse
 #---------
 # Imports
 #---------
+import binascii
 import bz2
+import collections
 import gzip
 import sys
 import os
+import posixpath
 import shutil
 import stat
 import errno
 import time
 import struct
 import copy
+import hashlib
 import io
+import json
+import mmap
+import tempfile
 from typing import IO, TYPE_CHECKING, Any, List, Optional, cast
 
 import six
@@ -89,6 +96,41 @@ NUL             = b"\0"              # the null character
 BLOCKSIZE       = 512                # length of processing blocks
 HEADERSIZE_SVR4 = 110                # length of fixed header
 
+# The fixed header is the magic followed by 13 fields of 8 hex digits:
+HEADER_FORMAT   = b"%06X" + 13 * b"%08X"
+HEADER_FIELDS   = struct.Struct(">13L")  # the fields after unhexlify()
+
+ZSTD_MAGIC      = b"\x28\xb5\x2f\xfd"  # magic of zstd frames
+LZ4_MAGIC       = b"\x04\x22\x4d\x18"  # magic of lz4 frames
+LZ4_LEGACY_MAGIC = b"\x02\x21\x4c\x18"  # magic of the lz4 legacy format (lz4 -l)
+GZIP_HEADER     = b"\037\213\010\0\0\0\0\0\0\377"  # no name, mtime 0
+
+#---------------------------------------------------------
+# member index (sidecar file) constants
+#---------------------------------------------------------
+MAXSYMLINKS     = 40                 # symbolic links to follow in a path
+LINK_CACHE_SIZE = 4096               # resolved symbolic links to cache
+INDEX_VERSION   = 1                  # format version of the index file
+INDEX_HASHSIZE  = 64 * 1024          # bytes hashed at both ends of the archive
+INDEX_FIELDS    = ("name", "linkname", "ino", "mode", "uid", "gid", "nlink",
+                   "mtime", "size", "devmajor", "devminor", "rdevmajor",
+                   "rdevminor", "namesize", "check", "offset", "offset_data")
+
+COMPRESSION_MAGIC = {           # magic of the streams of each comptype
+    "gz": b"\037\213",
+    "bz2": b"BZh",
+    "xz": b"\xfd7zXZ\0",
+    "zst": ZSTD_MAGIC,
+    "lz4": LZ4_MAGIC,
+}
+COMPRESSLEVEL = {               # default compression level of each comptype
+    "gz": 9,
+    "bz2": 9,
+    "xz": 6,
+    "zst": 3,
+    "lz4": 0,
+}
+
 #---------------------------------------------------------
 # Bits used in the mode field, values in octal.
 #---------------------------------------------------------
@@ -142,6 +184,131 @@ def copyfileobj(src, dst, length=None):
         dst.write(buf)
     return
 
+def _import_zstandard():
+    """Return the optional zstandard module for zstd compression."""
+    try:
+        import zstandard
+    except ImportError:
+        raise CompressionError("zstandard module is not available")
+    return zstandard
+
+def _import_lz4_frame():
+    """Return the lz4.frame module of the optional lz4 package."""
+    try:
+        import lz4.frame
+    except ImportError:
+        raise CompressionError("lz4 module is not available")
+    return lz4.frame
+
+def _import_lz4_block():
+    """Return the lz4.block module of the optional lz4 package."""
+    try:
+        import lz4.block
+    except ImportError:
+        raise CompressionError("lz4 module is not available")
+    return lz4.block
+
+def _source_date_epoch():
+    """Return the timestamp $SOURCE_DATE_EPOCH which reproducible builds
+       use instead of the current time, or None if it is not set.
+    """
+    epoch = os.environ.get("SOURCE_DATE_EPOCH")
+    return int(epoch) if epoch else None
+
+def _check_magic(name, fileobj, magic):
+    """Raise ReadError unless the file starts with magic. If fileobj is
+       given, it is used instead of opening name and is not moved.
+    """
+    if fileobj is None:
+        with bltn_open(name, "rb") as f:
+            buf = f.read(len(magic))
+    else:
+        pos = fileobj.tell()
+        buf = fileobj.read(len(magic))
+        fileobj.seek(pos)
+    if buf != magic:
+        raise ReadError("not a %s file" % ("zstd" if magic == ZSTD_MAGIC else "lz4"))
+
+class _LZ4LegacyDecompressor(object):
+    """Decompressor of the lz4 legacy format (lz4 -l), which dracut and the
+       kernel use for lz4 compressed initrds, with the interface of
+       bz2.BZ2Decompressor: After the magic, blocks of up to 8 MiB are
+       compressed separately, each preceded by its compressed size as 32-bit
+       little-endian integer. The format has no end marker: eof is set at a
+       block size which is not valid, e.g. at NUL padding or at the next
+       segment of an initrd, which is left in unused_data.
+    """
+    BLOCKSIZE = 8 * 1024 * 1024
+    MAX_COMPRESSED = BLOCKSIZE + BLOCKSIZE // 255 + 16  # LZ4_compressBound()
+
+    def __init__(self):
+        self.lz4_block = _import_lz4_block()
+        self.buf = bytearray()  # compressed data which is not decompressed yet
+        self.out = bytearray()  # decompressed data which is not returned yet
+        self.eof = False
+        self.unused_data = b""
+
+    def _blocksize(self):
+        """Return the size of the next block, or None if it is incomplete"""
+        if len(self.buf) < 4:
+            return None
+        size = struct.unpack("<L", bytes(self.buf[:4]))[0]
+        if 0 < size <= self.MAX_COMPRESSED and len(self.buf) < 4 + size:
+            return None
+        return size
+
+    @property
+    def needs_input(self):
+        return not self.eof and not self.out and self._blocksize() is None
+
+    def decompress(self, data, max_length=-1):
+        """Return up to max_length bytes (if not negative) decompressed from
+           data and the data passed before.
+        """
+        if self.eof:
+            raise EOFError("End of stream already reached")
+        self.buf += data
+        while max_length < 0 or len(self.out) < max_length:
+            size = self._blocksize()
+            if size is None:
+                break
+            if size == 0x184c2102:  # the magic, also between the blocks
+                del self.buf[:4]
+            elif not 0 < size <= self.MAX_COMPRESSED:
+                self.eof = True
+                self.unused_data = bytes(self.buf)
+                self.buf = bytearray()
+                break
+            else:
+                self.out += self.lz4_block.decompress(bytes(self.buf[4:4 + size]),
+                                                      uncompressed_size=self.BLOCKSIZE)
+                del self.buf[:4 + size]
+        size = len(self.out) if max_length < 0 else max_length
+        data = bytes(self.out[:size])
+        del self.out[:size]
+        return data
+
+def _consume(buf, size):
+    """Remove up to size bytes from the start of the bytearray buf and
+       return them as bytes.
+    """
+    with memoryview(buf) as view:
+        data = view[:size].tobytes()
+    del buf[:size]
+    return data
+
+def _consume_into(buf, b):
+    """Move up to len(b) bytes from the start of the bytearray buf into
+       the writable buffer b and return their number.
+    """
+    with memoryview(b) as target, memoryview(buf) as view:
+        target = target.cast("B")
+        size = min(len(target), len(view))
+        target[:size] = view[:size]
+        target.release()
+    del buf[:size]
+    return size
+
 FILEMODE_TABLE = (
     ((S_IFLNK,      "l"),
      (S_IFREG,      "-"),
@@ -244,11 +411,22 @@ class _Stream(object):
        A stream-like object could be for example: sys.stdin,
        sys.stdout, a socket, a tape device etc.
 
+       The data is buffered in bytearrays from which it is consumed at the
+       front, and decompressed in chunks bounded by the size requested by
+       the reader, so the memory used does not depend on the member sizes.
+
+       Concatenated compressed streams, like _ParallelStream writes them,
+       are read as one. If segment is true, only one compressed stream is
+       read, and unused() returns the data following it: This is used to
+       find the segments of concatenated archives like initrds.
+
        _Stream is intended to be used only internally.
     """
 
-    def __init__(self, name, mode, comptype, fileobj, bufsize):
-        """Construct a _Stream object.
+    def __init__(self, name, mode, comptype, fileobj, bufsize, segment=False,
+                 compresslevel=None, mtime=None):
+        """Construct a _Stream object. mtime is the timestamp of the gzip
+           header, default $SOURCE_DATE_EPOCH or the current time.
         """
         self._extfileobj = True
         if fileobj is None:
@@ -266,9 +444,15 @@ class _Stream(object):
         self.comptype = comptype
         self.fileobj  = fileobj
         self.bufsize  = bufsize
-        self.buf      = b""
+        self.buf      = bytearray()  # raw data of the stream
+        self.dbuf     = bytearray()  # decompressed data
         self.pos      = 0
         self.closed   = False
+        self.segment  = segment
+        self.compresslevel = compresslevel
+        if compresslevel is None:
+            self.compresslevel = COMPRESSLEVEL.get(comptype, 0)
+        self.mtime = mtime
 
         if comptype == "gz":
             try:
@@ -284,10 +468,10 @@ class _Stream(object):
 
         if comptype == "bz2":
             if mode == "r":
-                self.dbuf = b""
+                self.decompressor = bz2.BZ2Decompressor
                 self.cmp = bz2.BZ2Decompressor()
             else:
-                self.cmp = bz2.BZ2Compressor()
+                self.cmp = bz2.BZ2Compressor(self.compresslevel)
 
         if comptype == "xz":
             try:
@@ -295,10 +479,36 @@ class _Stream(object):
             except ImportError:
                 raise CompressionError("lzma module is not available")
             if mode == "r":
-                self.dbuf = b""
+                self.decompressor = lzma.LZMADecompressor
                 self.cmp = lzma.LZMADecompressor()
             else:
-                self.cmp = lzma.LZMACompressor()
+                self.cmp = lzma.LZMACompressor(preset=self.compresslevel)
+
+        if comptype == "zst":
+            zstandard = _import_zstandard()
+            if mode == "r" and segment:
+                # Only the decompressobj() stops at the end of the frame
+                self.cmp = zstandard.ZstdDecompressor().decompressobj()
+            elif mode == "r":
+                # zstd decompressobj() has no max_length: Use a reader instead
+                self.cmp = zstandard.ZstdDecompressor().stream_reader(
+                    fileobj, read_across_frames=True, closefd=False)
+            else:
+                self.cmp = zstandard.ZstdCompressor(
+                    level=self.compresslevel).compressobj()
+
+        if comptype == "lz4":
+            lz4_frame = _import_lz4_frame()
+            if mode == "r" and self.__fill(4).startswith(LZ4_LEGACY_MAGIC):
+                self.decompressor = _LZ4LegacyDecompressor
+                self.cmp = _LZ4LegacyDecompressor()
+            elif mode == "r":
+                self.decompressor = lz4_frame.LZ4FrameDecompressor
+                self.cmp = lz4_frame.LZ4FrameDecompressor()
+            else:
+                self.cmp = lz4_frame.LZ4FrameCompressor(
+                    compression_level=self.compresslevel)
+                self.__write(self.cmp.begin())
 
 
     def __del__(self):
@@ -308,11 +518,12 @@ class _Stream(object):
     def _init_write_gz(self):
         """Initialize for writing with gzip compression.
         """
-        self.cmp = self.zlib.compressobj(9, self.zlib.DEFLATED,
+        self.cmp = self.zlib.compressobj(self.compresslevel, self.zlib.DEFLATED,
                                             -self.zlib.MAX_WBITS,
                                             self.zlib.DEF_MEM_LEVEL,
                                             0)
-        timestamp = struct.pack("<L", int(time.time()))
+        mtime = _source_date_epoch() if self.mtime is None else self.mtime
+        timestamp = struct.pack("<L", int(time.time()) if mtime is None else mtime)
         self.__write(b"\037\213\010\010%s\002\377" % timestamp)
         if self.name.endswith(".gz"):
             self.name = self.name[:-3]
@@ -333,9 +544,12 @@ class _Stream(object):
            is ready to be written.
         """
         self.buf += s
-        while len(self.buf) > self.bufsize:
-            self.fileobj.write(self.buf[:self.bufsize])
-            self.buf = self.buf[self.bufsize:]
+        if len(self.buf) > self.bufsize:
+            end = (len(self.buf) - 1) // self.bufsize * self.bufsize
+            with memoryview(self.buf) as view:
+                for start in range(0, end, self.bufsize):
+                    self.fileobj.write(view[start:start + self.bufsize].tobytes())
+            del self.buf[:end]
 
     def close(self):
         """Close the _Stream object. No operation should be
@@ -348,8 +562,8 @@ class _Stream(object):
             self.buf += cast(bz2.BZ2Compressor, self.cmp).flush()
 
         if self.mode == "w" and self.buf:
-            self.fileobj.write(self.buf)
-            self.buf = b""
+            self.fileobj.write(bytes(self.buf))
+            self.buf = bytearray()
             if self.comptype == "gz":
                 # The native zlib crc is an unsigned 32-bit integer, but
                 # the Python wrapper implicitly casts that to a signed C
@@ -369,7 +583,6 @@ class _Stream(object):
         """Initialize for reading a gzip compressed fileobj.
         """
         self.cmp = self.zlib.decompressobj(-self.zlib.MAX_WBITS)
-        self.dbuf = b""
 
         # taken from gzip.GzipFile with some alterations
         if self.__read(2) != b"\037\213":
@@ -382,7 +595,7 @@ class _Stream(object):
 
         if flag & 4:
             xlen = ord(self.__read(1)) + 256 * ord(self.__read(1))
-            self.read(xlen)
+            self.__read(xlen)
         if flag & 8:
             while True:
                 s = self.__read(1)
@@ -406,10 +619,14 @@ class _Stream(object):
            is forbidden.
         """
         if pos - self.pos >= 0:
-            blocks, remainder = divmod(pos - self.pos, self.bufsize)
-            for i in range(blocks):
-                self.read(self.bufsize)
-            self.read(remainder)
+            # Skip the data in the buffer without copying it out:
+            while self.pos < pos:
+                buf = self._fill(min(pos - self.pos, self.bufsize))
+                if not buf:
+                    break
+                size = min(pos - self.pos, len(buf))
+                del buf[:size]
+                self.pos += size
         else:
             raise StreamError("seeking backwards is not allowed")
         return self.pos
@@ -432,40 +649,127 @@ class _Stream(object):
         self.pos += len(buf)
         return buf
 
+    def readinto(self, b):
+        """Read up to len(b) bytes from the stream into the writable
+           buffer b and return the number of bytes read.
+        """
+        size = _consume_into(self._fill(len(b)), b)
+        self.pos += size
+        return size
+
     def _read(self, size):
         """Return size bytes from the stream.
         """
+        return _consume(self._fill(size), size)
+
+    def _fill(self, size):
+        """Fill the buffer of (decompressed) data with up to size bytes
+           and return it.
+        """
         if self.comptype == "cpio":
-            return self.__read(size)
+            return self.__fill(size)
 
-        c = len(self.dbuf)
-        t = [self.dbuf]
-        while c < size:
-            buf = self.__read(self.bufsize)
-            if not buf:
+        while len(self.dbuf) < size:
+            buf = self._decompress(max(size - len(self.dbuf), self.bufsize))
+            if buf is None:
                 break
-            buf = cast(bz2.BZ2Decompressor, self.cmp).decompress(buf)
-            t.append(buf)
-            c += len(buf)
-        t = b"".join(t)
-        self.dbuf = t[size:]
-        return t[:size]
+            self.dbuf += buf
+        return self.dbuf
+
+    def _decompress(self, max_length):
+        """Return up to max_length bytes of decompressed data, or None at
+           the end of the compressed data.
+        """
+        if self.comptype == "gz":
+            # At the eof, unconsumed_tail is the data after the stream:
+            if self.cmp.eof and not self._next_stream():
+                return None
+            cmp = self.cmp
+            data = cmp.unconsumed_tail
+            if not data:
+                data = self.__read(self.bufsize)
+                if not data:
+                    return None
+            return cmp.decompress(data, max_length)
+
+        if self.comptype == "zst" and not self.segment:
+            return self.cmp.read(max_length) or None
+
+        if self.comptype == "zst":
+            # decompressobj() has neither max_length nor needs_input
+            if self.cmp.eof:
+                return None
+            data = self.__read(self.bufsize)
+            if not data:
+                return None
+            return self.cmp.decompress(data)
+
+        if self.cmp.eof and not self._next_stream():
+            return None
+        cmp = cast(bz2.BZ2Decompressor, self.cmp)
+        data = b""
+        if cmp.needs_input:
+            data = self.__read(self.bufsize)
+            if not data:
+                return None
+        return cmp.decompress(data, max_length)
+
+    def unused(self):
+        """Skip the rest of the compressed data and return the data which
+           was read from the stream beyond its end.
+        """
+        self.dbuf = bytearray()
+        while self._decompress(self.bufsize) is not None:
+            pass
+        return self._unused()
+
+    def _unused(self):
+        """Return and remove the data which was read from the stream
+           beyond the end of the compressed stream at its eof.
+        """
+        unused = bytes(self.cmp.unused_data or b"")  # lz4 may have None
+        if self.comptype == "gz":
+            # Skip the CRC32 and ISIZE which follow the deflate data.
+            self.__fill(8 - len(unused))
+            unused = (unused + bytes(self.buf))[8:]
+        else:
+            unused += bytes(self.buf)
+        self.buf = bytearray()
+        return unused
+
+    def _next_stream(self):
+        """At the eof of a compressed stream, start to decompress the
+           next one if another stream of the same comptype follows it.
+           Return False if not.
+        """
+        if self.segment or self.comptype == "zst":  # zst reads across frames
+            return False
+        self.buf[:0] = self._unused()
+        magic = COMPRESSION_MAGIC[self.comptype]
+        if not self.__fill(len(magic)).startswith(magic):
+            return False
+        if self.comptype == "gz":
+            self._init_read_gz()
+        else:
+            self.cmp = self.decompressor()
+        return True
 
     def __read(self, size):
         """Return size bytes from stream. If internal buffer is empty,
            read another block from the stream.
         """
-        c = len(self.buf)
-        t = [self.buf]
-        while c < size:
+        return _consume(self.__fill(size), size)
+
+    def __fill(self, size):
+        """Fill the buffer with up to size bytes of raw data from the
+           stream and return it.
+        """
+        while len(self.buf) < size:
             buf = self.fileobj.read(self.bufsize)
             if not buf:
                 break
-            t.append(buf)
-            c += len(buf)
-        t = b"".join(t)
-        self.buf = t[size:]
-        return t[:size]
+            self.buf += buf
+        return self.buf
 # class _Stream
 
 class _StreamProxy(object):
@@ -483,18 +787,128 @@ class _StreamProxy(object):
         return self.buf
 
     def getcomptype(self):
-        if self.buf.startswith(b"\037\213\010"):
-            return "gz"
-        if self.buf.startswith(b"BZh91"):
-            return "bz2"
-        if self.buf.startswith(b"\xfd7zXZ\0"):
-            return "xz"
+        for comptype, magic in COMPRESSION_MAGIC.items():
+            if self.buf.startswith(magic):
+                return comptype
+        if self.buf.startswith(LZ4_LEGACY_MAGIC):
+            return "lz4"
         return "cpio"
 
     def close(self):
         self.fileobj.close()
 # class StreamProxy
 
+def _compress_block(comptype, compresslevel, data):
+    """Compress data into a complete compressed stream (a gzip member, a
+       bzip2 or xz stream or a zstd or lz4 frame). Such streams can be
+       concatenated and are decompressed as one by the stock tools.
+    """
+    if comptype == "gz":
+        import zlib
+        cmp = zlib.compressobj(compresslevel, zlib.DEFLATED, -zlib.MAX_WBITS,
+                               zlib.DEF_MEM_LEVEL, 0)
+        trailer = struct.pack("<LL", zlib.crc32(data) & 0xffffffff,
+                              len(data) & 0xffffffff)
+        return b"".join((GZIP_HEADER, cmp.compress(data), cmp.flush(), trailer))
+    if comptype == "bz2":
+        return bz2.compress(data, compresslevel)
+    if comptype == "xz":
+        import lzma
+        return lzma.compress(data, preset=compresslevel)
+    if comptype == "zst":
+        return _import_zstandard().ZstdCompressor(level=compresslevel).compress(data)
+    return _import_lz4_frame().compress(data, compression_level=compresslevel)
+
+class _ParallelStream(object):
+    """Write-only stream that splits the data into blocks of blocksize
+       bytes which are compressed independently by a pool of `workers`
+       threads (the compressors release the GIL while compressing).
+       The compressed blocks are written in order as concatenated
+       streams, see _compress_block().
+
+       _ParallelStream is intended to be used only internally.
+    """
+
+    def __init__(self, name, comptype, fileobj, compresslevel, workers, blocksize):
+        if comptype == "zst":
+            _import_zstandard()
+        elif comptype == "lz4":
+            _import_lz4_frame()
+        elif comptype == "xz":
+            try:
+                import lzma  # pylint: disable=unused-import
+            except ImportError:
+                raise CompressionError("lzma module is not available")
+        elif comptype not in COMPRESSION_MAGIC:
+            raise CompressionError("unknown compression type %r" % comptype)
+        if blocksize <= 0:
+            raise ValueError("blocksize must be positive")
+
+        self._extfileobj = True
+        if fileobj is None:
+            fileobj = bltn_open(name, "wb")
+            self._extfileobj = False
+        from concurrent.futures import ThreadPoolExecutor
+
+        self.name = name or ""
+        self.mode = "w"
+        self.comptype = comptype
+        self.fileobj = fileobj
+        if compresslevel is None:
+            compresslevel = COMPRESSLEVEL[comptype]
+        self.compresslevel = compresslevel
+        self.workers = workers
+        self.blocksize = blocksize
+        self.pool = ThreadPoolExecutor(workers)
+        self.pending = collections.deque()  # futures of the compressed blocks
+        self.buf = bytearray()
+        self.pos = 0
+        self.closed = False
+
+    def write(self, s):
+        """Write string s to the stream.
+        """
+        self.buf += s
+        self.pos += len(s)
+        while len(self.buf) >= self.blocksize:
+            self._submit(_consume(self.buf, self.blocksize))
+
+    def _submit(self, block):
+        """Compress block by the pool and write the blocks compressed by
+           then, keeping at most two blocks per worker in memory.
+        """
+        self.pending.append(self.pool.submit(_compress_block, self.comptype,
+                                             self.compresslevel, block))
+        while len(self.pending) > 2 * self.workers or (
+                self.pending and self.pending[0].done()):
+            self.fileobj.write(self.pending.popleft().result())
+
+    def tell(self):
+        """Return the stream's file pointer position.
+        """
+        return self.pos
+
+    def close(self):
+        """Compress the remaining data, write all blocks and close the
+           _ParallelStream.
+        """
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            if self.buf or not self.pos:  # empty data is a stream, too
+                self.pending.append(self.pool.submit(
+                    _compress_block, self.comptype, self.compresslevel,
+                    bytes(self.buf)))
+                self.buf = bytearray()
+            while self.pending:
+                self.fileobj.write(self.pending.popleft().result())
+        finally:
+            self.pool.shutdown()
+            if not self._extfileobj:
+                self.fileobj.close()
+# class _ParallelStream
+
 class _CMPProxy(object):
 
     blocksize = 16 * 1024
@@ -503,25 +917,29 @@ class _CMPProxy(object):
         self.fileobj = fileobj
         self.mode = mode
         self.cmpobj = None
-        self.buf = b""
+        self.buf = bytearray()
         self.pos = 0
 
     def read(self, size):
-        b = [self.buf]
-        x = len(self.buf)
-        while x < size:
-            try:
-                raw = self.fileobj.read(self.blocksize)
-                assert self.cmpobj
-                data = self.cmpobj.decompress(raw)
-                b.append(data)
-            except EOFError:
+        while len(self.buf) < size:
+            assert self.cmpobj
+            if self.cmpobj.eof:
+                # Continue with the next stream of concatenated streams:
+                raw = self.cmpobj.unused_data or self.fileobj.read(self.blocksize)
+                if not raw:
+                    break
+                self.cmpobj = self.cmpobj.__class__()
+                try:
+                    self.buf += self.cmpobj.decompress(raw)
+                except IOError:  # trailing data which is not a stream
+                    break
+                continue
+            raw = self.fileobj.read(self.blocksize)
+            if not raw:
                 break
-            x += len(data)
-        self.buf = b"".join(b)
+            self.buf += self.cmpobj.decompress(raw)
 
-        buf = self.buf[:size]
-        self.buf = self.buf[size:]
+        buf = _consume(self.buf, size)
         self.pos += len(buf)
         return buf
 
@@ -561,9 +979,10 @@ class _BZ2Proxy(_CMPProxy):
        a file object argument.
     """
 
-    def __init__(self, fileobj, mode):
-        # type:(IO[Any], str) -> None
+    def __init__(self, fileobj, mode, compresslevel=9):
+        # type:(IO[Any], str, int) -> None
         _CMPProxy.__init__(self, fileobj, mode)
+        self.compresslevel = compresslevel
         self.init()
 
     def init(self):
@@ -571,13 +990,211 @@ class _BZ2Proxy(_CMPProxy):
         if self.mode == "r":
             self.cmpobj = bz2.BZ2Decompressor()
             self.fileobj.seek(0)
-            self.buf = b""
+            self.buf = bytearray()
         else:
-            self.cmpobj = bz2.BZ2Compressor()
+            self.cmpobj = bz2.BZ2Compressor(self.compresslevel)
 
 # class _BZ2Proxy
 
 
+class _ZstdProxy(_CMPProxy):
+    """Small proxy class that enables "r:zst" and "w:zst" modes, as
+       the zstandard module provides no seekable file object: Seeking
+       backwards restarts decompressing the file.
+    """
+
+    def __init__(self, fileobj, mode, compresslevel):
+        # type:(IO[Any], str, int) -> None
+        _CMPProxy.__init__(self, fileobj, mode)
+        self.zstandard = _import_zstandard()
+        self.compresslevel = compresslevel
+        self.reader = None
+        self.init()
+
+    def init(self):
+        self.pos = 0
+        if self.mode == "r":
+            self.fileobj.seek(0)
+            # zstd decompressobj() has no max_length: Use a reader instead
+            self.reader = self.zstandard.ZstdDecompressor().stream_reader(
+                self.fileobj, read_across_frames=True, closefd=False)
+        else:
+            self.cmpobj = self.zstandard.ZstdCompressor(
+                level=self.compresslevel).compressobj()
+
+    def read(self, size):
+        assert self.reader
+        chunks = []
+        while size > 0:
+            buf = self.reader.read(size)
+            if not buf:
+                break
+            chunks.append(buf)
+            size -= len(buf)
+        buf = b"".join(chunks)
+        self.pos += len(buf)
+        return buf
+
+# class _ZstdProxy
+
+
+class _MmapFile(object):
+    """Read-only file object on a memory-mapped file for the "r:mmap"
+       mode. Reading returns bytes, but view() provides zero-copy
+       memoryview slices of the mapping for the archive members.
+    """
+
+    def __init__(self, fileobj, extfileobj):
+        # type:(IO[bytes], bool) -> None
+        self.fileobj = fileobj
+        self._extfileobj = extfileobj
+        self.name = getattr(fileobj, "name", None)
+        self.mmap = mmap.mmap(fileobj.fileno(), 0, access=mmap.ACCESS_READ)
+        self.size = len(self.mmap)
+        self.pos = 0
+
+    def view(self, offset, size):
+        """Return a memoryview of size bytes of the file at offset."""
+        return memoryview(self.mmap)[offset:offset + size]
+
+    def pread(self, size, offset):
+        """Return size bytes at offset without changing the file position."""
+        return self.mmap[offset:offset + size]
+
+    def read(self, size=None):
+        if size is None:
+            size = self.size - self.pos
+        buf = self.mmap[self.pos:self.pos + size]
+        self.pos += len(buf)
+        return buf
+
+    def seek(self, pos, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            pos += self.pos
+        elif whence == os.SEEK_END:
+            pos += self.size
+        self.pos = max(pos, 0)
+        return self.pos
+
+    def tell(self):
+        return self.pos
+
+    def close(self):
+        try:
+            self.mmap.close()
+        except BufferError:
+            # memoryviews of members are still in use: The mapping is
+            # released when the last of them is garbage-collected.
+            pass
+        if not self._extfileobj:
+            self.fileobj.close()
+# class _MmapFile
+
+
+class _SegmentFile(io.RawIOBase):
+    """Read-only file object on the part of fileobj which starts at
+       offset and has size bytes, or extends to its end if size is None.
+       Used to read a segment of a concatenated archive.
+    """
+
+    def __init__(self, fileobj, offset, size=None):
+        io.RawIOBase.__init__(self)
+        self.fileobj = fileobj
+        self.offset = offset
+        self.size = size
+        self.pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, b):
+        size = len(b)
+        if self.size is not None:
+            size = max(0, min(size, self.size - self.pos))
+        self.fileobj.seek(self.offset + self.pos)
+        data = self.fileobj.read(size)
+        b[:len(data)] = data
+        self.pos += len(data)
+        return len(data)
+
+    def seek(self, pos, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            pos += self.pos
+        elif whence == os.SEEK_END:
+            if self.size is None:
+                pos += self.fileobj.seek(0, os.SEEK_END) - self.offset
+            else:
+                pos += self.size
+        self.pos = max(0, pos)
+        return self.pos
+
+    def tell(self):
+        return self.pos
+# class _SegmentFile
+
+class _LZ4LegacyFile(io.RawIOBase):
+    """Read-only file object which decompresses the lz4 legacy format
+       from fileobj. Seeking backwards decompresses it again from the
+       start, like for the file objects of the gzip and bz2 modules.
+    """
+
+    def __init__(self, fileobj, closefd=False):
+        io.RawIOBase.__init__(self)
+        self.fileobj = fileobj
+        self.closefd = closefd
+        self.start = fileobj.tell()
+        self._rewind()
+
+    def _rewind(self):
+        self.fileobj.seek(self.start)
+        self.decompressor = _LZ4LegacyDecompressor()
+        self.pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, b):
+        while not self.decompressor.eof:
+            data = b""
+            if self.decompressor.needs_input:
+                data = self.fileobj.read(BLOCKSIZE * 128)
+                if not data:  # the end of the file ends the last block
+                    break
+            data = self.decompressor.decompress(data, len(b))
+            if data:
+                b[:len(data)] = data
+                self.pos += len(data)
+                return len(data)
+        return 0
+
+    def seek(self, pos, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            pos += self.pos
+        elif whence == os.SEEK_END:
+            while self.read(BLOCKSIZE * 128):
+                pass
+            pos += self.pos
+        if pos < self.pos:
+            self._rewind()
+        while self.pos < pos and self.read(min(pos - self.pos, BLOCKSIZE * 128)):
+            pass
+        return self.pos
+
+    def tell(self):
+        return self.pos
+
+    def close(self):
+        if not self.closed and self.closefd:
+            self.fileobj.close()
+        io.RawIOBase.close(self)
+# class _LZ4LegacyFile
+
 #------------------------
 # Extraction file object
 #------------------------
@@ -587,11 +1204,12 @@ class _FileInFile(object):
        object.
     """
 
-    def __init__(self, fileobj, offset, size, sparse=None):
+    def __init__(self, fileobj, offset, size, sparse=None, pread=None):
         self.fileobj = fileobj
         self.offset = offset
         self.size = size
         self.sparse = sparse
+        self.pread = pread      # if given, pread(size, offset) reads without seeking
         self.position = 0
 
     def tell(self):
@@ -620,8 +1238,11 @@ class _FileInFile(object):
     def readnormal(self, size):
         """Read operation for regular files.
         """
-        self.fileobj.seek(self.offset + self.position)
+        offset = self.offset + self.position
         self.position += size
+        if self.pread is not None:
+            return self.pread(size, offset)
+        self.fileobj.seek(offset)
         return self.fileobj.read(size)
 
     def readsparse(self, size):
@@ -666,7 +1287,8 @@ class ExFileObject(object):
         self.fileobj = _FileInFile(cpiofile.fileobj,
                                    cpioinfo.offset_data,
                                    cpioinfo.size,
-                                   getattr(cpioinfo, "sparse", None))
+                                   getattr(cpioinfo, "sparse", None),
+                                   cpiofile.pread)
         self.name = cpioinfo.name
         self.mode = "r"
         self.closed = False
@@ -786,6 +1408,48 @@ class ExFileObject(object):
             yield line
 #class ExFileObject
 
+class MmapExFileObject(ExFileObject):
+    """File-like object for reading an archive member of a memory-mapped
+       archive. Is returned by CpioFile.extractfile() for "r:mmap".
+       In addition to ExFileObject, it provides readinto() and getbuffer()
+       to access the member's data without copying it.
+    """
+
+    def __init__(self, cpiofile, cpioinfo):
+        ExFileObject.__init__(self, cpiofile, cpioinfo)
+        self.view = cpiofile.fileobj.view(cpioinfo.offset_data, cpioinfo.size)
+
+    def getbuffer(self):
+        """Return a read-only memoryview of the member's data.
+        """
+        if self.closed:
+            raise ValueError("I/O operation on closed file")
+        return self.view[:]
+
+    def readinto(self, b):
+        """Read up to len(b) bytes into the writable buffer b and return
+           the number of bytes read.
+        """
+        if self.buffer:
+            buf = self.read(len(b))
+            b[:len(buf)] = buf
+            return len(buf)
+        if self.closed:
+            raise ValueError("I/O operation on closed file")
+
+        size = min(len(b), self.size - self.position)
+        memoryview(b).cast("B")[:size] = self.view[self.position:self.position + size]
+        self.position += size
+        self.fileobj.seek(self.position)
+        return size
+
+    def close(self):
+        """Close the file object and release the view of its data.
+        """
+        ExFileObject.close(self)
+        self.view.release()
+#class MmapExFileObject
+
 #------------------
 # Exported Classes
 #------------------
@@ -797,6 +1461,11 @@ class CpioInfo(object):
        usually created internally.
     """
 
+    __slots__ = ("ino", "mode", "uid", "gid", "nlink", "mtime", "size",
+                 "devmajor", "devminor", "rdevmajor", "rdevminor",
+                 "namesize", "check", "name", "linkname", "offset",
+                 "offset_data", "buf", "_link_path", "_link_target")
+
     def __init__(self, name=""):
         """Construct a CpioInfo object. name is the optional name
            of the member.
@@ -823,65 +1492,63 @@ class CpioInfo(object):
 
         self.buf = None
 
+        self._link_path = None  # set by extract() for hardlinks
+        self._link_target = None
+
+    def __copy__(self):
+        """Return a shallow copy, faster than copy.copy() does it for slots.
+        """
+        cpioinfo = self.__class__.__new__(self.__class__)
+        for attr in CpioInfo.__slots__:
+            setattr(cpioinfo, attr, getattr(self, attr))
+        state = getattr(self, "__dict__", None)  # attributes of subclasses
+        if state:
+            cpioinfo.__dict__.update(state)
+        return cpioinfo
+
     def __repr__(self):
         return "<%s %r at %#x>" % (self.__class__.__name__, self.name, id(self))
 
     @classmethod
     def frombuf(cls, buf):
         """Construct a CpioInfo object from a string buffer.
+           `buf` may also be a memoryview, e.g. of a memory-mapped archive.
+           Raise ValueError if it does not contain a cpio header.
         """
+        if len(buf) < HEADERSIZE_SVR4:
+            raise ValueError("truncated header")
+
         cpioinfo = cls()
         cpioinfo.buf = buf
-
-        cpioinfo.ino = int(buf[6:14], 16)
-        cpioinfo.mode = int(buf[14:22], 16)
-        cpioinfo.uid = int(buf[22:30], 16)
-        cpioinfo.gid = int(buf[30:38], 16)
-        cpioinfo.nlink = int(buf[38:46], 16)
-        cpioinfo.mtime = int(buf[46:54], 16)
-        cpioinfo.size = int(buf[54:62], 16)
-        cpioinfo.devmajor = int(buf[62:70], 16)
-        cpioinfo.devminor = int(buf[70:78], 16)
-        cpioinfo.rdevmajor = int(buf[78:86], 16)
-        cpioinfo.rdevminor = int(buf[86:94], 16)
-        cpioinfo.namesize = int(buf[94:102], 16)
-        cpioinfo.check = int(buf[102:110], 16)
+        (cpioinfo.ino, cpioinfo.mode, cpioinfo.uid, cpioinfo.gid,
+         cpioinfo.nlink, cpioinfo.mtime, cpioinfo.size,
+         cpioinfo.devmajor, cpioinfo.devminor,
+         cpioinfo.rdevmajor, cpioinfo.rdevminor,
+         cpioinfo.namesize, cpioinfo.check) = HEADER_FIELDS.unpack(
+             binascii.unhexlify(buf[6:HEADERSIZE_SVR4]))
 
         return cpioinfo
 
     def tobuf(self):
         """Return a cpio header as bytes"""
-        buf = b"%06X" % MAGIC_NEWC
-        buf += b"%08X" % self.ino
-        buf += b"%08X" % self.mode
-        buf += b"%08X" % self.uid
-        buf += b"%08X" % self.gid
-        buf += b"%08X" % self.nlink
-        buf += b"%08X" % int(self.mtime)
-        buf += b"%08X" % (self.linkname == '' and self.size or
-                         len(self.linkname))
-        buf += b"%08X" % self.devmajor
-        buf += b"%08X" % self.devminor
-        buf += b"%08X" % self.rdevmajor
-        buf += b"%08X" % self.rdevminor
-        buf += b"%08X" % (len(self.name)+1)
-        buf += b"%08X" % self.check
-
-        buf += six.ensure_binary(self.name) + NUL
-        _, remainder = divmod(len(buf), WORDSIZE)
-        if remainder != 0:
-            # pad to next word
-            buf += (WORDSIZE - remainder) * NUL
-
-        if self.linkname != '':
-            buf += six.ensure_binary(self.linkname)
-            _, remainder = divmod(len(buf), WORDSIZE)
-            if remainder != 0:
-                # pad to next word
-                buf += (WORDSIZE - remainder) * NUL
-
-        self.buf = buf
-        return buf
+        name = six.ensure_binary(self.name)
+        linkname = six.ensure_binary(self.linkname)
+        buf = [HEADER_FORMAT % (MAGIC_NEWC, self.ino, self.mode, self.uid,
+                                self.gid, self.nlink, int(self.mtime),
+                                linkname and len(linkname) or self.size,
+                                self.devmajor, self.devminor,
+                                self.rdevmajor, self.rdevminor,
+                                len(name) + 1, self.check),
+               name,
+               # NUL-terminate the name and pad to the next word:
+               NUL * (1 + (-(HEADERSIZE_SVR4 + len(name) + 1) % WORDSIZE))]
+
+        if linkname:
+            buf.append(linkname)
+            buf.append(NUL * (-len(linkname) % WORDSIZE))
+
+        self.buf = b"".join(buf)
+        return self.buf
 
     def isreg(self):
         return stat.S_ISREG(self.mode)
@@ -917,6 +1584,16 @@ class CpioFile(six.Iterator):
     hardlinks = True		# If true, only add content for the first
     				# hard link, else treat as regular file.
 
+    dedup = False               # If true, add the content of regular files
+                                # only once, and later files with the same
+                                # content as hard links to the first one.
+
+    reproducible = False        # If true, clamp the mtimes to
+                                # $SOURCE_DATE_EPOCH (default 0), set uid
+                                # and gid to 0 and add directories sorted.
+                                # Use open(reproducible=True) to also set
+                                # the timestamp of gzip headers.
+
     errorlevel = 0              # If 0, fatal errors only appear in debug
                                 # messages (if debug >= 0). If > 0, errors
                                 # are passed to the caller as exceptions.
@@ -953,6 +1630,7 @@ class CpioFile(six.Iterator):
             self.name = os.path.abspath(name)
         assert not isinstance(fileobj, io.TextIOBase)
         self.fileobj = fileobj
+        self.pread = self._get_pread(fileobj)
 
         # Init datastructures
         self.closed = False
@@ -961,6 +1639,14 @@ class CpioFile(six.Iterator):
         self.offset = 0        # current position in the archive file
         self.inodes = {}        # dictionary caching the inodes of
                                 # archive members already added
+        self._inos = {}         # renumbered inodes of the added hard links
+        self._last_ino = None   # the last inode number given by _renumber()
+        self._contents = {}     # type:dict[tuple[bytes, int, int, int], CpioInfo]
+        # cache of _find_link_target():
+        self._links = collections.OrderedDict()  # type:collections.OrderedDict[str, CpioInfo]
+        self.index = None       # path of the sidecar file of the member index
+        self._names = {}        # type:dict[str, CpioInfo]
+        self._datamembers = {}  # type:dict[int, CpioInfo]
 
         if self._mode == "r":
             self.firstmember = None
@@ -998,10 +1684,17 @@ class CpioFile(six.Iterator):
     # by adding it to the mapping in OPEN_METH.
 
     @classmethod
-    def open(cls, name=None, mode="r", fileobj=None, bufsize=20*512):
+    def open(cls, name=None, mode="r", fileobj=None, bufsize=20*512, index=None,
+             compresslevel=None, workers=1, blocksize=1024*1024, reproducible=False):
         """Open a cpio archive for reading, writing or appending. Return
            an appropriate CpioFile class.
 
+           If `index` is given for an archive opened for reading, it is the
+           path of a sidecar file holding the member index of the archive:
+           If it matches the archive, it is used instead of scanning the
+           archive, otherwise it is written after the next scan. See
+           CpioFile.load_index().
+
            mode:
 
            - ``r`` or ``r:*`` open for reading with transparent compression
@@ -1009,22 +1702,59 @@ class CpioFile(six.Iterator):
            - ``r:gz``         open for reading with gzip compression
            - ``r:bz2``        open for reading with bzip2 compression
            - ``r:xz``         open for reading with xz compression
+           - ``r:zst``        open for reading with zstd compression
+           - ``r:lz4``        open for reading with lz4 compression
+           - ``r:mmap``       open for reading uncompressed using mmap
            - ``a`` or ``a:``  open for appending
            - ``w`` or ``w:``  open for writing without compression
            - ``w:gz``         open for writing with gzip compression
            - ``w:bz2``        open for writing with bzip2 compression
            - ``w:xz``         open for writing with xz compression
+           - ``w:zst``        open for writing with zstd compression
+           - ``w:lz4``        open for writing with lz4 compression
 
            - ``r|*``        open a stream of cpio blocks with transparent compression
            - ``r|``         open an uncompressed stream of cpio blocks for reading
            - ``r|gz``       open a gzip compressed stream of cpio blocks
            - ``r|bz2``      open a bzip2 compressed stream of cpio blocks
            - ``r|xz``       open a xz compressed stream of cpio blocks
+           - ``r|zst``      open a zstd compressed stream of cpio blocks
+           - ``r|lz4``      open a lz4 compressed stream of cpio blocks
            - ``w|``         open an uncompressed stream for writing
            - ``w|gz``       open a gzip compressed stream for writing
            - ``w|bz2``      open a bzip2 compressed stream for writing
            - ``w|xz``       open a xz compressed stream for writing
+           - ``w|zst``      open a zstd compressed stream for writing
+           - ``w|lz4``      open a lz4 compressed stream for writing
+
+           The zstd and lz4 modes need the optional zstandard and lz4 modules.
+           The lz4 read modes also read the lz4 legacy format (lz4 -l) of
+           initrds, which ends at the end of the file or at NUL padding.
+
+           `compresslevel` sets the compression level of the compressed
+           ``w`` modes, the default depends on the compression. Passing it
+           with a read, append or uncompressed mode raises ValueError. If `workers` is greater
+           than 1, a compressed archive is written as a stream of blocks of
+           `blocksize` bytes which are compressed in parallel by `workers`
+           threads into concatenated gzip members, bzip2 or xz streams or
+           zstd or lz4 frames, which the stock tools decompress as one.
+
+           If `reproducible` is true, the `reproducible` option of the
+           returned CpioFile is set and the timestamp of a gzip header is
+           $SOURCE_DATE_EPOCH or 0 instead of the current time.
         """
+        if reproducible:
+            t = cls._open(name, mode, fileobj, bufsize, index, compresslevel, workers,
+                          blocksize, mtime=_source_date_epoch() or 0)
+            t.reproducible = True
+            return t
+        return cls._open(name, mode, fileobj, bufsize, index, compresslevel, workers,
+                         blocksize)
+
+    @classmethod
+    def _open(cls, name, mode, fileobj, bufsize, index, compresslevel, workers, blocksize,
+              mtime=None):
+        """Implement open(), using mtime for the timestamp of gzip headers"""
 
         if not name and not fileobj:
             raise ValueError("nothing to open")
@@ -1035,6 +1765,20 @@ class CpioFile(six.Iterator):
             else:
                 if not isinstance(fileobj, io.IOBase) or isinstance(fileobj, io.TextIOBase):
                     raise TypeError("CpioFile.fileobj needs to be IO[bytes] or io.BytesIO()")
+        if compresslevel is not None and (mode[:2] not in ("w:", "w|")
+                                          or mode[2:] in ("", "cpio", "mmap")):
+            raise ValueError("compresslevel needs a compressed write mode, not %r" % mode)
+
+        if index is not None:
+            t = cls.open(name, mode, fileobj, bufsize)
+            t.load_index(index)
+            return t
+
+        if workers > 1 and mode[:2] in ("w:", "w|") and mode[2:] in COMPRESSION_MAGIC:
+            t = cls(name, "w", cast(IO[bytes], _ParallelStream(
+                name, mode[2:], fileobj, compresslevel, workers, blocksize)))
+            t._extfileobj = False
+            return t
 
         if mode in ("r", "r:*"):
             # Find out which *open() is appropriate for opening the file.
@@ -1061,7 +1805,12 @@ class CpioFile(six.Iterator):
                 func = getattr(cls, cls.OPEN_METH[comptype])
             else:
                 raise CompressionError("unknown compression type %r" % comptype)
-            return func(name, fmode, fileobj)
+            kwargs = {}
+            if compresslevel is not None:
+                kwargs["compresslevel"] = compresslevel
+            if comptype == "gz" and mtime is not None:
+                kwargs["mtime"] = mtime
+            return func(name, fmode, fileobj, **kwargs)
 
         elif "|" in mode:
             fmode, comptype = mode.split("|", 1)
@@ -1072,7 +1821,8 @@ class CpioFile(six.Iterator):
                 raise ValueError("mode must be 'r' or 'w'")
 
             t = cls(name, fmode,
-                    _Stream(name, fmode, comptype, fileobj, bufsize))
+                    _Stream(name, fmode, comptype, fileobj, bufsize,
+                            compresslevel=compresslevel, mtime=mtime))
             t._extfileobj = False
             return t
 
@@ -1083,21 +1833,25 @@ class CpioFile(six.Iterator):
 
     @classmethod
     def cpioopen(cls, name, mode="r", fileobj=None):
-        # type:(str, str, Optional[GzipFile | IO[bytes]]) -> CpioFile
+        # type:(str | None, str, Optional[GzipFile | IO[bytes]]) -> CpioFile
         """Open uncompressed cpio archive name for reading or writing."""
         if len(mode) > 1 or mode not in "raw":
             raise ValueError("mode must be 'r', 'a' or 'w'")
         return cls(name, mode, fileobj)
 
     @classmethod
-    def gzopen(cls, name, mode="r", fileobj=None, compresslevel=9):
+    def gzopen(cls, name, mode="r", fileobj=None, compresslevel=9, mtime=None):
         """Open gzip compressed cpio archive name for reading or writing.
-           Appending is not allowed.
+           Appending is not allowed. mtime is the timestamp of the gzip
+           header, default $SOURCE_DATE_EPOCH or the current time.
         """
         if len(mode) > 1 or mode not in "rw":
             raise ValueError("mode must be 'r' or 'w'")
+        if mtime is None:
+            mtime = _source_date_epoch()
         try:
-            t = cls.cpioopen(name, mode, gzip.GzipFile(name, mode + "b", compresslevel, fileobj))
+            t = cls.cpioopen(name, mode, gzip.GzipFile(name, mode + "b", compresslevel, fileobj,
+                                                       mtime=mtime))
         except IOError:
             raise ReadError("not a gzip file")
         t._extfileobj = False
@@ -1111,7 +1865,7 @@ class CpioFile(six.Iterator):
             raise ValueError("mode must be 'r' or 'w'.")
 
         if fileobj is not None:
-            fileobj = cast(IO[Any], _BZ2Proxy(fileobj, mode))  # pragma: no cover
+            fileobj = cast(IO[Any], _BZ2Proxy(fileobj, mode, compresslevel))  # pragma: no cover
         else:
             fileobj = bz2.BZ2File(name, mode, compresslevel=compresslevel)
 
@@ -1147,17 +1901,105 @@ class CpioFile(six.Iterator):
         fileobj = lzma.LZMAFile(name, mode, **cast(Any, kwargs))
         try:
             t = cls.cpioopen(name, mode, fileobj)
-        except IOError:
+        except (IOError, lzma.LZMAError):
+            fileobj.close()
             raise ReadError("not a XZ file")
         t._extfileobj = False
         return t
 
+    @classmethod
+    def zstopen(cls, name, mode="r", fileobj=None, compresslevel=3):
+        # type:(str, Literal["r", "w"], Optional[IO[bytes]], int) -> CpioFile
+        """Open zstd compressed cpio archive name for reading or writing.
+           Appending is not allowed. Needs the zstandard module.
+        """
+        if len(mode) > 1 or mode not in "rw":
+            raise ValueError("mode must be 'r' or 'w'.")
+
+        _import_zstandard()
+        if mode == "r":
+            _check_magic(name, fileobj, ZSTD_MAGIC)
+        if fileobj is None:
+            fileobj = bltn_open(name, mode + "b")
+        try:
+            t = cls.cpioopen(name, mode, cast(IO[Any], _ZstdProxy(fileobj, mode, compresslevel)))
+        except IOError:
+            raise ReadError("not a zstd file")
+        t._extfileobj = False
+        return t
+
+    @classmethod
+    def lz4open(cls, name, mode="r", fileobj=None, compresslevel=0):
+        # type:(str, Literal["r", "w"], Optional[IO[bytes]], int) -> CpioFile
+        """Open lz4 compressed cpio archive name for reading or writing.
+           Appending is not allowed. Needs the lz4 module. Archives in the
+           lz4 legacy format of initrds can be read, but not written.
+        """
+        if len(mode) > 1 or mode not in "rw":
+            raise ValueError("mode must be 'r' or 'w'.")
+
+        lz4_frame = _import_lz4_frame()
+        if mode == "r":
+            try:
+                _check_magic(name, fileobj, LZ4_MAGIC)
+            except ReadError:
+                _check_magic(name, fileobj, LZ4_LEGACY_MAGIC)
+                _import_lz4_block()
+                if fileobj is None:
+                    raw = _LZ4LegacyFile(bltn_open(name, "rb"), closefd=True)
+                else:
+                    raw = _LZ4LegacyFile(fileobj)
+                t = cls.cpioopen(name, mode, cast(IO[bytes], io.BufferedReader(raw)))
+                t._extfileobj = False
+                return t
+        fileobj = lz4_frame.LZ4FrameFile(fileobj or name, mode,
+                                         compression_level=compresslevel)
+        try:
+            t = cls.cpioopen(name, mode, fileobj)
+        except IOError:
+            raise ReadError("not a lz4 file")
+        t._extfileobj = False
+        return t
+
+    @classmethod
+    def mmapopen(cls, name, mode="r", fileobj=None):
+        # type:(str, Literal["r"], Optional[IO[bytes]]) -> CpioFile
+        """Open uncompressed cpio archive name for reading by mapping it
+           into memory. Members returned by extractfile() are
+           MmapExFileObject objects which provide memoryview slices of
+           the mapping.
+        """
+        if mode != "r":
+            raise ValueError("mode must be 'r'")
+
+        extfileobj = fileobj is not None
+        if fileobj is None:
+            fileobj = bltn_open(name, "rb")
+        try:
+            mapped = _MmapFile(fileobj, extfileobj)
+        except (AttributeError, io.UnsupportedOperation, EnvironmentError, ValueError):
+            if not extfileobj:
+                fileobj.close()
+            raise ReadError("cannot map the archive into memory")
+
+        try:
+            t = cls.cpioopen(name, mode, cast(IO[bytes], mapped))
+        except CpioError:
+            mapped.close()
+            raise
+        t._extfileobj = False
+        t.fileobject = MmapExFileObject
+        return t
+
     # All *open() methods are registered here.
     OPEN_METH = {
         "cpio": "cpioopen",   # uncompressed cpio
         "gz":  "gzopen",    # gzip compressed cpio
         "bz2": "bz2open",   # bzip2 compressed cpio
         "xz":  "xzopen",  # xz compressed cpio
+        "zst": "zstopen",   # zstd compressed cpio
+        "lz4": "lz4open",   # lz4 compressed cpio
+        "mmap": "mmapopen",  # uncompressed cpio, memory-mapped
     }
 
     #--------------------------------------------------------------------------
@@ -1204,6 +2046,56 @@ class CpioFile(six.Iterator):
                                 # scan the whole archive.
         return self.members
 
+    def load_index(self, path):
+        """Use the member index in the sidecar file `path` for the archive.
+           If it exists and matches the size, mtime and hash of the archive,
+           the members are taken from it, so that getmember() and
+           extractfile() do not need to scan the archive. Otherwise, the
+           index is (re)written once all members have been read.
+           Return True if the index was loaded from `path`.
+        """
+        self._check("r")
+        if isinstance(self.fileobj, _Stream):
+            raise StreamError("a member index needs a seekable archive")
+        self.index = path
+        key = self._index_key()
+        try:
+            with bltn_open(path, "r") as f:
+                data = json.load(f)
+            if data["version"] != INDEX_VERSION or data["archive"] != key:
+                raise ValueError("index of a different archive")
+            members = []
+            for values in data["members"]:
+                cpioinfo = CpioInfo()
+                for field, value in zip(INDEX_FIELDS, values):
+                    setattr(cpioinfo, field, value)
+                members.append(cpioinfo)
+            offset = data["offset"]
+        except (EnvironmentError, ValueError, KeyError, TypeError) as e:
+            self._dbg(1, "cpiofile: not using index %r: %s" % (path, e))
+            if self._loaded:
+                self._write_index(path)
+            return False
+
+        self.members = []
+        self._names = {}
+        self._datamembers = {}
+        for cpioinfo in members:
+            self._add_member(cpioinfo)
+        self.firstmember = None
+        self.offset = offset
+        self._loaded = True
+        return True
+
+    def save_index(self, path):
+        """Write the member index of the archive to the sidecar file `path`.
+           All members are read first if this has not happened yet.
+        """
+        loaded = self._loaded
+        self.getmembers()
+        if loaded or path != self.index:  # else, _set_loaded() wrote it
+            self._write_index(path)
+
     def getnames(self):
         """Return the members of the archive as a list of their names. It has
            the same order as the list returned by getmembers().
@@ -1323,7 +2215,7 @@ class CpioFile(six.Iterator):
             if recursive:
                 if arcname == ".":
                     arcname = ""
-                for f in os.listdir("."):
+                for f in self._listdir("."):
                     self.add(f, os.path.join(arcname, f))
             return
 
@@ -1345,7 +2237,7 @@ class CpioFile(six.Iterator):
         elif cpioinfo.isdir():
             self.addfile(cpioinfo)
             if recursive:
-                for f in os.listdir(name):
+                for f in self._listdir(name):
                     self.add(os.path.join(name, f), os.path.join(arcname, f))
 
         else:
@@ -1357,11 +2249,33 @@ class CpioFile(six.Iterator):
            You can create CpioInfo objects using getcpioinfo().
            On Windows platforms, `fileobj` should always be opened with mode
            'rb' to avoid irritation about the file size.
+           If `dedup` or `reproducible` is set, the inodes are numbered in
+           the order of the archive and the device numbers are set to 0.
         """
         self._check("aw")
 
         cpioinfo = copy.copy(cpioinfo)
 
+        if self.reproducible:
+            cpioinfo.mtime = min(cpioinfo.mtime, _source_date_epoch() or 0)
+            cpioinfo.uid = cpioinfo.gid = 0
+        if self.dedup or self.reproducible:
+            self._renumber(cpioinfo)
+
+        if (self.dedup and fileobj is not None and cpioinfo.isreg() and
+                cpioinfo.size > 0 and not (self.hardlinks and cpioinfo.nlink > 1
+                                           and cpioinfo.ino in self.inodes)):
+            source = self._dedup(cpioinfo, fileobj)
+            if source is not fileobj:  # close the copy of an unseekable fileobj
+                try:
+                    self._addfile(cpioinfo, source)
+                finally:
+                    source.close()
+                return
+        self._addfile(cpioinfo, fileobj)
+
+    def _addfile(self, cpioinfo, fileobj):
+        """Write the header and the data of the renumbered cpioinfo."""
         if cpioinfo.nlink > 1:
             if self.hardlinks and cpioinfo.ino in self.inodes:
                 # this inode has already been added
@@ -1385,31 +2299,55 @@ class CpioFile(six.Iterator):
                 self.fileobj.write((WORDSIZE - remainder) * NUL)
                 self.offset += (WORDSIZE - remainder)
 
-        self.members.append(cpioinfo)
+        self._add_member(cpioinfo)
 
-    def extractall(self, path=".", members=None):
+    def extractall(self, path=".", members=None, workers=1):
         """Extract all members from the archive to the current working
            directory and set owner, modification time and permissions on
            directories afterwards. `path` specifies a different directory
            to extract to. `members` is optional and must be a subset of the
            list returned by getmembers().
+           If `workers` is greater than 1 and the archive is an uncompressed
+           file, regular files are extracted by a pool of `workers` threads.
+           Their parent directories, all other members and hardlinks are
+           still extracted in the order of the archive.
         """
         directories = []
 
         if members is None:
             members = self
 
-        for cpioinfo in members:
-            if cpioinfo.isdir():
-                # Extract directory with a safe mode, so that
-                # all files below can be extracted as well.
-                try:
-                    os.makedirs(os.path.join(path, six.ensure_text(cpioinfo.name)), 0o777)
-                except EnvironmentError:
-                    pass
-                directories.append(cpioinfo)
-            else:
-                self.extract(cpioinfo, path)
+        pool = None
+        pending = {}  # the last submitted extraction of each target path
+        if workers > 1 and self.pread is not None:
+            from concurrent.futures import ThreadPoolExecutor
+            pool = ThreadPoolExecutor(workers)
+
+        try:
+            for cpioinfo in members:
+                if cpioinfo.isdir():
+                    # Extract directory with a safe mode, so that
+                    # all files below can be extracted as well.
+                    try:
+                        os.makedirs(os.path.join(path, six.ensure_text(cpioinfo.name)), 0o777)
+                    except EnvironmentError:
+                        pass
+                    directories.append(cpioinfo)
+                elif pool is not None and cpioinfo.isreg() and not cpioinfo.islnk():
+                    targetpath = os.path.normpath(
+                        os.path.join(path, six.ensure_text(cpioinfo.name)))
+                    self._extract_upperdirs(cpioinfo, targetpath)
+                    if targetpath in pending:
+                        # A later member of the same name replaces it:
+                        pending[targetpath].result()
+                    pending[targetpath] = pool.submit(self.extract, cpioinfo, path)
+                else:
+                    self.extract(cpioinfo, path)
+            for future in pending.values():
+                future.result()
+        finally:
+            if pool is not None:
+                pool.shutdown()
 
         # Reverse sort directories.
         directories.sort(key=lambda x: x.name)
@@ -1417,11 +2355,11 @@ class CpioFile(six.Iterator):
 
         # Set correct owner, mtime and filemode on directories.
         for cpioinfo in directories:
-            path = os.path.join(path, six.ensure_text(cpioinfo.name))
+            dirpath = os.path.join(path, six.ensure_text(cpioinfo.name))
             try:
-                self.chown(cpioinfo, path)
-                self.utime(cpioinfo, path)
-                self.chmod(cpioinfo, path)
+                self.chown(cpioinfo, dirpath)
+                self.utime(cpioinfo, dirpath)
+                self.chmod(cpioinfo, dirpath)
             except ExtractError as e:
                 if self.errorlevel > 1:
                     raise
@@ -1478,18 +2416,18 @@ class CpioFile(six.Iterator):
         else:
             cpioinfo = self.getmember(member)
 
-        if cpioinfo.isreg():
-            return self.fileobject(self, cpioinfo)
-
-        elif cpioinfo.islnk():
+        if cpioinfo.islnk():
+            # Only one of the hard links to a file has its data
             return self.fileobject(self, self._datamember(cpioinfo))
+        elif cpioinfo.isreg():
+            return self.fileobject(self, cpioinfo)
         elif cpioinfo.issym():
             if isinstance(self.fileobj, _Stream):
                 # A small but ugly workaround for the case that someone tries
                 # to extract a symlink as a file-object from a non-seekable
                 # stream of cpio blocks.
                 raise StreamError("Need a seekable stream to open() a symlink target!")
-            return self.extractfile(cpioinfo.linkname)
+            return self.extractfile(self._find_link_target(cpioinfo))
         else:
             # If there's no data associated with the member (directory, chrdev,
             # blkdev, etc.), return None instead of a file object.
@@ -1503,20 +2441,7 @@ class CpioFile(six.Iterator):
         # and build the destination pathname, replacing
         # forward slashes to platform specific separators.
         targetpath = os.path.normpath(targetpath)
-
-        # Create all upper directories.
-        upperdirs = os.path.dirname(targetpath)
-        if upperdirs and not os.path.exists(upperdirs):
-            ti = CpioInfo()
-            ti.name  = upperdirs
-            ti.mode  = S_IFDIR | 0o777
-            ti.mtime = cpioinfo.mtime
-            ti.uid   = cpioinfo.uid
-            ti.gid   = cpioinfo.gid
-            try:
-                self._extract_member(ti, ti.name)
-            except Exception:
-                pass
+        self._extract_upperdirs(cpioinfo, targetpath)
 
         if cpioinfo.issym():
             self._dbg(1, "%s -> %s" % (cpioinfo.name, cpioinfo.linkname))
@@ -1541,6 +2466,22 @@ class CpioFile(six.Iterator):
             self.chmod(cpioinfo, targetpath)
             self.utime(cpioinfo, targetpath)
 
+    def _extract_upperdirs(self, cpioinfo, targetpath):
+        """Create all upper directories of targetpath for cpioinfo.
+        """
+        upperdirs = os.path.dirname(targetpath)
+        if upperdirs and not os.path.exists(upperdirs):
+            ti = CpioInfo()
+            ti.name  = upperdirs
+            ti.mode  = S_IFDIR | 0o777
+            ti.mtime = cpioinfo.mtime
+            ti.uid   = cpioinfo.uid
+            ti.gid   = cpioinfo.gid
+            try:
+                self._extract_member(ti, ti.name)
+            except Exception:
+                pass
+
     #--------------------------------------------------------------------------
     # Below are the different file methods. They are called via
     # _extract_member() when extract() is called. They can be replaced in a
@@ -1569,14 +2510,16 @@ class CpioFile(six.Iterator):
             else:
                 extractinfo = self._datamember(cpioinfo)
 
-        if cpioinfo.ino not in self.inodes:
-            self.inodes[cpioinfo.ino] = []
-        self.inodes[cpioinfo.ino].append(cpioinfo.name)
+        # setdefault() is atomic: makefile() may run in extractall()'s workers
+        self.inodes.setdefault(cpioinfo.ino, []).append(cpioinfo.name)
 
         if extractinfo:
             source = self.extractfile(extractinfo)
             target = bltn_open(targetpath, "wb")
-            copyfileobj(source, target)
+            if isinstance(source, MmapExFileObject):
+                target.write(source.getbuffer())
+            else:
+                copyfileobj(source, target)
             cast(ExFileObject, source).close()
             target.close()
 
@@ -1727,7 +2670,7 @@ class CpioFile(six.Iterator):
                                 "file: %s" % e)
             return None
 
-        self.members.append(cpioinfo)
+        self._add_member(cpioinfo)
         return cpioinfo
 
     def proc_member(self, cpioinfo):
@@ -1743,6 +2686,92 @@ class CpioFile(six.Iterator):
     #--------------------------------------------------------------------------
     # Little helper methods:
 
+    @staticmethod
+    def _get_pread(fileobj):
+        """Return a function pread(size, offset) to read from fileobj without
+           changing its file position if fileobj is an uncompressed, regular
+           file, else None. Such reads can be done from multiple threads.
+        """
+        if isinstance(fileobj, _MmapFile):
+            return fileobj.pread
+        if not isinstance(fileobj, io.BufferedReader) or not hasattr(os, "pread"):
+            return None
+        try:
+            fd = fileobj.fileno()
+            if not stat.S_ISREG(os.fstat(fd).st_mode):
+                return None
+        except (io.UnsupportedOperation, EnvironmentError):
+            return None
+        return lambda size, offset: os.pread(fd, size, offset)
+
+    def _listdir(self, path):
+        """Return the names in the directory path, sorted if `reproducible`
+           is set.
+        """
+        names = os.listdir(path)
+        if self.reproducible:
+            names.sort()
+        return names
+
+    def _renumber(self, cpioinfo):
+        """Give cpioinfo the next inode number unless it is a hard link to
+           an inode which has already been renumbered.
+        """
+        if self._last_ino is None:  # continue after the members of mode "a"
+            self._last_ino = max([member.ino for member in self.members] or [0])
+        key = (cpioinfo.devmajor, cpioinfo.devminor, cpioinfo.ino)
+        if cpioinfo.nlink > 1 and key in self._inos:
+            cpioinfo.ino = self._inos[key]
+        else:
+            self._last_ino += 1
+            cpioinfo.ino = self._last_ino
+            if cpioinfo.nlink > 1:
+                self._inos[key] = cpioinfo.ino
+        cpioinfo.devmajor = cpioinfo.devminor = 0
+
+    def _dedup(self, cpioinfo, fileobj):
+        """Hash the cpioinfo.size bytes of content in fileobj. If a file with
+           the same content, mode and owner has already been added, make
+           cpioinfo a hard link to it. Return a file object from which the
+           content can be read (again): If it is not fileobj, it is a
+           temporary copy which the caller has to close.
+        """
+        digest = hashlib.sha256()
+        if getattr(fileobj, "seekable", lambda: False)():
+            pos = fileobj.tell()
+            source = fileobj
+        else:
+            # Keep a copy of the content which cannot be read again:
+            source = tempfile.SpooledTemporaryFile(max_size=16 * 1024 * 1024)
+        try:
+            remaining = cpioinfo.size
+            while remaining > 0:
+                buf = fileobj.read(min(remaining, 64 * 1024))
+                if not buf:
+                    raise IOError("end of file reached")
+                digest.update(buf)
+                if source is not fileobj:
+                    source.write(buf)
+                remaining -= len(buf)
+            source.seek(0 if source is not fileobj else pos)
+        except BaseException:
+            if source is not fileobj:
+                source.close()
+            raise
+
+        key = (digest.digest(), cpioinfo.mode, cpioinfo.uid, cpioinfo.gid)
+        first = self._contents.get(key)
+        if first is None:
+            # Later files can only link to the file if its nlink is > 1:
+            cpioinfo.nlink = max(cpioinfo.nlink, 2)
+            self._contents[key] = cpioinfo
+        else:
+            self._dbg(2, "cpiofile: %s has the content of %s" % (
+                cpioinfo.name, first.name))
+            cpioinfo.ino = first.ino
+            cpioinfo.nlink = max(cpioinfo.nlink, 2)
+        return source
+
     def _word(self, count):
         """Round up a byte count by WORDSIZE and return it,
            e.g. _word(17) => 20.
@@ -1758,10 +2787,12 @@ class CpioFile(six.Iterator):
         """
         if cpioinfo.size == 0:
             # perhaps another member has the data?
-            for info in self:
-                if info.ino == cpioinfo.ino and info.size > 0:
-                    self._dbg(2, "cpiofile: found member %s" % info.name)
-                    return info
+            if cpioinfo.ino not in self._datamembers and not self._loaded:
+                self._load()
+            info = self._datamembers.get(cpioinfo.ino)
+            if info is not None:
+                self._dbg(2, "cpiofile: found member %s" % info.name)
+                return info
 
         return cpioinfo
 
@@ -1772,18 +2803,81 @@ class CpioFile(six.Iterator):
         """
         # Ensure that all members have been loaded.
         members = self.getmembers()
-
+        encoded_name = six.ensure_str(name)
         if cpioinfo is None:
-            end = len(members)
-        else:
-            end = members.index(cpioinfo)
+            return self._names.get(encoded_name)
 
-        encoded_name = six.ensure_str(name)
-        for i in range(end - 1, -1, -1):
+        for i in range(members.index(cpioinfo) - 1, -1, -1):
             if encoded_name == members[i].name:
                 return members[i]
         return None  # pragma: no cover
 
+    def _find_link_target(self, cpioinfo):
+        # type:(CpioInfo) -> CpioInfo
+        """Return the member which the symbolic link cpioinfo refers to,
+           following the symbolic links in the target's path, like for
+           the extracted files. Raise KeyError if it is not found.
+           The results are kept in a cache of LINK_CACHE_SIZE entries.
+        """
+        target = self._links.pop(cpioinfo.name, None)
+        if target is None:
+            self.getmembers()  # Ensure that all members have been loaded.
+            name = posixpath.join(posixpath.dirname(cpioinfo.name), cpioinfo.linkname)
+            target = self._resolve(name)
+            if len(self._links) >= LINK_CACHE_SIZE:
+                self._links.popitem(last=False)
+        self._links[cpioinfo.name] = target  # (re-)insert as most recent
+        return target
+
+    def _resolve(self, name):
+        # type:(str) -> CpioInfo
+        """Return the member for the path `name`, resolving each of its
+           components through the index of member names.
+        """
+        pending = collections.deque(name.split("/"))
+        path = ""
+        links = 0
+        while pending:
+            part = pending.popleft()
+            if part in ("", "."):
+                continue
+            if part == "..":
+                path = posixpath.dirname(path)
+                continue
+            cpioinfo = self._lookup(posixpath.join(path, part))
+            if cpioinfo is not None and cpioinfo.issym():
+                links += 1
+                if links > MAXSYMLINKS:
+                    raise KeyError("too many levels of symbolic links: %r" % name)
+                if cpioinfo.linkname.startswith("/"):
+                    path = ""
+                pending.extendleft(reversed(cpioinfo.linkname.split("/")))
+                continue
+            path = posixpath.join(path, part)
+        cpioinfo = self._lookup(path)
+        if cpioinfo is None:
+            raise KeyError("linkname %r not found" % name)
+        return cpioinfo
+
+    def _lookup(self, path):
+        # type:(str) -> CpioInfo | None
+        """Return the last member with the normalised path `path`, which
+           may have a "./" prefix in the archive.
+        """
+        cpioinfo = self._names.get(path)
+        if cpioinfo is None:
+            cpioinfo = self._names.get("./" + path if path else ".")
+        return cpioinfo
+
+    def _add_member(self, cpioinfo):
+        """Append cpioinfo to the members and to the lookup tables
+           of the member index.
+        """
+        self.members.append(cpioinfo)
+        self._names[cpioinfo.name] = cpioinfo
+        if cpioinfo.islnk() and cpioinfo.size > 0:
+            self._datamembers.setdefault(cpioinfo.ino, cpioinfo)
+
     def _load(self):
         """Read through the entire archive file and look for readable
            members.
@@ -1792,7 +2886,49 @@ class CpioFile(six.Iterator):
             cpioinfo = next(self)
             if cpioinfo is None:
                 break
+        self._set_loaded()
+
+    def _set_loaded(self):
+        """Flag that all members have been read and write the member
+           index if a sidecar file is used.
+        """
         self._loaded = True
+        if self.index is not None:
+            self._write_index(self.index)
+
+    def _write_index(self, path):
+        """Write the member index to the sidecar file `path`, replacing
+           it atomically.
+        """
+        data = {
+            "version": INDEX_VERSION,
+            "archive": self._index_key(),
+            "offset": self.offset,
+            "members": [[getattr(cpioinfo, field) for field in INDEX_FIELDS]
+                        for cpioinfo in self.members],
+        }
+        tmp_path = path + ".tmp"
+        with bltn_open(tmp_path, "w") as f:
+            json.dump(data, f, separators=(",", ":"))
+        os.rename(tmp_path, path)
+
+    def _index_key(self):
+        """Return the identity of the archive file which is stored in the
+           member index: Its size, mtime and a hash of its first and last
+           INDEX_HASHSIZE bytes.
+        """
+        if self.name is None or not os.path.isfile(self.name):
+            raise ValueError("a member index needs an archive file")
+        statres = os.stat(self.name)
+        digest = hashlib.sha256()
+        with bltn_open(self.name, "rb") as f:
+            digest.update(f.read(INDEX_HASHSIZE))
+            if statres.st_size > INDEX_HASHSIZE:
+                f.seek(max(INDEX_HASHSIZE, statres.st_size - INDEX_HASHSIZE))
+                digest.update(f.read(INDEX_HASHSIZE))
+        return {"size": statres.st_size,
+                "mtime": statres.st_mtime,
+                "hash": digest.hexdigest()}
 
     def _check(self, mode=None):
         """Check if CpioFile is still open, and if the operation's mode
@@ -1844,7 +2980,7 @@ class CpioIter(six.Iterator):
         if not self.cpiofile._loaded:
             cpioinfo = next(self.cpiofile)
             if not cpioinfo:
-                self.cpiofile._loaded = True
+                self.cpiofile._set_loaded()
                 raise StopIteration
         else:
             try:
@@ -1854,6 +2990,240 @@ class CpioIter(six.Iterator):
         self.index += 1
         return cpioinfo
 
+#---------------------------------------------
+# Concatenated cpio archives (initrds)
+#---------------------------------------------
+SEGMENT_MAGIC = ((b"070701", "cpio"), (b"070702", "cpio"), (LZ4_LEGACY_MAGIC, "lz4")) + tuple(
+    (magic, comptype) for comptype, magic in COMPRESSION_MAGIC.items())
+MICROCODE_PREFIX = "kernel/x86/microcode/"  # early microcode updates
+
+class CpioSegment(object):
+    """Informational class which holds the details about one cpio archive
+       in a concatenated archive: Its offset and size in the file, its
+       compression and its members.
+    """
+
+    def __init__(self, offset, comptype):
+        self.offset = offset        # the (compressed) archive starts here
+        self.size = 0               # size in the file, without padding
+        self.comptype = comptype    # key of CpioFile.OPEN_METH
+        self.members = []           # type:list[CpioInfo]
+
+    def __repr__(self):
+        return "<%s %s at offset %d>" % (self.__class__.__name__,
+                                         self.comptype, self.offset)
+
+    def ismicrocode(self):
+        """Return True if this is an uncompressed early microcode archive
+           which the kernel reads before the rest of the initrd.
+        """
+        return self.comptype == "cpio" and any(
+            m.name.startswith(MICROCODE_PREFIX) for m in self.members)
+
+class InitrdFile(object):
+    """Reads concatenated cpio archives like initrds, which consist of
+       e.g. an uncompressed early microcode archive followed by the
+       compressed main archive: Each archive (segment) can have its own
+       compression, and like the kernel, the members of later segments
+       replace the members of earlier ones with the same name.
+
+       addsegment() appends a new segment to the file without rewriting
+       the existing ones, e.g. to add an overlay of patched files.
+    """
+
+    def __init__(self, name=None, mode="r", fileobj=None, bufsize=20*512):
+        # type:(str | None, str, Optional[IO[bytes]], int) -> None
+        """Open the initrd `name' or `fileobj' for reading (mode `r`) or
+           for appending segments (mode `a`). `fileobj' must be seekable
+           and is not closed when the InitrdFile is closed.
+        """
+        if mode not in ("r", "a"):
+            raise ValueError("mode must be 'r' or 'a'")
+        self._mode = mode
+        if fileobj is None:
+            assert name
+            fileobj = bltn_open(name, {"r": "rb", "a": "r+b"}[mode])
+            self._extfileobj = False
+        else:
+            self._extfileobj = True
+        self.name = name
+        self.fileobj = fileobj
+        self.bufsize = bufsize
+        self.closed = False
+        self.segments = []          # type:list[CpioSegment]
+        self.members = []           # type:list[CpioInfo]
+        self._names = {}            # type:dict[str, CpioInfo]
+        self._segment_of = {}       # type:dict[int, CpioSegment]
+        self._cpiofiles = {}        # type:dict[int, CpioFile]
+        self._end = 0               # end of the last segment read
+        self._loaded = False
+        try:
+            self._load()
+        except:
+            self.close()
+            raise
+
+    def close(self):
+        """Close the InitrdFile and the archives opened for its segments.
+        """
+        if self.closed:
+            return
+        for t in self._cpiofiles.values():
+            t.close()
+        if not self._extfileobj:
+            self.fileobj.close()
+        self.closed = True
+
+    def getsegments(self):
+        """Return the segments of the file as a list of CpioSegment objects.
+        """
+        self._load()
+        return self.segments
+
+    def getmembers(self):
+        """Return the members of all segments as a list of CpioInfo
+           objects, in the order of the file.
+        """
+        self._load()
+        return self.members
+
+    def getnames(self):
+        """Return the names of the members of all segments.
+        """
+        return [cpioinfo.name for cpioinfo in self.getmembers()]
+
+    def getmember(self, name):
+        # type:(str) -> CpioInfo
+        """Return the CpioInfo object of the last member `name' in the
+           file, as it replaces the earlier ones. Raise KeyError if it is
+           not found.
+        """
+        self._load()
+        cpioinfo = self._names.get(six.ensure_str(name))
+        if cpioinfo is None:
+            raise KeyError("filename %r not found" % name)
+        return cpioinfo
+
+    def getsegment(self, member):
+        # type:(CpioInfo) -> CpioSegment
+        """Return the segment which contains the CpioInfo object `member'.
+        """
+        return self._segment_of[id(member)]
+
+    def extractfile(self, member):
+        """Extract a member as a file object. `member' may be a filename
+           or a CpioInfo object. See CpioFile.extractfile().
+        """
+        if isinstance(member, CpioInfo):
+            cpioinfo = member
+        else:
+            cpioinfo = self.getmember(member)
+        segment = self.getsegment(cpioinfo)
+        return self._cpiofile(segment).extractfile(cpioinfo)
+
+    def addsegment(self, comptype="cpio"):
+        # type:(str) -> CpioFile
+        """Append a new segment with the compression `comptype' to the
+           file and return a CpioFile to add its members. It is written
+           as a stream, the existing segments are not changed. The new
+           segment is read after the returned CpioFile has been closed.
+        """
+        self._check("a")
+        self._load()
+        self.fileobj.seek(0, os.SEEK_END)
+        padding = -self.fileobj.tell() % WORDSIZE
+        self.fileobj.write(NUL * padding)  # cpio headers are word-aligned
+        self._loaded = False
+        t = CpioFile.open(fileobj=self.fileobj, mode="w|" + comptype,
+                          bufsize=self.bufsize)  # type: CpioFile
+        return t
+
+    #--------------------------------------------------------------------------
+    def _load(self):
+        """Read the segments following the last one read.
+        """
+        self._check()
+        while not self._loaded:
+            segment = self._next()
+            if segment is None:
+                self._loaded = True
+                break
+            self.segments.append(segment)
+            for cpioinfo in segment.members:
+                self.members.append(cpioinfo)
+                self._names[cpioinfo.name] = cpioinfo
+                self._segment_of[id(cpioinfo)] = segment
+
+    def _next(self):
+        """Read the next segment of the file, skipping the NUL padding
+           before it. Return None at the end of the file.
+        """
+        offset = self._end
+        while True:
+            self.fileobj.seek(offset)
+            buf = self.fileobj.read(BLOCKSIZE)
+            data = buf.lstrip(NUL)
+            offset += len(buf) - len(data)
+            if data or not buf:
+                break
+        if not data:
+            return None
+
+        for magic, comptype in SEGMENT_MAGIC:
+            if data.startswith(magic):
+                break
+        else:
+            raise ReadError("unknown data at offset %d" % offset)
+
+        segment = CpioSegment(offset, comptype)
+        fileobj = _SegmentFile(self.fileobj, offset)
+        if comptype == "cpio":
+            t = CpioFile(None, "r", cast(IO[bytes], fileobj))
+            segment.members = t.getmembers()
+            segment.size = t.offset
+            self._cpiofiles[offset] = t  # is seekable: use it for extracting
+        else:
+            stream = _Stream(None, "r", comptype, fileobj, self.bufsize,
+                             segment=True)
+            t = CpioFile(None, "r", cast(IO[bytes], stream))
+            segment.members = t.getmembers()
+            segment.size = fileobj.tell() - len(stream.unused())
+        self._end = offset + segment.size
+        return segment
+
+    def _cpiofile(self, segment):
+        # type:(CpioSegment) -> CpioFile
+        """Return a seekable CpioFile to extract the members of a segment.
+        """
+        t = self._cpiofiles.get(segment.offset)
+        if t is not None:
+            return t
+        fileobj = cast(IO[bytes], _SegmentFile(self.fileobj, segment.offset, segment.size))
+        if segment.comptype == "xz":
+            # xzopen() does not support fileobj
+            import lzma
+            t = CpioFile.cpioopen(None, "r", cast(IO[bytes], lzma.LZMAFile(fileobj)))
+            t._extfileobj = False
+        else:
+            t = CpioFile.open(fileobj=fileobj, mode="r:" + segment.comptype)
+        self._cpiofiles[segment.offset] = t
+        return t
+
+    def _check(self, mode=None):
+        """Check if InitrdFile is still open, and if the operation's mode
+           corresponds to InitrdFile's mode.
+        """
+        if self.closed:
+            raise IOError("%s is closed" % self.__class__.__name__)
+        if mode is not None and self._mode not in mode:
+            raise IOError("bad operation for mode %r" % self._mode)
+
+    def __iter__(self):
+        """Iterate over the members of all segments.
+        """
+        return iter(self.getmembers())
+# class InitrdFile
+
 #---------------------------------------------
 # zipfile compatible CpioFile class
 #---------------------------------------------
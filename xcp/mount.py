@@ -21,11 +21,14 @@
 # (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
+import atexit
 import os
 import os.path
 import tempfile
+import threading
 
 import xcp.cmd
+from xcp import logger
 
 class MountException(Exception):
     pass
@@ -86,3 +89,156 @@ class TempMount(object):
             self.mounted = False
         if os.path.isdir(self.mount_point):
             os.rmdir(self.mount_point)
+
+# Superblock signatures (offset, magic) of the filesystems of installation media:
+FS_SIGNATURES = [
+    ("iso9660", 0x8001, b"CD001"),
+    ("udf", 0x8001, b"BEA01"),
+    ("ext", 0x438, b"\x53\xef"),
+    ("vfat", 0x52, b"FAT32"),
+    ("vfat", 0x36, b"FAT1"),
+    ("xfs", 0, b"XFSB"),
+]
+
+def probe_fstype(device):
+    # type:(str) -> str | None
+    """Return the type of the filesystem on device from its superblock (like blkid), or None.
+    ext2, ext3 and ext4 are returned as "ext"."""
+    try:
+        with open(device, "rb") as dev:
+            head = dev.read(0x8006)
+    except (IOError, OSError):
+        return None
+    for fstype, offset, magic in FS_SIGNATURES:
+        if head[offset:offset + len(magic)] == magic:
+            return fstype
+    return None
+
+def order_fstypes(device, fstypes):
+    # type:(str, list[str]) -> list[str]
+    """Return the fstypes matching the probed filesystem of device, or all if none match"""
+    probed = probe_fstype(device)
+    if probed:
+        matching = [fs for fs in fstypes if fs == probed or fs.startswith(probed)]
+        if matching:
+            return matching
+    return fstypes
+
+class RegisteredMount(object):
+    def __init__(self, mountpoint):
+        # type:(str) -> None
+        self.mountpoint = mountpoint
+        self.refcount = 0
+        self.timer = None  # type: threading.Timer | None
+
+class MountRegistry(object):
+    """
+    Process-wide registry of the mounts of MountingAccessors, keyed by (source, options).
+
+    acquire() returns the mountpoint of an existing mount of the source or mounts it,
+    and release() unmounts it when the last user released it. When idle_grace is set,
+    an unused mount is kept for idle_grace seconds, so a following acquire() does not
+    need to mount the source again. flush() unmounts the unused mounts at exit.
+    """
+
+    idle_grace = 0.0
+    """Seconds to keep an unused mount before it is unmounted"""
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.mounts = {}  # type: dict[tuple[str, tuple[str, ...]], RegisteredMount]
+
+    @staticmethod
+    def _key(source, options):
+        # type:(str, list[str] | None) -> tuple[str, tuple[str, ...]]
+        return (source, tuple(options or ()))
+
+    def acquire(self, source, fstypes, options = None):
+        # type:(str, list[str], list[str] | None) -> str
+        """Return the mountpoint of source, mounting it with the first matching fstype"""
+        key = self._key(source, options)
+        with self.lock:
+            registered = self.mounts.get(key)
+            if not registered:
+                registered = RegisteredMount(self._mount(source, fstypes, options))
+                self.mounts[key] = registered
+            if registered.timer:
+                registered.timer.cancel()
+                registered.timer = None
+            registered.refcount += 1
+            return registered.mountpoint
+
+    @staticmethod
+    def _mount(source, fstypes, options):
+        # type:(str, list[str], list[str] | None) -> str
+        mountpoint = tempfile.mkdtemp(prefix="media-", dir="/tmp")
+        # try each filesystem in turn, starting with the probed filesystem type:
+        for fs in order_fstypes(source, fstypes):
+            opts = options
+            if fs == 'iso9660' and 'ro' not in (opts or []):
+                opts = (opts or []) + ['ro']
+            try:
+                mount(source, mountpoint, options = opts, fstype = fs)
+            except MountException:
+                continue
+            return mountpoint
+        os.rmdir(mountpoint)
+        raise MountException
+
+    def release(self, source, options = None):
+        # type:(str, list[str] | None) -> None
+        """Release a mount of acquire(), unmount it when it is (or stays) unused"""
+        key = self._key(source, options)
+        with self.lock:
+            registered = self.mounts.get(key)
+            if not registered or registered.refcount <= 0:
+                return  # e.g. after flush() at exit
+            registered.refcount -= 1
+            if registered.refcount > 0:
+                return
+            if self.idle_grace <= 0:
+                self._unmount(key)
+                return
+            registered.timer = threading.Timer(self.idle_grace, self._expire,
+                                               (key, registered))
+            registered.timer.daemon = True
+            registered.timer.start()
+
+    def _expire(self, key, registered):
+        # type:(tuple[str, tuple[str, ...]], RegisteredMount) -> None
+        try:
+            with self.lock:
+                if self.mounts.get(key) is registered and registered.refcount == 0:
+                    self._unmount(key)
+        except Exception as e:  # pylint: disable=broad-except  # in the Timer thread
+            logger.logException(e)
+
+    def _unmount(self, key):
+        # type:(tuple[str, tuple[str, ...]]) -> bool
+        """Unmount the mount of key. If umount fails (e.g. busy), it stays registered."""
+        registered = self.mounts[key]
+        if registered.timer:
+            registered.timer.cancel()
+            registered.timer = None
+        rc = umount(registered.mountpoint)
+        if rc != 0:
+            logger.error("Failed to unmount %s (rc %s), keeping it registered"
+                         % (registered.mountpoint, rc))
+            return False
+        del self.mounts[key]
+        try:
+            os.rmdir(registered.mountpoint)
+        except OSError as e:
+            logger.error("Failed to remove %s: %s" % (registered.mountpoint, e))
+        return True
+
+    def flush(self):
+        # type:() -> None
+        """Unmount all unused mounts"""
+        with self.lock:
+            for key, registered in list(self.mounts.items()):
+                if registered.refcount == 0:
+                    self._unmount(key)
+
+registry = MountRegistry()
+atexit.register(registry.flush)
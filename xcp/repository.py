@@ -21,23 +21,64 @@
 # (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
-from hashlib import md5
+import binascii
+import bz2
+import ftplib
+from collections import namedtuple
+from hashlib import md5, sha256
+import io
+import json
+import lzma
 import os.path
+import sys
+import tempfile
+import time
 import xml.dom.minidom
+import xml.etree.ElementTree as ET
+import zlib
 import configparser
-from typing import TYPE_CHECKING, Type
+from typing import TYPE_CHECKING, Any, Iterator, Type, TypeVar, cast
 
 import six
+from six.moves import http_client  # pyright: ignore
 
-from xcp import version, xmlunwrap
+from xcp import logger, version, xmlunwrap
+from xcp.accessor import CachingAccessor, VerifyingReader, copy_fileobj
 
 if TYPE_CHECKING:
     from xml.dom.minidom import Element  # pytype: disable=pyi-error
 
+T = TypeVar("T")
+
 class Package(object):          # pylint: disable=too-few-public-methods
+    __slots__ = ()  # allows subclasses with __slots__, the others have a __dict__
+
+    if TYPE_CHECKING:  # The attributes which are set by the subclasses:
+        repository = cast("BaseRepository", None)
+        filename = cast(str, None)
+
     def __init__(self, *args):
         pass
 
+    def open_verified(self, sha256=None):
+        """
+        Open the file of the package, verifying its size and md5sum (and the sha256
+        if passed) while it is read. At the end of the file, read() raises
+        xcp.accessor.ChecksumError if the file does not match. Returns False if
+        the file cannot be opened (see Accessor.openAddress()).
+        """
+        # pylint: disable=no-member  # The attributes are set by the subclasses
+        access = self.repository.access
+        address = os.path.join(self.repository.base, self.filename)
+        if isinstance(access, CachingAccessor):
+            fileobj = access.openAddress(address, self.md5sum)
+        else:
+            fileobj = access.openAddress(address)
+        if not fileobj:
+            return False
+        size = int(self.size) if self.size is not None else None
+        return io.BufferedReader(VerifyingReader(fileobj, self.md5sum, sha256, size, address))
+
 # pylint: disable=super-init-not-called
 class BzippedPackage(Package):
     def __init__(self, repository, label, size, md5sum, optional, fname, root):
@@ -111,23 +152,156 @@ class FirmwarePackage(Package):
     def __repr__(self):
         return "<FirmwarePackage '%s'>" % self.label
 
+class _SnapshotDigest(object):
+    """The md5sum of a repository which was loaded from a metadata snapshot"""
+    def __init__(self, hexdigest):
+        self._hexdigest = hexdigest
+
+    def hexdigest(self):
+        return self._hexdigest
+
+    def digest(self):
+        return binascii.unhexlify(self._hexdigest)
+
+class YumPackage(Package):
+    """An RPM package of a Yum repository, as listed in its primary.xml"""
+    __slots__ = ("repository", "name", "epoch", "version", "release", "arch", "size",
+                 "checksum_type", "checksum", "filename")
+
+    def __init__(self, repository, name, epoch, version, release, arch, size,
+                 checksum_type, checksum, fname):
+        (
+            self.repository,
+            self.name,
+            self.epoch,
+            self.version,
+            self.release,
+            self.arch,
+            self.size,
+            self.checksum_type,
+            self.checksum,
+            self.filename
+        ) = (repository, name, epoch, version, release, arch, size, checksum_type, checksum,
+             fname)
+
+    @property
+    def label(self):
+        return self.name
+
+    @property
+    def md5sum(self):
+        return self.checksum if self.checksum_type == "md5" else None
+
+    @property
+    def nevra(self):
+        """Return name-[epoch:]version-release.arch, the epoch is omitted if it is 0"""
+        epoch = "" if self.epoch in ("", "0") else self.epoch + ":"
+        return "%s-%s%s-%s.%s" % (self.name, epoch, self.version, self.release, self.arch)
+
+    def open_verified(self, sha256=None):
+        if self.checksum_type == "sha256":
+            sha256 = sha256 or self.checksum
+        return super(YumPackage, self).open_verified(sha256)
+
+    def __repr__(self):
+        return "<YumPackage '%s'>" % self.nevra
+
+def _required(value, name):
+    # type: (T | None, str) -> T
+    """Return the value of an element or attribute, raise ValueError if it is missing"""
+    if value is None:
+        raise ValueError("%s is missing" % name)
+    return value
+
+RepomdData = namedtuple("RepomdData", ["location", "checksum_type", "checksum", "size"])
+"""Entry of repomd.xml for a metadata file of a Yum repository, e.g. primary.xml.gz"""
+
+class _Decompressor(object):
+    """
+    Decompressor of the concatenated compressed streams of a metadata file, e.g.
+    primary.xml.gz, by the extension of its name. Unlike the decompressing file
+    objects, it separates the errors of reading the file from the errors of its
+    data: decompress() and finish() raise RepoFormatError if the data is corrupt.
+    """
+
+    def __init__(self, name):
+        # type: (str) -> None
+        self.name = name
+        if name.endswith(".gz"):
+            self.factory = lambda: zlib.decompressobj(16 + zlib.MAX_WBITS)  # type: Any
+        elif name.endswith(".bz2"):
+            self.factory = bz2.BZ2Decompressor
+        elif name.endswith(".xz"):
+            self.factory = lzma.LZMADecompressor
+        elif name.endswith(".zst"):
+            try:
+                import zstandard
+            except ImportError:
+                raise RepoFormatError("zstandard module is not available to read %s" % name)
+            self.factory = zstandard.ZstdDecompressor().decompressobj
+        elif name.endswith(".xml"):
+            self.factory = None
+        else:
+            raise RepoFormatError("Unsupported compression of %s" % name)
+        self.decompressor = self.factory() if self.factory else None
+        self.started = False  # whether the current stream got data
+
+    def decompress(self, data):
+        # type: (bytes) -> bytes
+        """Return the decompressed data of the next chunk of the file"""
+        if self.decompressor is None:
+            return data
+        chunks = []
+        try:
+            while data:
+                self.started = True
+                chunks.append(self.decompressor.decompress(data))
+                if not self.decompressor.eof:
+                    break
+                data = self.decompressor.unused_data  # the next stream
+                self.decompressor = self.factory()
+                self.started = False
+        except Exception as e:  # pylint: disable=broad-except  # zstandard.ZstdError, etc
+            six.raise_from(RepoFormatError("%s: %s" % (self.name, e)), e)
+        return b"".join(chunks)
+
+    def finish(self):
+        # type: () -> None
+        """Raise RepoFormatError if the file ended within a compressed stream"""
+        if self.decompressor is not None and self.started and not self.decompressor.eof:
+            raise RepoFormatError("%s: compressed data ended unexpectedly" % self.name)
+
 class NoRepository(Exception):
     pass
 
 class RepoFormatError(Exception):
     pass
 
+class FetchError(Exception):
+    pass
+
+FETCH_TRANSIENT_ERRORS = ftplib.all_errors + (http_client.HTTPException,)
+"""Errors of reading packages (incl. IOError and OSError) which BaseRepository.fetch() retries"""
+
+FetchStats = namedtuple("FetchStats", ["packages", "bytes", "seconds"])
+"""Result of BaseRepository.fetch(): the number of packages and bytes and the duration"""
+
 class BaseRepository(object):
     """ Represents a repository containing packages and associated meta data. """
+    # Seconds to wait before the first retry of fetch(), doubled for each further retry:
+    fetch_retry_delay = 1.0
+    # Errors of Accessor.openAddress() which are not retried by fetch():
+    FETCH_PERMANENT_ERRORS = (401, 403, 404)
+
     def __init__(self, access, base = ""):
         self.access = access
         self.base = base
 
     @classmethod
-    def findRepositories(cls, access):
+    def findRepositories(cls, access, workers = 1):
         repos = YumRepository.findRepositories(access)
         try:
-            repos += Repository.findRepositories(access)
+            repos += Repository.findRepositories(access, workers)
         except RepoFormatError:
             pass
         return repos
@@ -151,6 +325,77 @@ class BaseRepository(object):
             return YumRepository.getProductVersion(access)
         return None
 
+    def fetch(self, packages, dest_dir, workers = 1, retries = 3):
+        """
+        Download packages to their file names in dest_dir and return the FetchStats.
+
+        The size and checksums of each package are verified while it is written (see
+        Package.open_verified()). Failed downloads are retried, except for missing
+        files, before FetchError is raised. With workers > 1 (and a threadsafe
+        accessor), the packages are downloaded concurrently, the largest first
+        so that the small packages fill the gaps at the end.
+        """
+        jobs = sorted(packages, key=lambda pkg: int(pkg.size or 0), reverse=True)
+        start = time.time()
+        self.access.start()
+        try:
+            if workers > 1 and getattr(self.access, "threadsafe", False):
+                from concurrent.futures import ThreadPoolExecutor
+
+                with ThreadPoolExecutor(workers) as executor:
+                    sizes = list(executor.map(
+                        lambda pkg: self._fetch_package(pkg, dest_dir, retries), jobs))
+            else:
+                sizes = [self._fetch_package(pkg, dest_dir, retries) for pkg in jobs]
+        finally:
+            self.access.finish()
+        stats = FetchStats(len(sizes), sum(sizes), time.time() - start)
+        logger.info("Fetched %d packages (%d bytes) in %.3fs (%.1f MiB/s)"
+                    % (stats.packages, stats.bytes, stats.seconds,
+                       stats.bytes / max(stats.seconds, 1e-6) / 1024 / 1024))
+        return stats
+
+    def _fetch_package(self, pkg, dest_dir, retries):
+        # type: (Package, str, int) -> int
+        """Download and verify pkg to dest_dir, return its size"""
+        filename = os.path.normpath(pkg.filename)
+        if os.path.isabs(filename) or filename.startswith(os.pardir):
+            raise RepoFormatError("Invalid package file name %s" % filename)
+        path = os.path.join(dest_dir, filename)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        part = path + ".part"
+        error = None  # type: Exception | None
+        try:
+            for attempt in range(retries + 1):
+                if attempt:
+                    logger.info("Retrying %s after: %s" % (filename, error))
+                    time.sleep(self.fetch_retry_delay * 2 ** (attempt - 1))
+                try:
+                    fileobj = pkg.open_verified()
+                    if not fileobj:
+                        # lastError may be set by the other workers of fetch() meanwhile:
+                        last_error = pkg.repository.access.threadLastError
+                        error = IOError("Failed to open %s: error %s" % (filename, last_error))
+                        if last_error in self.FETCH_PERMANENT_ERRORS:
+                            break
+                        continue
+                    with fileobj, open(part, "wb") as out_fh:
+                        size = copy_fileobj(fileobj, out_fh)
+                    os.rename(part, path)
+                    return size
+                except ftplib.error_perm as e:  # e.g. 550 No such file: not retried
+                    error = e
+                    break
+                except FETCH_TRANSIENT_ERRORS as e:  # ChecksumError is an IOError
+                    error = e
+        finally:
+            if os.path.exists(part):
+                os.remove(part)
+        fetch_error = FetchError("Failed to fetch %s: %s" % (filename, error))
+        six.raise_from(fetch_error, error)
+        raise fetch_error  # not reached, for the type checkers
+
 class YumRepository(BaseRepository):
     """ Represents a Yum repository containing packages and associated meta data. """
     REPOMD_FILENAME = "repodata/repomd.xml"
@@ -165,8 +410,158 @@ class YumRepository(BaseRepository):
             return []
         return [ YumRepository(access, "") ]
 
+    REPO_NS = "{http://linux.duke.edu/metadata/repo}"
+    COMMON_NS = "{http://linux.duke.edu/metadata/common}"
+    RPM_NS = "{http://linux.duke.edu/metadata/rpm}"
+
     def __init__(self, access, base = ""):
         BaseRepository.__init__(self, access, base)
+        self.packages = []  # type: list[YumPackage]
+        self.packages_loaded = False
+        self._by_name = {}  # type: dict[str, list[YumPackage]]
+        self._provides = {}  # type: dict[str, list[YumPackage]]
+
+    def read_repomd(self):
+        # type: () -> dict[str, RepomdData]
+        """Return the entries of repodata/repomd.xml by their data type, e.g. "primary" """
+        self.access.start()
+        try:
+            repomd = self.access.openAddress(os.path.join(self.base, self.REPOMD_FILENAME))
+            if not repomd:
+                raise NoRepository()
+            with repomd:
+                root = ET.parse(repomd).getroot()
+            entries = {}  # type: dict[str, RepomdData]
+            for data in root.iterfind(self.REPO_NS + "data"):
+                checksum = data.find(self.REPO_NS + "checksum")
+                size = data.findtext(self.REPO_NS + "size")
+                entries[_required(data.get("type"), "data type")] = RepomdData(
+                    _required(data.find(self.REPO_NS + "location"), "location").get("href"),
+                    checksum.get("type") if checksum is not None else None,
+                    (checksum.text or "").strip() if checksum is not None else None,
+                    int(size) if size else None,
+                )
+        except (ET.ParseError, AttributeError, ValueError) as e:
+            six.raise_from(RepoFormatError("%s format error" % self.REPOMD_FILENAME), e)
+        finally:
+            self.access.finish()
+        return entries
+
+    def iter_packages(self):
+        """
+        Return an iterator of the packages of the repository. Unless they were already
+        read, primary.xml is parsed while it is read and decompressed, and its checksum
+        from repomd.xml is verified. At the end, the packages are indexed for
+        find_packages() and what_provides().
+        """
+        if self.packages_loaded:
+            return iter(self.packages)
+        primary = self.read_repomd().get("primary")
+        if primary is None:
+            raise RepoFormatError("%s has no primary data" % self.REPOMD_FILENAME)
+        return self._iterparse_primary(primary)
+
+    def _iterparse_primary(self, primary_data):
+        # type: (RepomdData) -> Iterator[YumPackage]
+        """
+        Parse the compressed primary.xml while it is read and verified, yielding its
+        packages. The accessor is kept started until the file is parsed or the
+        iterator is closed.
+        """
+        location = primary_data.location
+        packages = []
+        by_name = {}  # type: dict[str, list[YumPackage]]
+        provides = {}  # type: dict[str, list[YumPackage]]
+        parser = ET.XMLPullParser(events=("start", "end"))
+        root = None  # type: ET.Element | None
+        self.access.start()
+        try:
+            fileobj = self.access.openAddress(os.path.join(self.base, location))
+            if not fileobj:
+                raise NoRepository()
+            sha256 = primary_data.checksum if primary_data.checksum_type == "sha256" else None
+            verified = io.BufferedReader(VerifyingReader(fileobj, None, sha256,
+                                                         primary_data.size, location))
+            decompressor = _Decompressor(location)
+            with verified:
+                while True:
+                    data = verified.read(64 * 1024)
+                    if data:
+                        parser.feed(decompressor.decompress(data))
+                    else:
+                        decompressor.finish()
+                        parser.close()
+                    # Only the start and end events of elements were requested:
+                    events = cast("Iterator[tuple[str, ET.Element]]", parser.read_events())
+                    for event, elem in events:
+                        if root is None:
+                            root = elem
+                        if event != "end" or elem.tag != self.COMMON_NS + "package":
+                            continue
+                        pkg, capabilities = self._new_yum_package(elem)
+                        root.clear()  # Free the parsed elements
+                        packages.append(pkg)
+                        by_name.setdefault(pkg.name, []).append(pkg)
+                        for capability in capabilities:
+                            provides.setdefault(capability, []).append(pkg)
+                        yield pkg
+                    if not data:
+                        break
+        except ET.ParseError as e:
+            six.raise_from(RepoFormatError("%s format error" % location), e)
+        finally:
+            self.access.finish()
+        self.packages = packages
+        self._by_name = by_name
+        self._provides = provides
+        self.packages_loaded = True
+
+    def _new_yum_package(self, elem):
+        # type: (ET.Element) -> tuple[YumPackage, list[str]]
+        """Return the YumPackage and the capabilities it provides for a package element"""
+        common, rpm = self.COMMON_NS, self.RPM_NS
+        try:
+            version_elem = _required(elem.find(common + "version"), "version")
+            checksum = _required(elem.find(common + "checksum"), "checksum")
+            pkg = YumPackage(
+                self,
+                elem.findtext(common + "name"),
+                sys.intern(version_elem.get("epoch", "0")),
+                version_elem.get("ver"),
+                version_elem.get("rel"),
+                sys.intern(_required(elem.findtext(common + "arch"), "arch")),
+                int(_required(elem.find(common + "size"), "size").get("package", "")),
+                sys.intern(_required(checksum.get("type"), "checksum type")),
+                (checksum.text or "").strip(),
+                _required(elem.find(common + "location"), "location").get("href"),
+            )
+        except ValueError as e:
+            six.raise_from(RepoFormatError("primary.xml: invalid package"), e)
+        capabilities = [entry.get("name") for entry in elem.iterfind(
+            "%sformat/%sprovides/%sentry" % (common, rpm, rpm))]
+        capabilities += [path.text for path in elem.iterfind(
+            "%sformat/%sfile" % (common, common))]
+        return pkg, [capability for capability in capabilities if capability]
+
+    def _load_packages(self):
+        if not self.packages_loaded:
+            for _ in self.iter_packages():
+                pass
+
+    def find_packages(self, name):
+        # type: (str) -> list[YumPackage]
+        """Return the packages of the repository named name, reading them if needed"""
+        self._load_packages()
+        return list(self._by_name.get(name, []))
+
+    def what_provides(self, capability):
+        # type: (str) -> list[YumPackage]
+        """
+        Return the packages which provide capability (by its name, regardless of
+        its version) or the file path capability listed in primary.xml.
+        """
+        self._load_packages()
+        return list(self._provides.get(capability, []))
 
     @classmethod
     def isRepo(cls, access, base):
@@ -222,12 +617,22 @@ class Repository(BaseRepository):
 
     OPER_MAP = {'eq': ' = ', 'ne': ' != ', 'lt': ' < ', 'gt': ' > ', 'le': ' <= ', 'ge': ' >= '}
 
+    # Directory for snapshots of the parsed repository metadata, None disables them.
+    # See _load_snapshot() for the details.
+    snapshot_dir = None  # type: str | None
+    SNAPSHOT_ATTRS = ('originator', 'name', 'product', 'version', 'build', 'description',
+                      'requires')
+
     @classmethod
-    def findRepositories(cls, access):
+    def findRepositories(cls, access, workers = 1):
+        """
+        Return the repositories found at the known locations and the locations listed
+        in XS-REPOSITORY-LIST. With workers > 1 (and a threadsafe accessor), the
+        locations are probed and the repositories are read by a pool of workers.
+        """
         # Check known locations:
         package_list = ['', 'packages', 'packages.main', 'packages.linux',
                         'packages.site']
-        repos = []
 
         access.start()
         try:
@@ -240,15 +645,38 @@ class Repository(BaseRepository):
             six.raise_from(RepoFormatError("Failed to open %s: %s" %
                                            (cls.REPOLIST_FILENAME, str(e))), e)
 
-        for loc in package_list:
-            if cls.isRepo(access, loc):
-                repos.append(Repository(access, loc))
-        access.finish()
-        return repos
+        try:
+            if workers > 1 and getattr(access, "threadsafe", False):
+                return cls._findRepositoriesConcurrently(access, package_list, workers)
+            repos = []
+            for loc in package_list:
+                if cls.isRepo(access, loc):
+                    repos.append(Repository(access, loc))
+            return repos
+        finally:
+            access.finish()
 
-    def __init__(self, access, base, is_group = False):
+    @classmethod
+    def _findRepositoriesConcurrently(cls, access, package_list, workers):
+        """Probe all files of all locations at once, then read the found repositories"""
+        from concurrent.futures import ThreadPoolExecutor
+
+        repo_files = [cls.REPOSITORY_FILENAME, cls.PKGDATA_FILENAME]
+        with ThreadPoolExecutor(workers) as executor:
+            probes = [executor.submit(access.access, os.path.join(loc, name))
+                      for loc in package_list for name in repo_files]
+            found = [loc for i, loc in enumerate(package_list)
+                     if all(probe.result() for probe in probes[2 * i:2 * i + 2])]
+            return list(executor.map(lambda loc: Repository(access, loc), found))
+
+    def __init__(self, access, base, is_group = False, lazy = False):
+        """
+        Read the XS-REPOSITORY and XS-PACKAGES files of the repository at base.
+        If lazy is set, XS-PACKAGES is read by iter_packages() instead.
+        """
         BaseRepository.__init__(self, access, base)
         self.is_group = is_group
+        self.packages_loaded = False
         self._md5 = md5()
         self.requires = []
         self.packages = []
@@ -256,9 +684,14 @@ class Repository(BaseRepository):
         self.version = ""
         self.build = ""
         self.originator = ""
+        self._validators = None  # type: list[list[object]] | None
 
         access.start()
 
+        if self.snapshot_dir and self._load_snapshot(self.snapshot_dir):
+            access.finish()
+            return
+
         try:
             repofile = access.openAddress(os.path.join(base, self.REPOSITORY_FILENAME))
         except Exception as e:
@@ -267,13 +700,14 @@ class Repository(BaseRepository):
         self._parse_repofile(repofile)
         repofile.close()
 
-        try:
-            pkgfile = access.openAddress(os.path.join(base, self.PKGDATA_FILENAME))
-        except Exception as e:
-            access.finish()
-            six.raise_from(NoRepository(), e)
-        self._parse_packages(pkgfile)
-        pkgfile.close()
+        if not lazy:
+            try:
+                pkgfile = access.openAddress(os.path.join(base, self.PKGDATA_FILENAME))
+            except Exception as e:
+                access.finish()
+                six.raise_from(NoRepository(), e)
+            self._parse_packages(pkgfile)
+            pkgfile.close()
 
         access.finish()
 
@@ -327,6 +761,9 @@ class Repository(BaseRepository):
         except Exception as e:
             six.raise_from(RepoFormatError("%s format error" % self.REPOSITORY_FILENAME), e)
 
+        self._set_product_version()
+
+    def _set_product_version(self):
         self.identifier = "%s:%s" % (self.originator, self.name)
         ver_str = self.version
         if self.build:
@@ -334,21 +771,149 @@ class Repository(BaseRepository):
         self.product_version = version.Version.from_string(ver_str)
 
     def _parse_packages(self, pkgfile):
-        pkgfile_contents = pkgfile.read()
-        pkgfile.close()
+        self.packages = list(self._iterparse_packages(pkgfile))
 
-        # update md5sum for repo
-        self._md5.update(pkgfile_contents)
-
-        # build xml doc object
+    def _iterparse_packages(self, pkgfile=None):
+        """
+        Parse XS-PACKAGES from pkgfile while it is read, yielding the packages.
+        When pkgfile is parsed to the end, the packages are stored in self.packages
+        and the md5sum of the repository is updated with the contents of pkgfile.
+        If pkgfile is None, XS-PACKAGES is opened using the accessor, which is kept
+        started until the file is parsed or the iterator is closed.
+        """
+        md5sum = self._md5.copy()
+        packages = []
+        parser = ET.XMLPullParser(events=("start", "end"))
+        root = None
+        started = pkgfile is None
+        if started:
+            self.access.start()
         try:
-            xmldoc = xml.dom.minidom.parseString(pkgfile_contents)  # pytype: disable=pyi-error
-        except Exception as e:
+            if started:
+                if self.snapshot_dir:
+                    self._validators = self._snapshot_validators()
+                pkgfile = self.access.openAddress(os.path.join(self.base, self.PKGDATA_FILENAME))
+                if not pkgfile:
+                    raise NoRepository()
+            while True:
+                data = pkgfile.read(64 * 1024)
+                if data:
+                    md5sum.update(data)
+                    parser.feed(data)
+                else:
+                    parser.close()
+                for event, elem in parser.read_events():
+                    if root is None:
+                        root = elem
+                    if event != "end" or elem.tag != "package":
+                        continue
+                    text = (elem.text or "") + "".join(child.tail or "" for child in elem)
+                    pkg = self._new_package(elem.attrib, text.strip())
+                    root.clear()  # Free the parsed elements
+                    packages.append(pkg)
+                    yield pkg
+                if not data:
+                    break
+        except ET.ParseError as e:
             six.raise_from(RepoFormatError("%s not in XML" % self.PKGDATA_FILENAME), e)
-
-        for pkg_node in xmlunwrap.getElementsByTagName(xmldoc, ['package']):
-            pkg = self._create_package(pkg_node)
-            self.packages.append(pkg)
+        finally:
+            if pkgfile:
+                pkgfile.close()
+            if started:
+                self.access.finish()
+        self._md5 = md5sum
+        self.packages = packages
+        self.packages_loaded = True
+        if self._validators and self.snapshot_dir:
+            self._save_snapshot(self.snapshot_dir)
+
+    def iter_packages(self):
+        """
+        Return an iterator of the packages of the repository. If the repository
+        was created with lazy=True, XS-PACKAGES is read and parsed while iterating.
+        """
+        if self.packages_loaded:
+            return iter(self.packages)
+        return self._iterparse_packages()
+
+    def _snapshot_validators(self):
+        # type: () -> list[list[object]] | None
+        """Return the size, mtime and ETag of the metadata files, None if they are unknown"""
+        validators = []
+        for name in (self.REPOSITORY_FILENAME, self.PKGDATA_FILENAME):
+            info = self.access.stat(os.path.join(self.base, name))
+            if not info.exists or (info.etag is None and info.mtime is None):
+                return None
+            validators.append([info.size, info.mtime, info.etag])
+        return validators
+
+    def _snapshot_index(self, snapshot_dir):
+        # type: (str) -> str
+        """Return the path of the snapshot index of the source of the repository"""
+        key = "%r\0%s" % (self.access, self.base)
+        return os.path.join(snapshot_dir, "repo-%s.json" % sha256(key.encode()).hexdigest())
+
+    def _load_snapshot(self, snapshot_dir):
+        # type: (str) -> bool
+        """
+        Load the repository metadata from a snapshot in snapshot_dir, return whether
+        it was loaded.
+
+        The snapshots are stored under the md5sum of XS-REPOSITORY and XS-PACKAGES,
+        and for each source (the accessor and base), an index file records the md5sum
+        and the size, mtime and ETag of both files. The snapshot is used when stat()
+        returns the same validators as when it was saved, so HEAD requests replace
+        downloading and parsing the metadata files.
+        """
+        self._validators = self._snapshot_validators()
+        if not self._validators:
+            return False
+        try:
+            with open(self._snapshot_index(snapshot_dir)) as index_file:
+                index = json.load(index_file)
+            if index["validators"] != self._validators:
+                return False
+            path = os.path.join(snapshot_dir, "md5-%s.json" % index["md5"])
+            with open(path) as snapshot_file:
+                snapshot = json.load(snapshot_file)
+            classes = dict((cls.__name__, cls) for cls, _ in self.constructor_map.values())
+            packages = []
+            for class_name, attributes in snapshot["packages"]:
+                pkg = classes[class_name].__new__(classes[class_name])
+                pkg.__dict__.update(attributes, repository=self)
+                packages.append(pkg)
+            for attr in self.SNAPSHOT_ATTRS:
+                setattr(self, attr, snapshot[attr])
+        except (IOError, OSError, ValueError, KeyError, TypeError):
+            return False
+        self._set_product_version()
+        self._md5 = _SnapshotDigest(index["md5"])
+        self.packages = packages
+        self.packages_loaded = True
+        return True
+
+    def _save_snapshot(self, snapshot_dir):
+        # type: (str) -> None
+        """Save the repository metadata and its validators for _load_snapshot()"""
+        md5sum = self._md5.hexdigest()
+        snapshot = dict((attr, getattr(self, attr)) for attr in self.SNAPSHOT_ATTRS)
+        snapshot["packages"] = [
+            (type(pkg).__name__, dict((k, v) for k, v in vars(pkg).items() if k != "repository"))
+            for pkg in self.packages
+        ]
+        index = {"validators": self._validators, "md5": md5sum}
+        try:
+            if not os.path.isdir(snapshot_dir):
+                os.makedirs(snapshot_dir)
+            for path, data in ((os.path.join(snapshot_dir, "md5-%s.json" % md5sum), snapshot),
+                               (self._snapshot_index(snapshot_dir), index)):
+                tmp = tempfile.NamedTemporaryFile("w", dir=snapshot_dir, prefix=".tmp-",
+                                                  delete=False)
+                with tmp:
+                    json.dump(data, tmp, separators=(",", ":"))
+                os.rename(tmp.name, path)
+        except (IOError, OSError, TypeError, ValueError) as e:
+            logger.info("Failed to save the metadata snapshot of %s: %s" % (self.base, e))
 
     # Dictionary to map file extensions to tuples containing a class and a tuple of attribute names.
     # _create_package() uses it to instantiate package objects for packages of these classes.
@@ -373,19 +938,25 @@ class Repository(BaseRepository):
         :param node: An XML element for package of a certain type with associated attributes
         :return: New instance of the corresponding `Package` class
         """
+        return self._new_package(dict(node.attributes.items()), xmlunwrap.getText(node))
+
+    def _new_package(self, attributes, text):
+        # type:(dict[str, str], str) -> Package
+        """Return a package object for the attributes and the text of a package element"""
+        if attributes.get('type', '') == '':
+            raise xmlunwrap.XmlUnwrapError("Missing mandatory attribute type")
+        constructor, attrs = self.constructor_map[attributes['type']]
         args = [ self ]  # type: list[Repository | str | None]
-        ptype = xmlunwrap.getStrAttribute(node, ['type'], mandatory = True)
-        assert ptype  #  Static analyis doesn't know that mandatory=True means raise() if not found
-        for attr in self.constructor_map[ptype][1]:
+        for attr in attrs:
             if attr == 'fname':
-                args.append(xmlunwrap.getText(node))
+                args.append(text)
+            elif attributes.get(attr, '') != '':
+                args.append(attributes[attr])
+            elif attr in self.optional_attrs:
+                args.append('')
             else:
-                args.append(
-                    xmlunwrap.getStrAttribute(
-                        node, [attr], mandatory=attr not in self.optional_attrs
-                    )
-                )
-        return self.constructor_map[ptype][0](*args)
+                raise xmlunwrap.XmlUnwrapError("Missing mandatory attribute %s" % attr)
+        return constructor(*args)
 
     @classmethod
     def isRepo(cls, access, base):